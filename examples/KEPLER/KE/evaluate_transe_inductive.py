@@ -8,12 +8,14 @@ import numpy as np
 import json
 import pickle
 from tqdm import tqdm
+from fairseq.ke_embedding_cache import load_entity_embeddings
 
 def main():
     print(gv.__file__)
     print(gap.__file__)
     parser = argparse.ArgumentParser()
-    parser.add_argument('--entity_embeddings', help='numpy of entity embeddings')
+    parser.add_argument('--entity_embeddings', help='numpy of entity embeddings, or the checkpoint (or its embedding cache directory) with --entity_rows')
+    parser.add_argument('--entity_rows', help='numpy of the cache row of every entity, written by generate_embeddings.py --cache')
     parser.add_argument('--relation_embeddings', help='numpy of relation embeddings')
     parser.add_argument('--entity2id', help='entity name to numpy id json')
     parser.add_argument('--relation2id', help='entity name to numpy id json')
@@ -32,9 +34,9 @@ def main():
     gv_relation2id = app.graph.relation2id
 
     # Load embeddings (Only load the embeddings that appear in the entity2id file)
-    entity_embeddings_full = np.load(args.entity_embeddings)
+    entity_embeddings_full, rows = load_entity_embeddings(args.entity_embeddings, args.entity_rows)
     relation_embeddings_full = np.load(args.relation_embeddings)
-    entity2id_ori = json.load(open(args.entity2id))
+    entity2id_ori = {key: int(rows[i]) for key, i in json.load(open(args.entity2id)).items()}
     relation2id_ori = json.load(open(args.relation2id))
 
     entity_embeddings = np.zeros((len(gv_entity2id), args.dim), dtype=np.float32) 
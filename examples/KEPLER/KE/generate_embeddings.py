@@ -1,6 +1,9 @@
 import numpy as np
 import os
+import json
 import argparse
+import torch
+from fairseq.ke_embedding_cache import KeEmbeddingCache, description_hash
 from fairseq.models.roberta import RobertaModel
 from fairseq.data import (
     data_utils,
@@ -17,6 +20,10 @@ parser.add_argument("--dict", type=str, help="path to the dict.txt file", defaul
 parser.add_argument("--ent_emb", type=str, default="EntityEmb.npy", help="filename to dump entity embeddings (in numpy format)")
 parser.add_argument("--rel_emb", type=str, default="RelEmb.npy", help="filename to dump relation embeddings (in numpy format)")
 parser.add_argument("--batch_size", type=int, default=64, help="batch size used in the inference")
+parser.add_argument("--max_tokens", type=int, default=None, help="if set, sort the entities by length and batch them by this token budget (padding included) instead of --batch_size")
+parser.add_argument("--resume", action="store_true", help="continue an interrupted export after its last completed batch")
+parser.add_argument("--cache", action="store_true", help="only encode the descriptions missing from the embedding cache of the checkpoint (<ckpt_dir>/emb_cache) and write --ent_rows instead of --ent_emb")
+parser.add_argument("--ent_rows", type=str, default="EntityRows.npy", help="filename to dump the cache row of every entity (with --cache)")
 
 def desc_dataset(path, dictionary):
     now_path=path
@@ -31,6 +38,65 @@ def desc_dataset(path, dictionary):
     dataset = RightPadDataset(dataset, pad_idx=1)
     return dataset
 
+def get_batches(desc, args, indices=None):
+    if indices is None:
+        indices = np.arange(len(desc))
+    if args.max_tokens is None or len(indices) == 0:
+        return [indices[s:s+args.batch_size] for s in range(0, len(indices), args.batch_size)]
+    sizes = desc.sizes
+    indices = indices[np.argsort(sizes[indices], kind="mergesort")]
+    return data_utils.batch_by_size(indices, lambda i: sizes[i], max_tokens=max(args.max_tokens, sizes[indices].max()))
+
+def encode(roberta, desc, ids):
+    datas = [desc[int(x)] for x in ids]
+    return roberta.extract_features(desc.collater(datas))[:,0,:].float().cpu().numpy()
+
+def update_cache(roberta, desc, args):
+    """Encode the descriptions missing from the cache and return the cache row of every entity."""
+    cache = KeEmbeddingCache.for_checkpoint(os.path.join(args.ckpt_dir, args.ckpt), roberta.model.args.encoder_embed_dim)
+    keys = np.array([description_hash(desc[i]) for i in range(len(desc))], dtype=np.uint64)
+    missing = cache.lookup(keys) < 0
+    num_cached = len(desc) - int(missing.sum())
+    # entities with the same description share one row
+    _, first = np.unique(keys[missing], return_index=True)
+    missing = np.nonzero(missing)[0][first]
+    print("| {} of {} descriptions are cached in {}, encoding {}".format(num_cached, len(desc), cache.path, len(missing)))
+    with torch.no_grad():
+        for ids in get_batches(desc, args, missing):
+            # an interrupted run keeps every batch appended so far
+            cache.append(keys[ids], encode(roberta, desc, ids))
+    return cache.lookup(keys)
+
+def export_embeddings(roberta, desc, args):
+    """Write the embeddings to a memory-mapped .npy file at their entity ids,
+    batch by batch, so they never have to fit into memory."""
+    batches = get_batches(desc, args)
+    shape = (len(desc), roberta.model.args.encoder_embed_dim)
+    progress_path = args.ent_emb+".progress"
+    progress = {"num_entities": len(desc), "batch_size": args.batch_size, "max_tokens": args.max_tokens, "batches": 0}
+    if args.resume and os.path.exists(progress_path):
+        with open(progress_path, "r") as f:
+            done = json.load(f)
+        assert all(done[k] == progress[k] for k in progress if k != "batches"), \
+            "cannot resume {} with different data or batching".format(args.ent_emb)
+        progress["batches"] = done["batches"]
+        entity_embs = np.lib.format.open_memmap(args.ent_emb, mode="r+")
+        assert entity_embs.shape == shape
+        print("| resuming after {} of {} batches".format(progress["batches"], len(batches)))
+    else:
+        entity_embs = np.lib.format.open_memmap(args.ent_emb, mode="w+", dtype=np.float32, shape=shape)
+
+    with torch.no_grad():
+        for i in range(progress["batches"], len(batches)):
+            ids = batches[i]
+            entity_embs[ids] = encode(roberta, desc, ids)
+            entity_embs.flush()
+            progress["batches"] = i+1
+            with open(progress_path, "w") as f:
+                json.dump(progress, f)
+    del entity_embs
+    os.remove(progress_path)
+
 if __name__=='__main__':
     args = parser.parse_args()
     dictionary = Dictionary.load(args.dict)
@@ -38,14 +104,8 @@ if __name__=='__main__':
     roberta = RobertaModel.from_pretrained(args.ckpt_dir, checkpoint_file = args.ckpt)
     roberta.eval()
     np.save(args.rel_emb, roberta.model.ke_heads['acl'].relation_emb.weight.cpu().detach().numpy())
-    entity_embs=[]
-    for i in range(0, len(desc)//args.batch_size+1):
-        s = i*args.batch_size
-        t = min((i+1)*args.batch_size, len(desc))
-        if s >= len(desc):
-            continue
-        datas = [desc[x] for x in range(s,t)]
-        embs = roberta.extract_features(desc.collater(datas))[:,0,:]
-        entity_embs.append(embs.cpu().detach().numpy())
-    a = np.concatenate(entity_embs, axis=0)
-    np.save(args.ent_emb, a)
+
+    if args.cache:
+        np.save(args.ent_rows, update_cache(roberta, desc, args))
+    else:
+        export_embeddings(roberta, desc, args)
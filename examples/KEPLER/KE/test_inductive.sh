@@ -38,19 +38,22 @@ if [ ! -e "$CKPT_DIR/dict.txt" ]; then
         cp $TEST_DATA/gpt2_bpe/dict.txt $CKPT_DIR
 fi
 
+# Only descriptions missing from $CKPT_DIR/emb_cache are encoded
 echo "Generating embeddings..."
 python generate_embeddings.py \
         --data $TEST_DATA/corpus/all.bpe \
         --ckpt_dir $CKPT_DIR \
         --ckpt checkpoint_best.pt \
         --dict $TEST_DATA/gpt2_bpe/dict.txt \
-        --ent_emb $TEST_DATA/embeddings/EntityEmb.npy \
         --rel_emb $TEST_DATA/embeddings/RelEmb.npy \
-        --batch_size 64
+        --batch_size 64 \
+        --cache \
+        --ent_rows $TEST_DATA/embeddings/EntityRows.npy
 
 # echo "Evaluating..."
 python evaluate_transe_inductive.py \
-        --entity_embeddings $TEST_DATA/embeddings/EntityEmb.npy \
+        --entity_embeddings $CKPT_DIR/checkpoint_best.pt \
+        --entity_rows $TEST_DATA/embeddings/EntityRows.npy \
         --relation_embeddings $TEST_DATA/embeddings/RelEmb.npy \
         --dim 768 \
         --entity2id $TEST_DATA/id_mapping/entity2id.json \
@@ -6,6 +6,7 @@ import json
 import argparse
 import numpy as np
 from datetime import datetime
+from ke_dump import BpeDumpWriter, IndexedDumpWriter, binarize_entities
 
 parser=argparse.ArgumentParser()
 parser.add_argument("--dumpPath", type=str, help="path to store output files, do NOT create it previously")
@@ -14,6 +15,8 @@ parser.add_argument("--train", type=str, help="file name of training triplets")
 parser.add_argument("--valid", type=str, help="file name of validation triplets")
 parser.add_argument("--test", type=str, help="file name of test triplets")
 parser.add_argument("--ent_desc", type=str, help="path to the entity description file (after BPE encoding)")
+parser.add_argument("--indexed", action="store_true", help="dump entity ids and binarize each entity description only once")
+parser.add_argument("--dict", type=str, help="path to the dict.txt file, required by --indexed")
 
 def getTriplets(path):
     res=[]
@@ -61,19 +64,12 @@ def getTokens(s):
     return min(len(s.split()),512)
 
 def genSample(triplets, args, split, Qdesc, true_head, true_tail):
-    fHead = open(os.path.join(args.dumpPath, "head", split)+".bpe", "w")
-    fTail = open(os.path.join(args.dumpPath, "tail", split)+".bpe", "w")
-    fnHead = open(os.path.join(args.dumpPath, "negHead", split)+".bpe", "w")
-    fnTail = open(os.path.join(args.dumpPath, "negTail", split)+".bpe", "w")
-    rel=[]
-    sizes=[]
+    writer = (IndexedDumpWriter if args.indexed else BpeDumpWriter)(args.dumpPath, split, Qdesc)
     nE=len(Qdesc)
     for h,r,t in triplets:
-        rel.append(r)
-        fHead.write(Qdesc[h])
-        fTail.write(Qdesc[t])
         size=getTokens(Qdesc[h])
         size+=getTokens(Qdesc[t])
+        negatives = {}
         for mode in ["head-batch","tail-batch"]:
             negative_sample_list = []
             negative_sample_size = 0
@@ -97,23 +93,16 @@ def genSample(triplets, args, split, Qdesc, true_head, true_tail):
                 negative_sample_list.append(negative_sample)
                 negative_sample_size += negative_sample.size
             negative_sample = np.concatenate(negative_sample_list)[:args.negative_sampling_size]
-            for t in negative_sample:
-                x=int(t)
-                if mode == 'head-batch':
-                    fnHead.write(Qdesc[x])
-                else:
-                    fnTail.write(Qdesc[x])
-                size += getTokens(Qdesc[x])
-        sizes.append(size)
-    fHead.close()
-    fTail.close()
-    fnHead.close()
-    fnTail.close()
-    np.save(os.path.join(args.dumpPath, "relation", split)+".npy", np.array(rel))
-    np.save(os.path.join(args.dumpPath, "sizes", split)+".npy", np.array(sizes))
+            for x in negative_sample:
+                size += getTokens(Qdesc[int(x)])
+            negatives[mode] = negative_sample
+        writer.add(h, r, t, negatives["head-batch"], negatives["tail-batch"], size)
+    writer.close()
 
 if __name__=='__main__':
     args=parser.parse_args()
+    if args.indexed and args.dict is None:
+        parser.error("--indexed requires --dict")
     TrainTriplets = getTriplets(args.train)
     ValidTriplets = getTriplets(args.valid)
     TestTriplets = getTriplets(args.test)
@@ -126,8 +115,10 @@ if __name__=='__main__':
     true_head, true_tail = get_true_head_and_tail(AllTriplets)
     os.mkdir(args.dumpPath)
     json.dump(count, open(os.path.join(args.dumpPath, "count.json"), "w"))
-    for nm in ["head","tail","negHead","negTail","relation","sizes"]:
+    for nm in (IndexedDumpWriter if args.indexed else BpeDumpWriter).SUBDIRS:
         os.mkdir(os.path.join(args.dumpPath, nm))
+    if args.indexed:
+        binarize_entities(args.ent_desc, args.dict, args.dumpPath)
     print(str(datetime.now()) + " preparation finished")
     genSample(TrainTriplets, args, "train", Qdesc, true_head, true_tail)
     print(str(datetime.now())+" training set finished")
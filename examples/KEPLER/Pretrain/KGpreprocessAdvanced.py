@@ -8,6 +8,8 @@ import random
 import numpy as np
 from datetime import datetime
 from tqdm import tqdm
+from ke_dump import BpeDumpWriter, IndexedDumpWriter, binarize_entities
+from ke_sampling import NegativeSampler, sampleTriplets
 
 random.seed(42)
 np.random.seed(42)
@@ -21,6 +23,9 @@ parser.add_argument("--test", type=str, help="file name of test triplets")
 parser.add_argument("--ent_desc", type=str, help="path to the entity description file (after BPE encoding)")
 parser.add_argument("--json", type=str, help="if set to a json file, use local negative sampling")
 parser.add_argument("--negative_sampling_type", type=str, default="local", help="local or global negative sampling")
+parser.add_argument("--indexed", action="store_true", help="dump entity ids and binarize each entity description only once")
+parser.add_argument("--dict", type=str, help="path to the dict.txt file, required by --indexed")
+parser.add_argument("--batch_size", type=int, default=10000, help="number of triplets sampled together")
 
 def getTriplets(path):
     res=[]
@@ -46,103 +51,29 @@ def countFrequency(triplets, start=4):
             count[tr] += 1
     return count
     
-def getTrueHeadsAndTails(triplets):
-    true_heads = {}
-    true_tails = {}
-
-    for head, relation, tail in triplets:
-        if (head, relation) not in true_tails:
-            true_tails[(head, relation)] = []
-        true_tails[(head, relation)].append(tail)
-        if (relation, tail) not in true_heads:
-            true_heads[(relation, tail)] = []
-        true_heads[(relation, tail)].append(head)
-
-    for relation, tail in true_heads:
-        true_heads[(relation, tail)] = np.array(list(set(true_heads[(relation, tail)])))
-    for head, relation in true_tails:
-        true_tails[(head, relation)] = np.array(list(set(true_tails[(head, relation)])))                 
-    return true_heads, true_tails
-
 def getTokenCount(s):
     return min(len(s.split()), 512)
 
-def getHeadsOrTails(json_data, selection=(None, None), negative_sampling_type="local"):
-    # selection is a tuple of (head, tail)
-    if selection == (None, None):
-        raise ValueError("Either head or tail should be specified")
-    if selection[0] is not None and selection[1] is not None:
-        raise ValueError("Only one of head or tail should be specified")
-
-    source = "citations" if selection[0] is None else "paper_contexts" # source is the one that is specified in selection
-    target = "paper_contexts" if selection[0] is None else "citations" # target is the one that is not specified in selection
-
-    entities = []
-    if negative_sampling_type == "global":
-        for entry in json_data:
-            t = entry[target]
-            entities.extend(t)
-    elif negative_sampling_type == "local":
-        for entry in json_data:
-            # Get only the local heads or tails
-            s = selection[0] if selection[0] is not None else selection[1]
-            if s in entry[source]:
-                t = entry[target]
-                entities.extend(t)
-    return np.array(list(set(entities)))
-
-def genSample(triplets, args, split, Qdesc, true_heads, true_tails, json_data):
-    fHead = open(os.path.join(args.dumpPath, "head", split)+".bpe", "w")
-    fTail = open(os.path.join(args.dumpPath, "tail", split)+".bpe", "w")
-    fnHead = open(os.path.join(args.dumpPath, "negHead", split)+".bpe", "w")
-    fnTail = open(os.path.join(args.dumpPath, "negTail", split)+".bpe", "w")
-    rel = []
+def genSample(triplets, args, split, Qdesc, sampler):
+    writer = (IndexedDumpWriter if args.indexed else BpeDumpWriter)(args.dumpPath, split, Qdesc)
     nss = args.negative_sampling_size
     nst = args.negative_sampling_type
-    num_tokens_list = []
-    num_entities=len(Qdesc)
-    num_successful_n_sampling = [0, 0] # increment first element by 1 if nHead sampling succeeds, second element for nTail
-    num_missing_n_sampling = [0, 0] # increment first element by 1 if nHead sampling fails, second element for nTail
+    num_tokens = np.array([getTokenCount(s) for s in Qdesc])
+    num_successful_n_sampling = [0, 0] # first element counts successful nHead sampling, second element nTail
+    num_missing_n_sampling = [0, 0] # first element counts failed nHead sampling, second element nTail
 
-    for h,r,t in tqdm(triplets, unit="triplet"):
-        num_tokens = 0
-        n_samples = {"nHead": [], "nTail": []}
+    batches = sampleTriplets(sampler, triplets, nss, num_tokens, args.batch_size)
+    for batch, ok, n_samples, sizes in tqdm(batches, total=-(-len(triplets)//args.batch_size), unit="batch"):
         for m, mode in enumerate(["nHead", "nTail"]):
-            selection = (None, t) if mode == "nHead" else (h, None)
-            all_headsOrTails = getHeadsOrTails(json_data, selection, negative_sampling_type=nst)
-            true_headsOrTails = true_heads[(r, t)] if mode == "nHead" else true_tails[(h, r)]
-            mask = np.in1d(all_headsOrTails, true_headsOrTails, assume_unique=True, invert=True)
-            all_nHeadsOrTails = all_headsOrTails[mask]
-            if len(all_nHeadsOrTails) < nss:
-                num_missing_n_sampling[m] += 1
-            else:
-                n_samples[mode] = np.random.choice(all_nHeadsOrTails, nss, replace=False)
-                num_successful_n_sampling[m] += 1
+            num_successful_n_sampling[m] += int(ok[mode].sum())
+            num_missing_n_sampling[m] += int((~ok[mode]).sum())
 
-        # If both nHead and nTail sampling succeeds
-        if len(n_samples["nHead"]) > 0 and len(n_samples["nTail"]) > 0: 
-            num_tokens += getTokenCount(Qdesc[h])
-            num_tokens += getTokenCount(Qdesc[t])
-            fHead.write(Qdesc[h])
-            fTail.write(Qdesc[t])
-            rel.append(r)
-            # Write negative samples to file
-            for tok in n_samples["nHead"]:
-                x = int(tok)
-                fnHead.write(Qdesc[x])
-                num_tokens += getTokenCount(Qdesc[x])
-            for tok in n_samples["nTail"]:
-                x = int(tok)
-                fnTail.write(Qdesc[x])
-                num_tokens += getTokenCount(Qdesc[x])
-            num_tokens_list.append(num_tokens)
+        # Keep the triplets for which both nHead and nTail sampling succeeds
+        for i in np.nonzero(ok["nHead"] & ok["nTail"])[0]:
+            h, r, t = (int(x) for x in batch[i])
+            writer.add(h, r, t, n_samples["nHead"][i], n_samples["nTail"][i], int(sizes[i]))
 
-    fHead.close()
-    fTail.close()
-    fnHead.close()
-    fnTail.close()
-    np.save(os.path.join(args.dumpPath, "relation", split)+".npy", np.array(rel))
-    np.save(os.path.join(args.dumpPath, "sizes", split)+".npy", np.array(num_tokens_list))
+    writer.close()
 
     print(f"> {nst} nHead sampling = {num_successful_n_sampling[0]}")
     print(f"> missing nHead sampling = {num_missing_n_sampling[0]}")
@@ -152,6 +83,8 @@ def genSample(triplets, args, split, Qdesc, true_heads, true_tails, json_data):
 
 if __name__=='__main__':
     args=parser.parse_args()
+    if args.indexed and args.dict is None:
+        parser.error("--indexed requires --dict")
     TrainTriplets = getTriplets(args.train)
     ValidTriplets = getTriplets(args.valid)
     TestTriplets = getTriplets(args.test)
@@ -161,19 +94,21 @@ if __name__=='__main__':
         Qdesc=fin.readlines()
     print(str(datetime.now())+" load finish")
     count = countFrequency(AllTriplets)
-    true_heads, true_tails = getTrueHeadsAndTails(AllTriplets)
     os.mkdir(args.dumpPath)
     json.dump(count, open(os.path.join(args.dumpPath, "count.json"), "w"))
-    for nm in ["head","tail","negHead","negTail","relation","sizes"]:
+    for nm in (IndexedDumpWriter if args.indexed else BpeDumpWriter).SUBDIRS:
         os.mkdir(os.path.join(args.dumpPath, nm))
+    if args.indexed:
+        binarize_entities(args.ent_desc, args.dict, args.dumpPath)
     print(str(datetime.now()) + " preparation finished")
     json_data = None
     if args.json is not None:
         with open(os.path.join(args.json), "r") as file:
             json_data = json.load(file)
-    genSample(TrainTriplets, args, "train", Qdesc, true_heads, true_tails, json_data)
+    sampler = NegativeSampler(json_data, AllTriplets, len(Qdesc), args.negative_sampling_type)
+    genSample(TrainTriplets, args, "train", Qdesc, sampler)
     print(str(datetime.now())+" training set finished")
-    genSample(ValidTriplets, args, "valid", Qdesc, true_heads, true_tails, json_data)
+    genSample(ValidTriplets, args, "valid", Qdesc, sampler)
     print(str(datetime.now())+" validation set finished")
-    genSample(TestTriplets, args, "test", Qdesc, true_heads, true_tails, json_data)
+    genSample(TestTriplets, args, "test", Qdesc, sampler)
     print(str(datetime.now())+" test set finished")
@@ -0,0 +1,144 @@
+# coding=utf-8
+"""do negative sampling with a process pool and dump binarized KE data, already split into shards"""
+import os
+import json
+import argparse
+import itertools
+import numpy as np
+from datetime import datetime
+from multiprocessing import Pool
+from shutil import copyfile
+
+from fairseq.data import Dictionary, data_utils, indexed_dataset
+from ke_dump import BinarizedDumpWriter, binarize_entities
+from ke_sampling import NegativeSampler, sampleTriplets
+
+parser=argparse.ArgumentParser()
+parser.add_argument("--dumpPath", type=str, help="path to store output files, do NOT create it previously; shards go to <dumpPath>_0, <dumpPath>_1, ...")
+parser.add_argument("-ns", "--negative_sampling_size", type=int, default=1)
+parser.add_argument("--train", type=str, help="file name of training triplets")
+parser.add_argument("--valid", type=str, help="file name of validation triplets")
+parser.add_argument("--test", type=str, help="file name of test triplets")
+parser.add_argument("--ent_desc", type=str, help="path to the entity description file (after BPE encoding), or the prefix of its .bin/.idx written by multiprocessing_bpe_binarizer.py --keep-empty --srcdict <dict>")
+parser.add_argument("--dict", type=str, help="path to the dict.txt file")
+parser.add_argument("--json", type=str, help="citations json, required by local and global negative sampling")
+parser.add_argument("--negative_sampling_type", type=str, default="uniform", choices=["uniform", "local", "global"])
+parser.add_argument("--split_size", type=int, default=None, help="max number of training instances in each shard")
+parser.add_argument("--workers", type=int, default=1)
+parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--batch_size", type=int, default=10000, help="number of triplets sampled together")
+
+SPLITS = ["train", "valid", "test"]
+
+
+def readTriplets(path, chunk_size=1000000):
+    """Read (head, relation, tail) ids into an [N, 3] int32 array, chunk_size lines at a time."""
+    chunks = []
+    with open(path, "r") as fin:
+        while True:
+            lines = list(itertools.islice(fin, chunk_size))
+            if len(lines) == 0:
+                break
+            chunks.append(np.loadtxt(lines, dtype=np.int32, usecols=(0, 1, 2), ndmin=2))
+    return np.concatenate(chunks) if len(chunks) > 0 else np.zeros((0, 3), dtype=np.int32)
+
+
+def countFrequency(triplets, start=4):
+    count = {}
+    h, r, t = triplets[:, 0], triplets[:, 1], triplets[:, 2]
+    for keys in [np.stack([h, r], axis=1), np.stack([t, -r-1], axis=1)]:
+        uniq, cnt = np.unique(keys, axis=0, return_counts=True)
+        for (a, b), c in zip(uniq.tolist(), cnt.tolist()):
+            count["%d,%d" % (a, b)] = start + c - 1
+    return count
+
+
+worker = {}
+
+def initWorker(sampler, entity_prefix, vocab_size, args):
+    worker["sampler"] = sampler
+    worker["entities"] = indexed_dataset.MMapIndexedDataset(entity_prefix)
+    worker["num_tokens"] = np.minimum(worker["entities"].sizes.astype(np.int64) - 1, 512)  # without </s>
+    worker["vocab_size"] = vocab_size
+    worker["args"] = args
+
+def dumpShard(split, shard, outPath, triplets):
+    """Sample and binarize one shard. Its seed depends only on (--seed, split, shard),
+    so the output does not depend on --workers or on the order the shards run in."""
+    args = worker["args"]
+    writer = BinarizedDumpWriter(outPath, split, worker["entities"], worker["vocab_size"])
+    num_successful_n_sampling = [0, 0]
+    num_missing_n_sampling = [0, 0]
+    with data_utils.numpy_seed(args.seed, SPLITS.index(split), shard):
+        batches = sampleTriplets(worker["sampler"], triplets, args.negative_sampling_size, worker["num_tokens"], args.batch_size)
+        for batch, ok, n_samples, sizes in batches:
+            for m, mode in enumerate(["nHead", "nTail"]):
+                num_successful_n_sampling[m] += int(ok[mode].sum())
+                num_missing_n_sampling[m] += int((~ok[mode]).sum())
+            for i in np.nonzero(ok["nHead"] & ok["nTail"])[0]:
+                h, r, t = (int(x) for x in batch[i])
+                writer.add(h, r, t, n_samples["nHead"][i], n_samples["nTail"][i], int(sizes[i]))
+    writer.close()
+    return split, num_successful_n_sampling, num_missing_n_sampling
+
+def makeDumpDir(path):
+    os.mkdir(path)
+    for nm in BinarizedDumpWriter.SUBDIRS:
+        os.mkdir(os.path.join(path, nm))
+
+
+if __name__=='__main__':
+    args=parser.parse_args()
+    triplets = {split: readTriplets(path) for split, path in zip(SPLITS, [args.train, args.valid, args.test]) if path is not None}
+    AllTriplets = np.concatenate(list(triplets.values()))
+    print(str(datetime.now())+" load finish")
+    makeDumpDir(args.dumpPath)
+    os.mkdir(os.path.join(args.dumpPath, "entity"))
+    json.dump(countFrequency(AllTriplets), open(os.path.join(args.dumpPath, "count.json"), "w"))
+    binarize_entities(args.ent_desc, args.dict, args.dumpPath, int(AllTriplets[:, [0, 2]].max()) + 1 if len(AllTriplets) > 0 else 0)
+    entity_prefix = os.path.join(args.dumpPath, "entity", "desc")
+    num_entities = len(indexed_dataset.MMapIndexedDataset(entity_prefix))
+    json_data = None
+    if args.json is not None:
+        with open(args.json, "r") as file:
+            json_data = json.load(file)
+    sampler = NegativeSampler(json_data, AllTriplets, num_entities, args.negative_sampling_type)
+    print(str(datetime.now()) + " preparation finished")
+
+    # shuffle the training triplets among the shards, as splitDump.py does
+    train = triplets.get("train", np.zeros((0, 3), dtype=np.int32))
+    split_size = args.split_size or max(len(train), 1)
+    Idx = np.random.RandomState(args.seed).permutation(len(train))
+    SNUM = max(-(-len(train) // split_size), 1)
+    print("The data will be splited into %d splits"%(SNUM))
+    jobs = []
+    for i in range(SNUM):
+        nPath = args.dumpPath+"_%d"%(i)
+        makeDumpDir(nPath)
+        jobs.append(("train", i, nPath, train[Idx[i*split_size:(i+1)*split_size]]))
+    jobs += [(split, 0, args.dumpPath, triplets[split]) for split in ["valid", "test"] if split in triplets]
+
+    initargs = (sampler, entity_prefix, len(Dictionary.load(args.dict)), args)
+    if args.workers > 1:
+        with Pool(args.workers, initializer=initWorker, initargs=initargs) as pool:
+            results = pool.starmap(dumpShard, jobs)
+    else:
+        initWorker(*initargs)
+        results = [dumpShard(*job) for job in jobs]
+
+    for split in SPLITS:
+        stats = [(s, m) for nm, s, m in results if nm == split]
+        if len(stats) == 0:
+            continue
+        s, m = np.sum([x[0] for x in stats], axis=0), np.sum([x[1] for x in stats], axis=0)
+        print(f"> {split}: {args.negative_sampling_type} nHead sampling = {s[0]}, missing = {m[0]}")
+        print(f"> {split}: {args.negative_sampling_type} nTail sampling = {s[1]}, missing = {m[1]}")
+
+    # every shard gets the same validation and test data
+    for i in range(SNUM):
+        nPath = args.dumpPath+"_%d"%(i)
+        copyfile(os.path.join(args.dumpPath, "count.json"), os.path.join(nPath, "count.json"))
+        for nm in BinarizedDumpWriter.SUBDIRS:
+            for fn in os.listdir(os.path.join(args.dumpPath, nm)):
+                copyfile(os.path.join(args.dumpPath, nm, fn), os.path.join(nPath, nm, fn))
+    print(str(datetime.now())+" %d shards finished"%(SNUM))
@@ -28,8 +28,7 @@ if __name__=='__main__':
 
     with open(args.raw_corpus, "r") as fin:
         with open(args.converted_corpus, "w") as fout:
-            lines = fin.readlines()
-            for idx, line in enumerate(lines):
+            for idx, line in enumerate(fin):
                 data = line.split('\t')
                 assert len(data) >= 2
                 assert (data[0].startswith('H') or data[0].startswith('T'))
@@ -44,8 +43,7 @@ if __name__=='__main__':
             exit(1)
         with open(inFile, "r") as fin:
             with open(outFile, "w") as fout:
-                lines = fin.readlines()
-                for line in lines:
+                for line in fin:
                     data = line.strip().split('\t')
                     assert len(data) == 3
                     if data[1] not in Pid:
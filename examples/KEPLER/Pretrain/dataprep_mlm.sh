@@ -23,27 +23,17 @@ python split.py \
 		--input_file $MLM_DATA/corpus/all.txt \
 		--output_dir $MLM_DATA/corpus
 
-echo "BPE Encoding the converted corpus..."
-for SPLIT in train valid test; do \
-    python ../../roberta/multiprocessing_bpe_encoder.py \
-        --encoder-json $MLM_DATA/gpt2_bpe/encoder.json \
-        --vocab-bpe $MLM_DATA/gpt2_bpe/vocab.bpe \
-        --inputs $MLM_DATA/corpus/$SPLIT.txt \
-        --outputs $MLM_DATA/corpus/$SPLIT.bpe \
-        --keep-empty \
-        --workers 40; \
-done
-
 [ -d "$MLM_DATA/preprocessed" ] && rm -rf "$MLM_DATA/preprocessed"
 
-echo "Binarizing..."
-python ../../../fairseq_cli/preprocess.py \
-    --only-source \
+echo "BPE Encoding and binarizing the converted corpus..."
+python ../../roberta/multiprocessing_bpe_binarizer.py \
+    --encoder-json $MLM_DATA/gpt2_bpe/encoder.json \
+    --vocab-bpe $MLM_DATA/gpt2_bpe/vocab.bpe \
     --srcdict $MLM_DATA/gpt2_bpe/dict.txt \
-    --trainpref $MLM_DATA/corpus/train.bpe \
-    --validpref $MLM_DATA/corpus/valid.bpe \
-    --testpref $MLM_DATA/corpus/test.bpe \
-    --destdir $MLM_DATA/preprocessed/ \
+    --inputs $MLM_DATA/corpus/train.txt $MLM_DATA/corpus/valid.txt $MLM_DATA/corpus/test.txt \
+    --outputs $MLM_DATA/preprocessed/train $MLM_DATA/preprocessed/valid $MLM_DATA/preprocessed/test \
+    --keep-empty \
+    --bpe-cache $MLM_DATA/gpt2_bpe/cache \
     --workers 40
     
 # https://github.com/THU-KEG/KEPLER/blob/main/examples/roberta/README.pretraining.md
@@ -0,0 +1,139 @@
+# coding=utf-8
+"""writers shared by KGpreprocess.py, KGpreprocessAdvanced.py and KGpreprocessSharded.py to dump KE training data"""
+import os
+import shutil
+import numpy as np
+
+from fairseq.binarizer import Binarizer
+from fairseq.data import Dictionary, indexed_dataset
+
+
+class BpeDumpWriter(object):
+    """Dump the BPE description of every head, tail and negative, one line per
+    occurrence. The outputs have to be binarized with fairseq-preprocess."""
+
+    SUBDIRS = ["head", "tail", "negHead", "negTail", "relation", "sizes"]
+
+    def __init__(self, dumpPath, split, Qdesc):
+        self.dumpPath = dumpPath
+        self.split = split
+        self.Qdesc = Qdesc
+        self.fHead = open(os.path.join(dumpPath, "head", split)+".bpe", "w")
+        self.fTail = open(os.path.join(dumpPath, "tail", split)+".bpe", "w")
+        self.fnHead = open(os.path.join(dumpPath, "negHead", split)+".bpe", "w")
+        self.fnTail = open(os.path.join(dumpPath, "negTail", split)+".bpe", "w")
+        self.rel = []
+        self.sizes = []
+
+    def add(self, h, r, t, nHeads, nTails, size):
+        self.rel.append(r)
+        self.fHead.write(self.Qdesc[h])
+        self.fTail.write(self.Qdesc[t])
+        for x in nHeads:
+            self.fnHead.write(self.Qdesc[int(x)])
+        for x in nTails:
+            self.fnTail.write(self.Qdesc[int(x)])
+        self.sizes.append(size)
+
+    def close(self):
+        self.fHead.close()
+        self.fTail.close()
+        self.fnHead.close()
+        self.fnTail.close()
+        np.save(os.path.join(self.dumpPath, "relation", self.split)+".npy", np.array(self.rel))
+        np.save(os.path.join(self.dumpPath, "sizes", self.split)+".npy", np.array(self.sizes))
+
+
+class IndexedDumpWriter(object):
+    """Dump only entity ids: int32 (head, relation, tail) triples and int32
+    [num_triples, negative_sampling_size] negative arrays. Descriptions are
+    gathered by entity id from the binarized store under entity/ at training
+    time (--ke-data-format entity)."""
+
+    SUBDIRS = ["entity", "triples", "negHead", "negTail", "sizes"]
+
+    def __init__(self, dumpPath, split, Qdesc=None):
+        self.dumpPath = dumpPath
+        self.split = split
+        self.triples = []
+        self.nHeads = []
+        self.nTails = []
+        self.sizes = []
+
+    def add(self, h, r, t, nHeads, nTails, size):
+        self.triples.append((h, r, t))
+        self.nHeads.append(nHeads)
+        self.nTails.append(nTails)
+        self.sizes.append(size)
+
+    def close(self):
+        def save(nm, a):
+            np.save(os.path.join(self.dumpPath, nm, self.split)+".npy", np.array(a, dtype=np.int32))
+        save("triples", np.reshape(self.triples, (-1, 3)))
+        save("negHead", self.nHeads)
+        save("negTail", self.nTails)
+        np.save(os.path.join(self.dumpPath, "sizes", self.split)+".npy", np.array(self.sizes))
+
+
+class BinarizedDumpWriter(object):
+    """Same layout as BpeDumpWriter, but heads, tails and negatives are copied
+    from the binarized entity store straight into mmap datasets, so no .bpe
+    text and no fairseq-preprocess run is needed."""
+
+    SUBDIRS = BpeDumpWriter.SUBDIRS
+
+    def __init__(self, dumpPath, split, entities, vocab_size):
+        self.dumpPath = dumpPath
+        self.split = split
+        self.entities = entities
+        self.builders = {
+            nm: indexed_dataset.make_builder(os.path.join(dumpPath, nm, split)+".bin", impl="mmap", vocab_size=vocab_size)
+            for nm in ["head", "tail", "negHead", "negTail"]
+        }
+        self.rel = []
+        self.sizes = []
+
+    def add(self, h, r, t, nHeads, nTails, size):
+        self.rel.append(r)
+        self.builders["head"].add_item(self.entities[int(h)])
+        self.builders["tail"].add_item(self.entities[int(t)])
+        for x in nHeads:
+            self.builders["negHead"].add_item(self.entities[int(x)])
+        for x in nTails:
+            self.builders["negTail"].add_item(self.entities[int(x)])
+        self.sizes.append(size)
+
+    def close(self):
+        for nm, builder in self.builders.items():
+            builder.finalize(os.path.join(self.dumpPath, nm, self.split)+".idx")
+        np.save(os.path.join(self.dumpPath, "relation", self.split)+".npy", np.array(self.rel))
+        np.save(os.path.join(self.dumpPath, "sizes", self.split)+".npy", np.array(self.sizes))
+
+
+def binarize_entities(ent_desc, dict_path, dumpPath, num_entities=None):
+    """Binarize every entity description once into dumpPath/entity/desc.{bin,idx}.
+    ent_desc is either BPE text, or the prefix of descriptions that are already
+    binarized, which are copied. These have to be written by
+    multiprocessing_bpe_binarizer.py with --keep-empty and --srcdict dict_path,
+    otherwise row i is not the description of entity i. num_entities, if given,
+    is the number of entity ids the triplets need."""
+    dictionary = Dictionary.load(dict_path)
+    out_prefix = os.path.join(dumpPath, "entity", "desc")
+    res = None
+    if indexed_dataset.MMapIndexedDataset.exists(ent_desc):
+        desc_dict = os.path.join(os.path.dirname(os.path.abspath(ent_desc)), "dict.txt")
+        assert os.path.exists(desc_dict), "no dict.txt next to the binarized descriptions {}".format(ent_desc)
+        assert Dictionary.load(desc_dict).symbols == dictionary.symbols, \
+            "{} was not binarized with {}".format(ent_desc, dict_path)
+        for path_fn in [indexed_dataset.data_file_path, indexed_dataset.index_file_path]:
+            shutil.copyfile(path_fn(ent_desc), path_fn(out_prefix))
+    else:
+        ds = indexed_dataset.make_builder(out_prefix+".bin", impl="mmap", vocab_size=len(dictionary))
+        res = Binarizer.binarize(ent_desc, dictionary, lambda t: ds.add_item(t))
+        ds.finalize(out_prefix+".idx")
+    if num_entities is not None:
+        num_desc = len(indexed_dataset.MMapIndexedDataset(out_prefix))
+        assert num_desc >= num_entities, \
+            "{} has {} descriptions, but the triplets use {} entity ids (binarize it with --keep-empty)".format(
+                ent_desc, num_desc, num_entities)
+    return res
@@ -0,0 +1,127 @@
+# coding=utf-8
+"""vectorized local/global negative sampling over the citation graph"""
+import numpy as np
+
+from fairseq.data.ke_online_negative_dataset import (
+    KeCitationNeighbourhood,
+    gather_ranges,
+    group_by_key,
+    in_sorted,
+    lookup_batch,
+)
+
+
+def chooseWithoutReplacement(seg, cand, num_segments, size):
+    """Uniformly pick *size* of the candidates of every segment (rows with
+    fewer candidates are left at -1)."""
+    res = np.full((num_segments, size), -1, dtype=np.int64)
+    if len(seg) == 0:
+        return res
+    order = np.lexsort((np.random.random(len(seg)), seg))
+    seg, cand = seg[order], cand[order]
+    counts = np.bincount(seg, minlength=num_segments)
+    rank = np.arange(len(seg)) - np.repeat(np.cumsum(counts) - counts, counts)
+    keep = rank < size
+    res[seg[keep], rank[keep]] = cand[keep]
+    return res
+
+
+class NegativeSampler(object):
+    """Samples local, global or uniform negatives for many triplets at once.
+
+    The citation graph is indexed once in CSR form (paper -> citations,
+    citation -> papers) and the true heads/tails of all triplets are kept as
+    sorted int64 keys, so filtering is a sorted-array membership test.
+    Candidate pools and filtering follow the per-triplet loop this replaces:
+    a triplet is dropped when a side has fewer than nss valid candidates.
+    "uniform" ignores the citation graph and draws from all entities, as
+    KGpreprocess.py does.
+    """
+
+    def __init__(self, json_data, triplets, num_entities, negative_sampling_type="local"):
+        self.num_entities = E = num_entities
+        if negative_sampling_type == "uniform":
+            self.neighbourhood = None
+        else:
+            self.neighbourhood = KeCitationNeighbourhood(json_data, negative_sampling_type)
+        self.negative_sampling_type = negative_sampling_type
+        # a triple listed in several splits (or twice in one) is a single true fact
+        triplets = np.unique(np.asarray(triplets, dtype=np.int64).reshape(-1, 3), axis=0)
+        h, r, t = triplets[:, 0], triplets[:, 1], triplets[:, 2]
+        self.num_relations = R = int(r.max()) + 1 if len(r) > 0 else 1
+        assert R * E * E < 2 ** 63, "entity/relation ids do not fit into int64 keys"
+        self.true_heads = np.unique((r * E + t) * E + h)
+        self.true_tails = np.unique((h * R + r) * E + t)
+        self.true_groups = {
+            "nHead": group_by_key(r * E + t, h),
+            "nTail": group_by_key(h * R + r, t),
+        }
+
+    def _queries(self, h, r, t, mode):
+        if mode == "nHead":
+            return r * self.num_entities + t, self.true_heads
+        return h * self.num_relations + r, self.true_tails
+
+    def _local(self, h, r, t, mode, nss):
+        B, E = len(h), self.num_entities
+        source, target = ("citations", "paper_contexts") if mode == "nHead" else ("paper_contexts", "citations")
+        source, target = self.neighbourhood.sides[source], self.neighbourhood.sides[target]
+        entries, lens = lookup_batch(source["entries"], t if mode == "nHead" else h)
+        seg = np.repeat(np.arange(B), lens)
+        starts, ends = target["offsets"][entries], target["offsets"][entries + 1]
+        cand = gather_ranges(target["members"], starts, ends)
+        key = np.unique(np.repeat(seg, ends - starts) * E + cand)
+        seg, cand = key // E, key % E
+        queries, true = self._queries(h, r, t, mode)
+        valid = ~in_sorted(queries[seg] * E + cand, true)
+        seg, cand = seg[valid], cand[valid]
+        ok = np.bincount(seg, minlength=B) >= nss
+        return ok, chooseWithoutReplacement(seg, cand, B, nss)
+
+    def _global(self, h, r, t, mode, nss):
+        B, E = len(h), self.num_entities
+        if self.neighbourhood is None:
+            pool = np.arange(E)
+        else:
+            pool = self.neighbourhood.sides["paper_contexts" if mode == "nHead" else "citations"]["all"]
+        queries, true = self._queries(h, r, t, mode)
+        true_values, lens = lookup_batch(self.true_groups[mode], queries)
+        num_true = np.bincount(np.repeat(np.arange(B), lens), weights=in_sorted(true_values, pool), minlength=B)
+        ok = len(pool) - num_true >= nss
+        keys = np.zeros(0, dtype=np.int64)
+        todo = np.nonzero(ok)[0]
+        while len(todo) > 0:
+            seg = np.repeat(todo, nss * 2)
+            cand = pool[np.random.randint(len(pool), size=len(seg))]
+            valid = ~in_sorted(queries[seg] * E + cand, true)
+            keys = np.unique(np.concatenate([keys, seg[valid] * E + cand[valid]]))
+            todo = todo[np.bincount(keys // E, minlength=B)[todo] < nss]
+        return ok, chooseWithoutReplacement(keys // E, keys % E, B, nss)
+
+    def sample(self, triplets, mode, nss):
+        """Returns a bool mask of the triplets with enough negative
+        candidates and a [num_triplets, nss] array of negatives."""
+        triplets = np.asarray(triplets, dtype=np.int64).reshape(-1, 3)
+        h, r, t = triplets[:, 0], triplets[:, 1], triplets[:, 2]
+        if self.negative_sampling_type != "local":
+            return self._global(h, r, t, mode, nss)
+        return self._local(h, r, t, mode, nss)
+
+
+def sampleTriplets(sampler, triplets, nss, num_tokens, batch_size):
+    """Sample negatives for chunks of *batch_size* triplets.
+
+    Yields (batch, ok, negatives, sizes): the success mask and the
+    [len(batch), nss] negatives of both "nHead" and "nTail", and the token
+    count of every instance (head, tail and all of its negatives).
+    """
+    triplets = np.asarray(triplets, dtype=np.int64).reshape(-1, 3)
+    for s in range(0, len(triplets), batch_size):
+        batch = triplets[s:s+batch_size]
+        ok, negatives = {}, {}
+        for mode in ["nHead", "nTail"]:
+            ok[mode], negatives[mode] = sampler.sample(batch, mode, nss)
+        sizes = num_tokens[batch[:, 0]] + num_tokens[batch[:, 2]]
+        for mode in ["nHead", "nTail"]:
+            sizes += num_tokens[negatives[mode].clip(0)].sum(axis=1)
+        yield batch, ok, negatives, sizes
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+import sys
+
+from collections import Counter
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+
+from fairseq.binarizer import Binarizer, safe_readline
+from fairseq.data import Dictionary, indexed_dataset
+from fairseq.data.encoders.gpt2_bpe import get_encoder
+
+
+def main():
+    """
+    Helper script to encode raw text with the GPT-2 BPE and binarize it into
+    an ``MMapIndexedDataset`` in one pass, using multiple processes.
+
+    It writes the same ``.bin``/``.idx`` files as
+    ``multiprocessing_bpe_encoder.py --keep-empty`` followed by
+    ``fairseq-preprocess --only-source --srcdict <dict> --dataset-impl mmap``,
+    without the intermediate text files.
+
+    The encoder.json and vocab.bpe files can be obtained here:
+    - https://dl.fbaipublicfiles.com/fairseq/gpt2_bpe/encoder.json
+    - https://dl.fbaipublicfiles.com/fairseq/gpt2_bpe/vocab.bpe
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--encoder-json",
+        help='path to encoder.json',
+    )
+    parser.add_argument(
+        "--vocab-bpe",
+        type=str,
+        help='path to vocab.bpe',
+    )
+    parser.add_argument(
+        "--srcdict",
+        help="path to the dict.txt of the BPE ids",
+    )
+    parser.add_argument(
+        "--inputs",
+        nargs="+",
+        help="raw text files to encode",
+    )
+    parser.add_argument(
+        "--outputs",
+        nargs="+",
+        help="output prefixes, e.g. <destdir>/train for <destdir>/train.{bin,idx}",
+    )
+    parser.add_argument(
+        "--keep-empty",
+        action="store_true",
+        help="keep empty lines (as a single </s>)",
+    )
+    parser.add_argument(
+        "--bpe-cache",
+        help="directory of a persistent word -> BPE ids cache, shared by the "
+             "workers and extended with the new words of this run",
+    )
+    parser.add_argument("--workers", type=int, default=20)
+    args = parser.parse_args()
+
+    assert len(args.inputs) == len(args.outputs), \
+        "number of input and output paths should match"
+
+    dictionary = Dictionary.load(args.srcdict)
+    new_words = {}
+    with Pool(args.workers, initializer=initializer, initargs=(args,)) as pool:
+        for input, output in zip(args.inputs, args.outputs):
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            dictionary.save(os.path.join(os.path.dirname(os.path.abspath(output)), "dict.txt"))
+            stats = binarize_file(pool, input, output, args.workers, len(dictionary), new_words)
+            print(
+                "| {}: {} sents, {} tokens, {} empty lines skipped, {:.3}% replaced by {}".format(
+                    input, stats["nseq"], stats["ntok"], stats["nempty"],
+                    100 * stats["nunk"] / max(stats["ntok"], 1), dictionary.unk_word,
+                ),
+                file=sys.stderr,
+            )
+
+    if args.bpe_cache is not None:
+        cache = get_encoder(args.encoder_json, args.vocab_bpe, args.bpe_cache).persistent_cache
+        cache.update(new_words)
+        print("| BPE cache {}: {} words ({} new)".format(
+            args.bpe_cache, len(cache), len(new_words)), file=sys.stderr)
+
+
+def binarize_file(pool, input, output, num_chunks, vocab_size, new_words):
+    """Binarize byte ranges of *input* in the pool and concatenate them, in
+    order, into *output*.{bin,idx}."""
+    offsets = Binarizer.find_offsets(input, num_chunks)
+    chunks = [
+        (input, "{}.chunk{}".format(output, i), offsets[i], offsets[i + 1])
+        for i in range(num_chunks)
+    ]
+    stats = Counter()
+    ds = indexed_dataset.make_builder(output + ".bin", impl="mmap", vocab_size=vocab_size)
+    for (_, prefix, _, _), (chunk_stats, words) in zip(chunks, pool.starmap(binarize_chunk, chunks)):
+        stats.update(chunk_stats)
+        new_words.update(words)
+        ds.merge_file_(prefix)
+        os.remove(indexed_dataset.data_file_path(prefix))
+        os.remove(indexed_dataset.index_file_path(prefix))
+    ds.finalize(output + ".idx")
+    return stats
+
+
+def bpe_lookup_table(dictionary, bpe_vocab_size):
+    """Dictionary index of every BPE id (the symbols of dict.txt are decimal
+    BPE ids), or that of ``<unk>`` for ids that are not in the dictionary."""
+    table = np.full(bpe_vocab_size, dictionary.unk(), dtype=np.int64)
+    symbols = dictionary.int_symbol_table()
+    if symbols is not None:
+        n = min(len(symbols), bpe_vocab_size)
+        table[:n] = symbols[:n]
+    return table
+
+
+def initializer(args):
+    global worker
+    bpe = get_encoder(args.encoder_json, args.vocab_bpe, args.bpe_cache)
+    dictionary = Dictionary.load(args.srcdict)
+    worker = {
+        "bpe": bpe,
+        "table": bpe_lookup_table(dictionary, len(bpe.encoder)),
+        "unk": dictionary.unk(),
+        "eos": dictionary.eos(),
+        "vocab_size": len(dictionary),
+        "keep_empty": args.keep_empty,
+    }
+
+
+def binarize_chunk(input, output_prefix, offset, end):
+    """Encode and binarize the lines of *input* that start in ``[offset,
+    end)`` into *output_prefix*.{bin,idx}."""
+    global worker
+    bpe, table, eos = worker["bpe"], worker["table"], worker["eos"]
+    stats = Counter(nseq=0, ntok=0, nunk=0, nempty=0)
+    ds = indexed_dataset.make_builder(output_prefix + ".bin", impl="mmap", vocab_size=worker["vocab_size"])
+    with open(input, "r", encoding="utf-8") as f:
+        f.seek(offset)
+        # next(f) breaks f.tell(), hence readline() must be used
+        line = safe_readline(f)
+        while line:
+            if end > 0 and f.tell() > end:
+                break
+            line = line.strip()
+            if len(line) == 0 and not worker["keep_empty"]:
+                stats["nempty"] += 1
+            else:
+                ids = bpe.encode(line)
+                tokens = np.empty(len(ids) + 1, dtype=np.int64)
+                tokens[:-1] = table[ids]
+                tokens[-1] = eos
+                ds.add_item(torch.from_numpy(tokens))
+                stats["nseq"] += 1
+                stats["ntok"] += len(tokens)
+                stats["nunk"] += int((tokens == worker["unk"]).sum())
+            line = f.readline()
+    ds.finalize(output_prefix + ".idx")
+    return stats, bpe.pop_new_words()
+
+
+if __name__ == "__main__":
+    main()
@@ -50,6 +50,11 @@ def main():
         action="store_true",
         help="keep empty lines",
     )
+    parser.add_argument(
+        "--bpe-cache",
+        help="directory of a persistent word -> BPE ids cache, shared by the "
+             "workers and extended with the new words of this run",
+    )
     parser.add_argument("--workers", type=int, default=20)
     args = parser.parse_args()
 
@@ -73,7 +78,9 @@ def main():
         encoded_lines = pool.imap(encoder.encode_lines, zip(*inputs), 100)
 
         stats = Counter()
-        for i, (filt, enc_lines) in enumerate(encoded_lines, start=1):
+        new_words = {}
+        for i, (filt, enc_lines, words) in enumerate(encoded_lines, start=1):
+            new_words.update(words)
             if filt == "PASS":
                 for enc_line, output_h in zip(enc_lines, outputs):
                     print(enc_line, file=output_h)
@@ -85,6 +92,12 @@ def main():
         for k, v in stats.most_common():
             print("[{}] filtered {} lines".format(k, v), file=sys.stderr)
 
+        if args.bpe_cache is not None:
+            cache = get_encoder(args.encoder_json, args.vocab_bpe, args.bpe_cache).persistent_cache
+            cache.update(new_words)
+            print("| BPE cache {}: {} words ({} new)".format(
+                args.bpe_cache, len(cache), len(new_words)), file=sys.stderr)
+
 
 class MultiprocessingEncoder(object):
 
@@ -93,7 +106,7 @@ class MultiprocessingEncoder(object):
 
     def initializer(self):
         global bpe
-        bpe = get_encoder(self.args.encoder_json, self.args.vocab_bpe)
+        bpe = get_encoder(self.args.encoder_json, self.args.vocab_bpe, self.args.bpe_cache)
 
     def encode(self, line):
         global bpe
@@ -106,16 +119,18 @@ class MultiprocessingEncoder(object):
 
     def encode_lines(self, lines):
         """
-        Encode a set of lines. All lines will be encoded together.
+        Encode a set of lines. All lines will be encoded together, and
+        returned with the words that are missing from the BPE cache.
         """
+        global bpe
         enc_lines = []
         for line in lines:
             line = line.strip()
             if len(line) == 0 and not self.args.keep_empty:
-                return ["EMPTY", None]
+                return ["EMPTY", None, bpe.pop_new_words()]
             tokens = self.encode(line)
             enc_lines.append(" ".join(tokens))
-        return ["PASS", enc_lines]
+        return ["PASS", enc_lines, bpe.pop_new_words()]
 
     def decode_lines(self, lines):
         dec_lines = []
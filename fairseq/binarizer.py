@@ -23,33 +23,36 @@ class Binarizer:
 
     @staticmethod
     def binarize(filename, dict, consumer, tokenize=tokenize_line, append_eos=True, reverse_order=False,
-                 offset=0, end=-1):
+                 offset=0, end=-1, batch_size=10000):
         nseq, ntok = 0, 0
         replaced = Counter()
 
-        def replaced_consumer(word, idx):
-            if idx == dict.unk_index and word != dict.unk_word:
-                replaced.update([word])
+        def encode(lines):
+            # lines are encoded batch_size at a time with Dictionary.encode_lines
+            nonlocal nseq, ntok
+            batch, batch_replaced = dict.encode_lines(
+                lines, line_tokenizer=tokenize, append_eos=append_eos, reverse_order=reverse_order,
+            )
+            replaced.update(batch_replaced)
+            for ids in batch:
+                nseq += 1
+                ntok += len(ids)
+                consumer(ids)
 
         with open(filename, 'r', encoding='utf-8') as f:
             f.seek(offset)
             # next(f) breaks f.tell(), hence readline() must be used
+            lines = []
             line = safe_readline(f)
             while line:
                 if end > 0 and f.tell() > end:
                     break
-                ids = dict.encode_line(
-                        line=line,
-                        line_tokenizer=tokenize,
-                        add_if_not_exist=False,
-                        consumer=replaced_consumer,
-                        append_eos=append_eos,
-                        reverse_order=reverse_order,
-                )
-                nseq += 1
-                ntok += len(ids)
-                consumer(ids)
+                lines.append(line)
+                if len(lines) == batch_size:
+                    encode(lines)
+                    lines = []
                 line = f.readline()
+            encode(lines)
         return {'nseq': nseq, 'nunk': sum(replaced.values()), 'ntok': ntok, 'replaced': replaced}
 
     @staticmethod
@@ -13,6 +13,13 @@ from fairseq import utils
 from . import FairseqCriterion, register_criterion
 
 
+def mean_negative_logsigmoid(nScores):
+    """Mean ``logsigmoid(-score)`` over the negatives of every triple, not
+    counting the in-batch negatives masked out with -inf."""
+    valid = nScores.ne(float('-inf'))
+    return F.logsigmoid(-nScores).masked_fill(~valid, 0).sum(dim=1) / valid.sum(dim=1).clamp(min=1).type_as(nScores)
+
+
 @register_criterion('MLMetKE')
 class MLMetKELoss(FairseqCriterion):
     """
@@ -22,8 +29,16 @@ class MLMetKELoss(FairseqCriterion):
     def __init__(self, args, task):
         super().__init__(args, task)
     def MLM_loss(self, model, sample):
-        logits = model(**sample['MLM']['net_input'], return_all_hiddens=False)[0]
-        targets = model.get_targets(sample["MLM"], [logits])
+        targets = model.get_targets(sample["MLM"], None)
+        masked_tokens = targets.ne(self.padding_idx)
+        sample_size = masked_tokens.int().sum().item()
+        # the LM head only projects the masked tokens onto the vocabulary
+        # (rare case: without any, project everything so the output is not empty)
+        if sample_size == 0:
+            masked_tokens = None
+        logits = model(**sample['MLM']['net_input'], return_all_hiddens=False, masked_tokens=masked_tokens)[0]
+        if masked_tokens is not None:
+            targets = targets[masked_tokens]
         loss = F.nll_loss(
             F.log_softmax(
                 logits.view(-1, logits.size(-1)),
@@ -34,25 +49,23 @@ class MLMetKELoss(FairseqCriterion):
             reduction='mean',
             ignore_index=self.padding_idx,
         )
-
-        sample_size = targets.ne(self.padding_idx).int().sum().item()
         return loss, sample_size
 
     def KE_loss(self, model, sample):
         relations = model.get_targets(sample["KE"],None)
         inputs=sample["KE"]["net_input"]
-        pScores, nScores, sample_size = model.KEscore(src_tokens=(inputs["heads"],inputs["tails"],inputs["nHeads"],inputs["nTails"],inputs["heads_r"],inputs["tails_r"], inputs['relation_desc'] if 'relation_desc' in inputs else None),relations=relations,ke_head_name=self.args.ke_head_name) 
+        pScores, nScores, sample_size = model.KEscore(src_tokens=(inputs["heads"],inputs["tails"],inputs.get("nHeads"),inputs.get("nTails"),inputs["heads_r"],inputs["tails_r"], inputs['relation_desc'] if 'relation_desc' in inputs else None),relations=relations,ke_head_name=self.args.ke_head_name,in_batch_negatives=inputs.get('in_batch_negatives'),memory_bank=inputs.get('memory_bank'))
         pLoss = F.logsigmoid(pScores).squeeze(dim=1)
-        nLoss = F.logsigmoid(-nScores).mean(dim=1)
+        nLoss = mean_negative_logsigmoid(nScores)
         loss = (-pLoss.mean()-nLoss.mean())/2.0
         return loss, sample_size 
 
     def KE_loss2(self, model, sample):
         relations = model.get_targets(sample["KE2"],None)
         inputs=sample["KE2"]["net_input"]
-        pScores, nScores, sample_size = model.KEscore(src_tokens=(inputs["heads"],inputs["tails"],inputs["nHeads"],inputs["nTails"],inputs["heads_r"],inputs["tails_r"], inputs['relation_desc'] if 'relation_desc' in inputs else None),relations=relations,ke_head_name=self.args.ke_head_name2) 
+        pScores, nScores, sample_size = model.KEscore(src_tokens=(inputs["heads"],inputs["tails"],inputs.get("nHeads"),inputs.get("nTails"),inputs["heads_r"],inputs["tails_r"], inputs['relation_desc'] if 'relation_desc' in inputs else None),relations=relations,ke_head_name=self.args.ke_head_name2,in_batch_negatives=inputs.get('in_batch_negatives'),memory_bank=inputs.get('memory_bank'))
         pLoss = F.logsigmoid(pScores).squeeze(dim=1)
-        nLoss = F.logsigmoid(-nScores).mean(dim=1)
+        nLoss = mean_negative_logsigmoid(nScores)
         loss = (-pLoss.mean()-nLoss.mean())/2.0 
         return loss, sample_size 
 
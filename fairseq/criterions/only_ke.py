@@ -11,6 +11,7 @@ import torch.nn.functional as F
 from fairseq import utils
 
 from . import FairseqCriterion, register_criterion
+from .MLMetKE import mean_negative_logsigmoid
 
 
 @register_criterion('OnlyKE')
@@ -100,14 +101,14 @@ class OnlyKELoss(FairseqCriterion):
     def KE_loss(self, model, sample):
         relations = model.get_targets(sample["KE"],None)
         inputs=sample["KE"]["net_input"]
-        pScores, nScores, sample_size = model.KEscore(src_tokens=(inputs["heads"],inputs["tails"],inputs["nHeads"],inputs["nTails"],inputs["heads_r"],inputs["tails_r"]),relations=relations,ke_head_name=self.args.ke_head_name)
+        pScores, nScores, sample_size = model.KEscore(src_tokens=(inputs["heads"],inputs["tails"],inputs.get("nHeads"),inputs.get("nTails"),inputs["heads_r"],inputs["tails_r"]),relations=relations,ke_head_name=self.args.ke_head_name,in_batch_negatives=inputs.get('in_batch_negatives'),memory_bank=inputs.get('memory_bank'))
         #pScores, nScores, sample_size = model.KEscore(src_tokens=sample["KE"]["net_input"]["src_tokens"],relations=relations,ke_head_name=self.args.ke_head_name)
         #print("KE_score_pre",pScores,nScores)
         #pScores=pScores.type(torch.cuda.FloatTensor)
         #nScores=nScores.type(torch.cuda.FloatTensor)
         #print("KE_score",pScores,nScores)
         pLoss = F.logsigmoid(pScores).squeeze(dim=1)
-        nLoss = F.logsigmoid(-nScores).mean(dim=1)
+        nLoss = mean_negative_logsigmoid(nScores)
         #print("pLoss",pLoss)
         #print("nLoss",nLoss)
         loss = (-pLoss.mean()-nLoss.mean())/2.0
@@ -120,14 +121,14 @@ class OnlyKELoss(FairseqCriterion):
     def KE_loss2(self, model, sample):
         relations = model.get_targets(sample["KE2"],None)
         inputs=sample["KE2"]["net_input"]
-        pScores, nScores, sample_size = model.KEscore(src_tokens=(inputs["heads"],inputs["tails"],inputs["nHeads"],inputs["nTails"],inputs["heads_r"],inputs["tails_r"]),relations=relations,ke_head_name=self.args.ke_head_name2)
+        pScores, nScores, sample_size = model.KEscore(src_tokens=(inputs["heads"],inputs["tails"],inputs.get("nHeads"),inputs.get("nTails"),inputs["heads_r"],inputs["tails_r"]),relations=relations,ke_head_name=self.args.ke_head_name2,in_batch_negatives=inputs.get('in_batch_negatives'),memory_bank=inputs.get('memory_bank'))
         #pScores, nScores, sample_size = model.KEscore(src_tokens=sample["KE"]["net_input"]["src_tokens"],relations=relations,ke_head_name=self.args.ke_head_name)
         #print("KE_score_pre",pScores,nScores)
         #pScores=pScores.type(torch.cuda.FloatTensor)
         #nScores=nScores.type(torch.cuda.FloatTensor)
         #print("KE_score",pScores,nScores)
         pLoss = F.logsigmoid(pScores).squeeze(dim=1)
-        nLoss = F.logsigmoid(-nScores).mean(dim=1)
+        nLoss = mean_negative_logsigmoid(nScores)
         #print("pLoss",pLoss)
         #print("nLoss",nLoss)
         loss = (-pLoss.mean()-nLoss.mean())/2.0
@@ -44,7 +44,9 @@ class RelationExtractionCriterion(FairseqCriterion):
             #classification_head_name='tacred',
         )
         #print(reps.size())
-        reps = torch.gather(reps,1,sample['index'])
+        index = sample['index'].long()
+        rows = torch.arange(index.size(0), device=reps.device).unsqueeze(1)
+        reps = reps[rows, index]  # B x 2 x C, the features at the two entity markers
         #print(reps.size())
         reps_ = reps.view(-1,1,self.args.encoder_embed_dim*2)
         #print(reps_.size())
@@ -43,6 +43,8 @@ from .truncate_dataset import TruncateDataset
 from .fake_numel_dataset import FakeNumelDataset
 from .ke_dataset import KEDataset
 from .ke_negative_dataset import KeNegDataset
+from .ke_entity_dataset import KeEntityDataset
+from .ke_online_negative_dataset import KeInBatchNegDataset, KeOnlineNegDataset, KeTrueEntitiesDataset
 
 from .iterators import (
     CountingIterator,
@@ -99,4 +101,8 @@ __all__ = [
     'FakeNumelDataset',
     'KEDataset',
     'KeNegDataset',
+    'KeEntityDataset',
+    'KeInBatchNegDataset',
+    'KeOnlineNegDataset',
+    'KeTrueEntitiesDataset',
 ]
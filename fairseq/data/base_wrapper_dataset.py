@@ -36,6 +36,12 @@ class BaseWrapperDataset(FairseqDataset):
     def size(self, index):
         return self.dataset.size(index)
 
+    def num_tokens_vec(self, indices):
+        return self.dataset.num_tokens_vec(indices)
+
+    def size_vec(self, indices):
+        return self.dataset.size_vec(indices)
+
     def ordered_indices(self):
         return self.dataset.ordered_indices()
 
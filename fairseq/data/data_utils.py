@@ -181,9 +181,72 @@ def filter_by_size(indices, size_fn, max_positions, raise_exception=False):
     #     ).format(len(ignored), max_positions, ignored[:10]))
 
 
+def _sizes_within(sizes, max_positions):
+    """Boolean mask of the rows of *sizes* (``[N]`` or ``[N, k]``) within
+    *max_positions*, with the component-wise rules of :func:`filter_by_size`."""
+    sizes = np.asarray(sizes)
+    if isinstance(max_positions, float) or isinstance(max_positions, int):
+        return sizes <= max_positions
+    within = np.ones(len(sizes), dtype=bool)
+    if sizes.ndim == 1:
+        for b in max_positions:
+            if b is not None:
+                within &= sizes <= b
+    else:
+        for a, b in zip(sizes.T, max_positions):
+            if b is not None:
+                within &= a <= b
+    return within
+
+
+def filter_by_size_vec(indices, sizes, max_positions, raise_exception=False):
+    """
+    Filter indices based on their precomputed sizes, with array operations.
+
+    Args:
+        indices (np.ndarray): ordered array of dataset indices
+        sizes (np.ndarray or dict): sizes of *indices*, as returned by
+            :func:`~fairseq.data.FairseqDataset.size_vec`: an ``[N]`` or
+            ``[N, k]`` array, or a dict of them (e.g., for
+            :class:`~fairseq.data.RoundRobinZipDatasets`)
+        max_positions (tuple): filter elements larger than this size.
+            Comparisons are done component-wise.
+        raise_exception (bool, optional): if ``True``, raise an exception if
+            any elements are filtered (default: False).
+
+    Returns:
+        np.ndarray: the indices that are kept
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    if isinstance(sizes, dict):
+        if isinstance(max_positions, dict):
+            keys = [key for key in sizes if key in max_positions]
+            within = np.ones(len(indices), dtype=bool)
+            for key in keys:
+                within &= _sizes_within(sizes[key], max_positions[key])
+        else:
+            # one component per dataset, as for the RoundRobin case of filter_by_size
+            keys = list(sizes)
+            within = _sizes_within(np.stack([sizes[key] for key in keys], axis=1), max_positions)
+    else:
+        within = _sizes_within(sizes, max_positions)
+
+    if raise_exception and not within.all():
+        first = np.flatnonzero(~within)[0]
+        if isinstance(sizes, dict):
+            size = {key: sizes[key][first] for key in sizes}
+        else:
+            size = sizes[first]
+        raise Exception((
+            'Size of sample #{} is invalid (={}) since max_positions={}, '
+            'skip this example with --skip-invalid-size-inputs-valid-test'
+        ).format(indices[first], size, max_positions))
+    return indices[within]
+
+
 def batch_by_size(
     indices, num_tokens_fn, max_tokens=None, max_sentences=None,
-    required_batch_size_multiple=1,
+    required_batch_size_multiple=1, num_tokens_vec=None,
 ):
     """
     Yield mini-batches of indices bucketed by size. Batches may contain
@@ -199,6 +262,9 @@ def batch_by_size(
             batch (default: None).
         required_batch_size_multiple (int, optional): require batch size to
             be a multiple of N (default: 1).
+        num_tokens_vec (np.ndarray, optional): precomputed number of tokens
+            of every index in *indices*; replaces *num_tokens_fn* with a
+            plain lookup (default: None).
     """
     max_tokens = max_tokens if max_tokens is not None else sys.maxsize
     max_sentences = max_sentences if max_sentences is not None else sys.maxsize
@@ -206,6 +272,11 @@ def batch_by_size(
 
     if isinstance(indices, types.GeneratorType):
         indices = np.fromiter(indices, dtype=np.int64, count=-1)
+    if num_tokens_vec is not None:
+        assert len(num_tokens_vec) == len(indices)
+        lookup = np.zeros(np.max(indices) + 1 if len(indices) > 0 else 0, dtype=np.int64)
+        lookup[indices] = num_tokens_vec
+        num_tokens_fn = lookup.tolist().__getitem__
     return batch_by_size_fast(indices, num_tokens_fn, max_tokens, max_sentences, bsz_mult)
 
 
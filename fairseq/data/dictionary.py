@@ -6,13 +6,21 @@
 from collections import Counter
 from multiprocessing import Pool
 import os
+import re
 
+import numpy as np
 import torch
 
 from fairseq.tokenizer import tokenize_line
 from fairseq.binarizer import safe_readline
 from fairseq.data import data_utils
 
+# text of whitespace separated, canonical decimal integers (e.g. GPT-2 BPE ids),
+# in ASCII only: str.isdigit() also accepts symbols like '²' that int() rejects
+INT_SYMBOL = re.compile(r"0|[1-9][0-9]*")
+INT_TEXT = re.compile(r"[0-9 \t\n\r\f\v]*")
+LEADING_ZERO = re.compile(r"(?<![0-9])0[0-9]")
+
 
 class Dictionary(object):
     """A mapping from symbols to consecutive integers"""
@@ -261,6 +269,74 @@ class Dictionary(object):
             ids[nwords] = self.eos_index
         return ids
 
+    def int_symbol_table(self):
+        """Lookup array from the integer symbols of the dictionary (e.g. the
+        GPT-2 BPE ids of a RoBERTa ``dict.txt``) to their indices, with
+        :func:`unk` for the integers in between, or ``None`` if no symbol is an
+        integer."""
+        key = (id(self.indices), len(self.indices))
+        if getattr(self, '_int_symbol_table_key', None) != key:
+            symbols = [
+                (int(sym), idx) for sym, idx in self.indices.items()
+                if isinstance(sym, str) and INT_SYMBOL.fullmatch(sym)
+            ]
+            table = None
+            if len(symbols) > 0:
+                symbols, indices = np.array(symbols, dtype=np.int64).T
+                table = np.full(symbols.max() + 1, self.unk_index, dtype=np.int64)
+                table[symbols] = indices
+            self._int_symbol_table, self._int_symbol_table_key = table, key
+        return self._int_symbol_table
+
+    def encode_lines(self, lines, line_tokenizer=tokenize_line, append_eos=True, reverse_order=False):
+        """Encode a batch of lines in one vectorized pass, as
+        :func:`encode_line` with ``add_if_not_exist=False`` does line by line.
+
+        Lines of integers (e.g. GPT-2 BPE ids) are parsed at once and mapped
+        through :func:`int_symbol_table`, other lines go through one lookup of
+        every word in the symbol table.
+
+        Returns:
+            tuple: a list of ``IntTensor``, one per line, and a ``Counter`` of
+            the words replaced by :func:`unk`
+        """
+        table = self.int_symbol_table() if line_tokenizer is tokenize_line else None
+        text = ' '.join(lines)
+        if table is not None and INT_TEXT.fullmatch(text) and not LEADING_ZERO.search(text):
+            lens = np.array([len(line.split()) for line in lines], dtype=np.int64)
+            words = np.fromstring(text, dtype=np.int64, sep=' ') if lens.sum() > 0 else np.zeros(0, dtype=np.int64)
+            ids = np.full(len(words), self.unk_index, dtype=np.int64)
+            known = words < len(table)
+            ids[known] = table[words[known]]
+            replaced = Counter(str(words[i]) for i in np.flatnonzero(ids == self.unk_index))
+        else:
+            words = [line_tokenizer(line) for line in lines]
+            lens = np.array([len(line_words) for line_words in words], dtype=np.int64)
+            words = [word for line_words in words for word in line_words]
+            get = self.indices.get
+            ids = np.array([get(word, self.unk_index) for word in words], dtype=np.int64)
+            replaced = Counter(
+                words[i] for i in np.flatnonzero(ids == self.unk_index) if words[i] != self.unk_word
+            )
+        return self._split_lines(ids, lens, append_eos, reverse_order), replaced
+
+    def _split_lines(self, ids, lens, append_eos, reverse_order):
+        """Per-line ``IntTensor`` of the concatenated *ids* of lines of *lens* words."""
+        if len(lens) == 0:
+            return []
+        out_lens = lens + 1 if append_eos else lens
+        out_starts = np.cumsum(out_lens) - out_lens
+        word_starts = np.cumsum(lens) - lens
+        # position of every word in its line
+        pos = np.arange(len(ids)) - np.repeat(word_starts, lens)
+        if reverse_order:
+            pos = np.repeat(lens, lens) - 1 - pos
+        out = np.empty(out_lens.sum(), dtype=np.int32)
+        out[np.repeat(out_starts, lens) + pos] = ids
+        if append_eos:
+            out[out_starts + lens] = self.eos_index
+        return list(torch.from_numpy(out).split(out_lens.tolist()))
+
     @staticmethod
     def _add_file_to_dictionary_single_worker(filename, tokenize, eos_word, worker_id=0, num_workers=1):
         counter = Counter()
@@ -561,6 +637,12 @@ class BertDictionary(Dictionary):
             ids[nwords] = self.eos_index
         return ids
 
+    def encode_lines(self, lines, line_tokenizer=tokenize_line, append_eos=True, reverse_order=False):
+        words = [line_tokenizer(line) for line in lines]
+        lens = np.array([len(line_words) for line_words in words], dtype=np.int64)
+        ids = np.array([int(word) for line_words in words for word in line_words], dtype=np.int64)
+        return self._split_lines(ids, lens, append_eos, reverse_order), Counter()
+
     @staticmethod
     def _add_file_to_dictionary_single_worker(filename, tokenize, eos_word, worker_id=0, num_workers=1):
         raise NotImplementedError
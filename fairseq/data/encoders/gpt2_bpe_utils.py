@@ -6,7 +6,12 @@ Original license: MIT
 """
 
 from functools import lru_cache
+import hashlib
 import json
+import os
+import uuid
+
+import numpy as np
 
 
 @lru_cache()
@@ -44,7 +49,7 @@ def get_pairs(word):
 
 class Encoder:
 
-    def __init__(self, encoder, bpe_merges, errors='replace'):
+    def __init__(self, encoder, bpe_merges, errors='replace', cache_path=None):
         self.encoder = encoder
         self.decoder = {v:k for k,v in self.encoder.items()}
         self.errors = errors # how to handle errors in decoding
@@ -52,6 +57,12 @@ class Encoder:
         self.byte_decoder = {v:k for k, v in self.byte_encoder.items()}
         self.bpe_ranks = dict(zip(bpe_merges, range(len(bpe_merges))))
         self.cache = {}
+        # ids of every raw (pre byte-encoding) token seen, and those not found in the persistent cache
+        self.ids_cache = {}
+        self.new_words = {}
+        self.persistent_cache = None
+        if cache_path is not None:
+            self.persistent_cache = BpeCache(cache_path, vocab_hash(encoder, bpe_merges))
 
         try:
             import regex as re
@@ -65,57 +76,183 @@ class Encoder:
     def bpe(self, token):
         if token in self.cache:
             return self.cache[token]
-        word = tuple(token)
-        pairs = get_pairs(word)
-
-        if not pairs:
-            return token
+        word = ' '.join(self.merge(token))
+        self.cache[token] = word
+        return word
 
-        while True:
-            bigram = min(pairs, key = lambda pair: self.bpe_ranks.get(pair, float('inf')))
-            if bigram not in self.bpe_ranks:
+    def merge(self, token):
+        """Symbols of a byte-encoded token: the lowest-ranked adjacent pair is
+        merged everywhere (left to right), until no pair is a BPE merge."""
+        ranks = self.bpe_ranks
+        no_merge = len(ranks)
+        word = list(token)
+        while len(word) > 1:
+            pair_ranks = [ranks.get(pair, no_merge) for pair in zip(word, word[1:])]
+            rank = min(pair_ranks)
+            if rank == no_merge:
                 break
-            first, second = bigram
             new_word = []
-            i = 0
-            while i < len(word):
-                try:
-                    j = word.index(first, i)
-                    new_word.extend(word[i:j])
-                    i = j
-                except:
-                    new_word.extend(word[i:])
-                    break
-
-                if word[i] == first and i < len(word)-1 and word[i+1] == second:
-                    new_word.append(first+second)
+            i, n = 0, len(pair_ranks)
+            while i <= n:
+                if i < n and pair_ranks[i] == rank:
+                    new_word.append(word[i] + word[i + 1])
                     i += 2
                 else:
                     new_word.append(word[i])
                     i += 1
-            new_word = tuple(new_word)
             word = new_word
-            if len(word) == 1:
-                break
-            else:
-                pairs = get_pairs(word)
-        word = ' '.join(word)
-        self.cache[token] = word
         return word
 
+    def token_ids(self, token):
+        """BPE ids of one pre-tokenized piece of text."""
+        ids = self.ids_cache.get(token)
+        if ids is None:
+            if self.persistent_cache is not None:
+                ids = self.persistent_cache.get(token)
+            if ids is None:
+                ids = [self.encoder[bpe_token]
+                       for bpe_token in self.merge(''.join(self.byte_encoder[b] for b in token.encode('utf-8')))]
+                if self.persistent_cache is not None:
+                    self.new_words[token] = ids
+            self.ids_cache[token] = ids
+        return ids
+
     def encode(self, text):
         bpe_tokens = []
         for token in self.re.findall(self.pat, text):
-            token = ''.join(self.byte_encoder[b] for b in token.encode('utf-8'))
-            bpe_tokens.extend(self.encoder[bpe_token] for bpe_token in self.bpe(token).split(' '))
+            bpe_tokens.extend(self.token_ids(token))
         return bpe_tokens
 
+    def pop_new_words(self):
+        """Words encoded since the last call that the persistent cache lacks,
+        as a ``{token: ids}`` dict for :func:`BpeCache.update`."""
+        new_words, self.new_words = self.new_words, {}
+        return new_words
+
     def decode(self, tokens):
         text = ''.join([self.decoder[token] for token in tokens])
         text = bytearray([self.byte_decoder[c] for c in text]).decode('utf-8', errors=self.errors)
         return text
 
-def get_encoder(encoder_json_path, vocab_bpe_path):
+
+def vocab_hash(encoder, bpe_merges):
+    """SHA-1 of a BPE vocabulary, which a persistent cache is only valid for."""
+    sha1 = hashlib.sha1()
+    sha1.update(json.dumps(encoder, sort_keys=True).encode('utf-8'))
+    sha1.update('\n'.join(' '.join(merge) for merge in bpe_merges).encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def word_hash(token):
+    """64-bit key of a raw token in the persistent cache."""
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class BpeCache(object):
+    """Persistent word -> BPE ids cache of one vocabulary, read through memory maps.
+
+    A generation of the cache is stored in ``keys.<name>.npy`` (sorted
+    uint64 word hashes), ``offsets.<name>.npy`` and ``ids.<name>.npy``,
+    where *name* is unique to the process that wrote it; ``meta.json``,
+    replaced atomically once the arrays are written, names the current
+    generation. Any number of processes (e.g. the workers of a
+    multiprocessing encoder) can map the same cache, and the OS shares its
+    pages between them. Concurrent updates never mix the arrays of two
+    writers, though the words of all but the last one may be lost. Words
+    are identified by a 64-bit hash.
+
+    Args:
+        path (str): cache directory
+        vocab (str): :func:`vocab_hash` of the BPE vocabulary
+    """
+
+    def __init__(self, path, vocab):
+        self.path = path
+        self.vocab = vocab
+        self._load()
+
+    def _load(self, attempts=10):
+        self.generation = -1
+        self.name = None
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.ids = np.zeros(0, dtype=np.int32)
+        meta_path = os.path.join(self.path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta['vocab'] != self.vocab:
+            raise ValueError('BPE cache {} was built for another vocabulary'.format(self.path))
+        # caches written before generations were named use the generation number
+        generation_name = meta.get('name', str(meta['generation']))
+        try:
+            keys, offsets, ids = (
+                np.load(self._file(name, generation_name), mmap_mode='r') for name in ['keys', 'offsets', 'ids']
+            )
+        except FileNotFoundError:
+            # a writer replaced this generation after meta.json was read
+            if attempts <= 1:
+                raise
+            return self._load(attempts - 1)
+        self.generation, self.name = meta['generation'], generation_name
+        self.keys, self.offsets, self.ids = keys, offsets, ids
+
+    def _file(self, name, generation_name=None):
+        generation_name = self.name if generation_name is None else generation_name
+        return os.path.join(self.path, '{}.{}.npy'.format(name, generation_name))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, token):
+        """BPE ids of *token*, or ``None`` if it is not cached."""
+        key = np.uint64(word_hash(token))
+        i = int(np.searchsorted(self.keys, key))
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        return self.ids[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+    def update(self, words):
+        """Write a new generation with the ``{token: ids}`` entries of
+        *words* added, and switch to it."""
+        self._load()  # merge into the latest generation of other writers
+        words = {word_hash(token): ids for token, ids in words.items()}
+        new_keys = np.fromiter(words, dtype=np.uint64, count=len(words))
+        new_keys = new_keys[~np.isin(new_keys, self.keys)]
+        if len(new_keys) == 0:
+            return
+        new_lens = np.array([len(words[int(key)]) for key in new_keys], dtype=np.int64)
+        new_ids = np.fromiter((i for key in new_keys for i in words[int(key)]), dtype=np.int32, count=new_lens.sum())
+
+        keys = np.concatenate([self.keys, new_keys])
+        lens = np.concatenate([np.diff(self.offsets), new_lens])
+        starts = np.concatenate([self.offsets[:-1], len(self.ids) + np.cumsum(new_lens) - new_lens])
+        all_ids = np.concatenate([self.ids, new_ids])
+        order = np.argsort(keys, kind='mergesort')
+        offsets = np.concatenate([[0], np.cumsum(lens[order])])
+        ids = all_ids[np.repeat(starts[order] - offsets[:-1], lens[order]) + np.arange(offsets[-1])]
+
+        generation = self.generation + 1
+        name = '{}-{}'.format(generation, uuid.uuid4().hex)
+        os.makedirs(self.path, exist_ok=True)
+        for array_name, array in [('keys', keys[order]), ('offsets', offsets), ('ids', ids)]:
+            np.save(self._file(array_name, name), array)
+        meta_path = os.path.join(self.path, 'meta.json')
+        with open('{}.{}.tmp'.format(meta_path, name), 'w') as f:
+            json.dump({'vocab': self.vocab, 'generation': generation, 'name': name, 'num_words': len(keys)}, f)
+        os.replace('{}.{}.tmp'.format(meta_path, name), meta_path)
+        # readers that still map the old generation keep their (unlinked) files
+        for array_name in ['keys', 'offsets', 'ids']:
+            try:
+                if self.name is not None:
+                    os.remove(self._file(array_name))
+            except FileNotFoundError:
+                pass  # already removed by a concurrent writer
+        self._load()
+
+
+def get_encoder(encoder_json_path, vocab_bpe_path, cache_path=None):
     with open(encoder_json_path, 'r') as f:
         encoder = json.load(f)
     with open(vocab_bpe_path, 'r', encoding="utf-8") as f:
@@ -124,4 +261,5 @@ def get_encoder(encoder_json_path, vocab_bpe_path):
     return Encoder(
         encoder=encoder,
         bpe_merges=bpe_merges,
+        cache_path=cache_path,
     )
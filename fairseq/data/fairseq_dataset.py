@@ -37,6 +37,18 @@ class FairseqDataset(torch.utils.data.Dataset):
         filtering a dataset with ``--max-positions``."""
         raise NotImplementedError
 
+    def num_tokens_vec(self, indices):
+        """Return the number of tokens of every sample in *indices* as an
+        array. Override with array operations where the sizes are
+        precomputed; batching calls this once per epoch."""
+        return np.fromiter((self.num_tokens(index) for index in indices), dtype=np.int64, count=len(indices))
+
+    def size_vec(self, indices):
+        """Return the sizes of the samples in *indices* as an array (or a
+        dict of arrays, like :func:`size`), or ``None`` if they are only
+        available through :func:`size`."""
+        return None
+
     def ordered_indices(self):
         """Return an ordered list of indices. Batches will be constructed based
         on this order."""
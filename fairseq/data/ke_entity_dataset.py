@@ -0,0 +1,50 @@
+# Copyright Xiaozhi Wang
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import numpy as np
+
+from . import BaseWrapperDataset
+
+
+class KeEntityDataset(BaseWrapperDataset):
+    """Gathers entity descriptions by entity id from a shared description store.
+
+    Each description is stored once in *dataset* (one row per entity) and
+    *entity_ids* holds, for every KE instance, the id of the entity to read.
+
+    Args:
+        dataset (~torch.utils.data.Dataset): entity description store
+        entity_ids (np.ndarray): entity id of each item
+    """
+
+    def __init__(self, dataset, entity_ids):
+        super().__init__(dataset)
+        self.entity_ids = entity_ids
+        self._sizes = np.asarray(dataset.sizes)[entity_ids]
+
+    def __getitem__(self, index):
+        return self.dataset[int(self.entity_ids[index])]
+
+    def __len__(self):
+        return len(self.entity_ids)
+
+    @property
+    def sizes(self):
+        return self._sizes
+
+    def num_tokens(self, index):
+        return self._sizes[index]
+
+    def size(self, index):
+        return self._sizes[index]
+
+    def num_tokens_vec(self, indices):
+        return self._sizes[indices]
+
+    def size_vec(self, indices):
+        return self._sizes[indices]
+
+    def prefetch(self, indices):
+        self.dataset.prefetch(np.unique(np.asarray(self.entity_ids)[indices]))
@@ -0,0 +1,305 @@
+# Copyright Xiaozhi Wang
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import numpy as np
+import torch
+
+from . import BaseWrapperDataset, FairseqDataset, data_utils
+
+
+def group_by_key(keys, values):
+    """Group *values* by *keys* in CSR form.
+
+    Returns:
+        tuple: sorted unique keys, offsets into the values (``len(keys) + 1``)
+        and the values sorted by key and then by value.
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    values = np.asarray(values, dtype=np.int64)
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    uniq, starts = np.unique(keys, return_index=True)
+    return uniq, np.append(starts, len(keys)), values
+
+
+def lookup(groups, key):
+    """Return the (sorted) values grouped under *key*, or an empty array."""
+    keys, offsets, values = groups
+    i = np.searchsorted(keys, key)
+    if i < len(keys) and keys[i] == key:
+        return values[offsets[i]:offsets[i + 1]]
+    return values[:0]
+
+
+def lookup_batch(groups, keys):
+    """Vectorized :func:`lookup`: the values of every key, concatenated, and
+    the number of values of each key."""
+    uniq, offsets, values = groups
+    keys = np.asarray(keys, dtype=np.int64)
+    if len(uniq) == 0:
+        return values[:0], np.zeros(len(keys), dtype=np.int64)
+    pos = np.minimum(np.searchsorted(uniq, keys), len(uniq) - 1)
+    found = uniq[pos] == keys
+    starts = np.where(found, offsets[pos], 0)
+    ends = np.where(found, offsets[pos + 1], 0)
+    return gather_ranges(values, starts, ends), ends - starts
+
+
+def gather_ranges(values, starts, ends):
+    """Concatenate ``values[s:e]`` for every (s, e) without a Python loop."""
+    lens = ends - starts
+    if lens.sum() == 0:
+        return values[:0]
+    shift = np.repeat(starts - np.cumsum(lens) + lens, lens)
+    return values[shift + np.arange(lens.sum())]
+
+
+def in_sorted(a, sorted_b):
+    """Element-wise membership of *a* in the sorted array *sorted_b*."""
+    if len(sorted_b) == 0:
+        return np.zeros(len(a), dtype=bool)
+    idx = np.minimum(np.searchsorted(sorted_b, a), len(sorted_b) - 1)
+    return sorted_b[idx] == a
+
+
+class KeTrueEntities(object):
+    """True heads of every (relation, tail) and true tails of every
+    (head, relation), used to filter negative samples.
+
+    Args:
+        triples (np.ndarray): ``[N, 3]`` array of (head, relation, tail) ids
+        num_entities (int): number of entities
+        num_relations (int): number of relations
+    """
+
+    def __init__(self, triples, num_entities, num_relations):
+        h, r, t = (np.asarray(triples[:, i], dtype=np.int64) for i in range(3))
+        self.num_entities = num_entities
+        self.num_relations = num_relations
+        self.heads = group_by_key(r * num_entities + t, h)
+        self.tails = group_by_key(h * num_relations + r, t)
+
+    def true_heads(self, relation, tail):
+        return lookup(self.heads, relation * self.num_entities + tail)
+
+    def true_tails(self, head, relation):
+        return lookup(self.tails, head * self.num_relations + relation)
+
+
+class KeCitationNeighbourhood(object):
+    """Candidate negatives from the citation graph, as in
+    ``KGpreprocessAdvanced.py``.
+
+    For a tail, the *local* candidate heads are the ``paper_contexts`` of
+    every entry citing it; for a head, the candidate tails are the
+    ``citations`` of every entry whose ``paper_contexts`` contain it. With
+    *global* sampling, every entity appearing on that side of any entry is a
+    candidate.
+
+    Args:
+        json_data (list): entries of ``citations_per_paper_id.json``
+        negative_sampling_type (str): 'local' or 'global'
+    """
+
+    def __init__(self, json_data, negative_sampling_type='local'):
+        assert negative_sampling_type in ['local', 'global']
+        self.negative_sampling_type = negative_sampling_type
+        self.sides = {}
+        for side in ['paper_contexts', 'citations']:
+            members = [np.asarray(entry[side], dtype=np.int64) for entry in json_data]
+            lens = np.array([len(m) for m in members], dtype=np.int64)
+            offsets = np.append(0, np.cumsum(lens))
+            members = np.concatenate(members) if len(members) > 0 else np.zeros(0, dtype=np.int64)
+            entries = np.repeat(np.arange(len(json_data)), lens)
+            self.sides[side] = {
+                'offsets': offsets,
+                'members': members,
+                'entries': group_by_key(members, entries),
+                'all': np.unique(members),
+            }
+
+    def candidates(self, entity, mode):
+        """Sorted unique candidate heads ('head-batch') or tails
+        ('tail-batch') for the given tail or head *entity*."""
+        source, target = ('citations', 'paper_contexts') if mode == 'head-batch' \
+            else ('paper_contexts', 'citations')
+        target = self.sides[target]
+        if self.negative_sampling_type == 'global':
+            return target['all']
+        entries = lookup(self.sides[source]['entries'], entity)
+        offsets = target['offsets']
+        return np.unique(gather_ranges(target['members'], offsets[entries], offsets[entries + 1]))
+
+
+class KeNegativeSampler(object):
+    """Draws filtered negative heads or tails for a triple with the global
+    NumPy RNG (callers seed it, see :class:`KeOnlineNegDataset`).
+
+    Without *neighbourhood*, negatives are drawn uniformly from all entities
+    as in ``KGpreprocess.py``. Otherwise they are drawn without replacement
+    from the citation neighbourhood; if the neighbourhood has fewer than
+    *size* valid candidates we fall back to uniform sampling, since online
+    sampling cannot drop the triple like the offline dump does.
+
+    Args:
+        true_entities (KeTrueEntities): known true triples
+        num_entities (int): number of entities
+        neighbourhood (KeCitationNeighbourhood, optional): citation graph
+    """
+
+    def __init__(self, true_entities, num_entities, neighbourhood=None):
+        self.true_entities = true_entities
+        self.num_entities = num_entities
+        self.neighbourhood = neighbourhood
+
+    def _true(self, h, r, t, mode):
+        if mode == 'head-batch':
+            return self.true_entities.true_heads(r, t)
+        return self.true_entities.true_tails(h, r)
+
+    def sample(self, h, r, t, mode, size):
+        true = self._true(h, r, t, mode)
+        if self.neighbourhood is not None:
+            candidates = self.neighbourhood.candidates(t if mode == 'head-batch' else h, mode)
+            candidates = candidates[~in_sorted(candidates, true)]
+            if len(candidates) >= size:
+                return np.random.choice(candidates, size, replace=False)
+        negative_sample_list = []
+        negative_sample_size = 0
+        while negative_sample_size < size:
+            negative_sample = np.random.randint(self.num_entities, size=size * 2)
+            negative_sample = negative_sample[~in_sorted(negative_sample, true)]
+            negative_sample_list.append(negative_sample)
+            negative_sample_size += negative_sample.size
+        return np.concatenate(negative_sample_list)[:size]
+
+
+class KeOnlineNegDataset(BaseWrapperDataset):
+    """Negative heads or tails drawn on the fly for every triple.
+
+    Replaces :class:`KeNegDataset` over an offline dump: the negatives of
+    item *index* are seeded by (seed, epoch, index), so they are
+    reproducible but fresh in every epoch.
+
+    Args:
+        dataset (~torch.utils.data.Dataset): entity descriptions indexed by
+            entity id
+        triples (np.ndarray): ``[N, 3]`` array of (head, relation, tail) ids
+        sampler (KeNegativeSampler): negative sampler
+        mode (str): 'head-batch' or 'tail-batch'
+        negative_sample_size (int): number of negatives per triple
+        seed (int): seed for the random number generator
+        epoch (int): initial epoch
+    """
+
+    def __init__(self, dataset, triples, sampler, mode, negative_sample_size, seed=1, epoch=0):
+        super().__init__(dataset)
+        assert mode in ['head-batch', 'tail-batch']
+        self.triples = triples
+        self.sampler = sampler
+        self.mode = mode
+        self.ns = negative_sample_size
+        self.seed = seed
+        self.epoch = epoch
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def negative_ids(self, index):
+        h, r, t = (int(x) for x in self.triples[index])
+        with data_utils.numpy_seed(self.seed, self.epoch, index, self.mode == 'tail-batch'):
+            return self.sampler.sample(h, r, t, self.mode, self.ns)
+
+    def __getitem__(self, index):
+        return [self.dataset[int(x)] for x in self.negative_ids(index)]
+
+    def collater(self, samples):
+        return self.dataset.collater([y for x in samples for y in x])
+
+    def __len__(self):
+        return len(self.triples)
+
+
+class KeInBatchNegDataset(FairseqDataset):
+    """Masks of the in-batch negatives of every triple.
+
+    With in-batch negatives the heads or tails already encoded for a batch
+    are the negatives of the other triples of the batch, so no negative
+    description is loaded. Item *index* is the triple itself, and the
+    collater returns a ``[B, B]`` bool mask that is True where the head
+    ('head-batch') or tail ('tail-batch') of triple *j* is a valid negative
+    for triple *i*: it is not the true entity of *i* and does not form a
+    known true triple with it.
+
+    Args:
+        triples (np.ndarray): ``[N, 3]`` array of (head, relation, tail) ids
+        true_entities (KeTrueEntities): known true triples
+        mode (str): 'head-batch' or 'tail-batch'
+    """
+
+    def __init__(self, triples, true_entities, mode):
+        super().__init__()
+        assert mode in ['head-batch', 'tail-batch']
+        self.triples = triples
+        self.true_entities = true_entities
+        self.mode = mode
+
+    def __getitem__(self, index):
+        return index
+
+    def collater(self, samples):
+        triples = np.asarray(self.triples[np.asarray(samples, dtype=np.int64)], dtype=np.int64).reshape(-1, 3)
+        h, r, t = triples[:, 0], triples[:, 1], triples[:, 2]
+        true = self.true_entities
+        if self.mode == 'head-batch':
+            entities, (values, lens) = h, lookup_batch(true.heads, r * true.num_entities + t)
+        else:
+            entities, (values, lens) = t, lookup_batch(true.tails, h * true.num_relations + r)
+        # (row, entity) pairs of the known true triples, against every (row, entity of the batch)
+        rows = np.arange(len(triples))
+        known = np.sort(np.repeat(rows, lens) * true.num_entities + values)
+        pairs = rows[:, None] * true.num_entities + entities[None, :]
+        valid = ~in_sorted(pairs.reshape(-1), known).reshape(pairs.shape) & (entities[None, :] != entities[:, None])
+        return torch.from_numpy(valid)
+
+    def __len__(self):
+        return len(self.triples)
+
+
+class KeTrueEntitiesDataset(FairseqDataset):
+    """Known true heads ('head-batch') or tails ('tail-batch') of every
+    triple, to filter negatives drawn on the model side (see
+    :class:`~fairseq.modules.KeMemoryBank`). The collater returns a
+    ``[B, L]`` LongTensor padded with -1.
+
+    Args:
+        triples (np.ndarray): ``[N, 3]`` array of (head, relation, tail) ids
+        true_entities (KeTrueEntities): known true triples
+        mode (str): 'head-batch' or 'tail-batch'
+    """
+
+    def __init__(self, triples, true_entities, mode):
+        super().__init__()
+        assert mode in ['head-batch', 'tail-batch']
+        self.triples = triples
+        self.true_entities = true_entities
+        self.mode = mode
+
+    def __getitem__(self, index):
+        return index
+
+    def collater(self, samples):
+        triples = np.asarray(self.triples[np.asarray(samples, dtype=np.int64)], dtype=np.int64).reshape(-1, 3)
+        true = self.true_entities
+        if self.mode == 'head-batch':
+            values, lens = lookup_batch(true.heads, triples[:, 1] * true.num_entities + triples[:, 2])
+        else:
+            values, lens = lookup_batch(true.tails, triples[:, 0] * true.num_relations + triples[:, 1])
+        padded = np.full((len(triples), max(lens.max(), 1) if len(lens) > 0 else 1), -1, dtype=np.int64)
+        padded[np.repeat(np.arange(len(triples)), lens), np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens)] = values
+        return torch.from_numpy(padded)
+
+    def __len__(self):
+        return len(self.triples)
@@ -3,6 +3,8 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import numpy as np
+
 from . import BaseWrapperDataset
 
 
@@ -25,5 +27,11 @@ class ListDataset(BaseWrapperDataset):
     def size(self, index):
         return self.sizes[index]
 
+    def num_tokens_vec(self, indices):
+        return np.asarray(self.sizes)[indices]
+
+    def size_vec(self, indices):
+        return np.asarray(self.sizes)[indices]
+
     def set_epoch(self, epoch):
         pass
@@ -5,6 +5,7 @@
 
 from collections import OrderedDict
 
+import numpy as np
 import torch
 from torch.utils.data.dataloader import default_collate
 
@@ -99,6 +100,15 @@ class NestedDictionaryDataset(FairseqDataset):
         else:
             return (s[index] for s in self.sizes)
 
+    def num_tokens_vec(self, indices):
+        return np.max([np.asarray(s)[indices] for s in self.sizes], axis=0)
+
+    def size_vec(self, indices):
+        if len(self.sizes) == 1:
+            return np.asarray(self.sizes[0])[indices]
+        else:
+            return np.stack([np.asarray(s)[indices] for s in self.sizes], axis=1)
+
     @property
     def supports_prefetch(self):
         """Whether this dataset supports prefetching."""
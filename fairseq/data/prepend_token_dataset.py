@@ -40,3 +40,15 @@ class PrependTokenDataset(BaseWrapperDataset):
         if self.token is not None:
             n += 1
         return n
+
+    def num_tokens_vec(self, indices):
+        n = self.dataset.num_tokens_vec(indices)
+        if self.token is not None:
+            n = n + 1
+        return n
+
+    def size_vec(self, indices):
+        n = self.dataset.size_vec(indices)
+        if n is not None and self.token is not None:
+            n = n + 1
+        return n
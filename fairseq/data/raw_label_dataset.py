@@ -3,6 +3,7 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import numpy as np
 import torch
 
 from . import FairseqDataset
@@ -21,4 +22,6 @@ class RawLabelDataset(FairseqDataset):
         return len(self.labels)
 
     def collater(self, samples):
+        if len(samples) > 0 and isinstance(samples[0], np.ndarray):
+            return torch.from_numpy(np.stack(samples))
         return torch.tensor(samples)
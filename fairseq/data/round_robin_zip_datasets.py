@@ -44,6 +44,11 @@ class RoundRobinZipDatasets(FairseqDataset):
             'Must call RoundRobinZipDatasets.ordered_indices() first'
         return self._ordered_indices[key][index % len(self.datasets[key])]
 
+    def _map_indices(self, key, indices):
+        assert self._ordered_indices is not None, \
+            'Must call RoundRobinZipDatasets.ordered_indices() first'
+        return np.asarray(self._ordered_indices[key])[np.asarray(indices) % len(self.datasets[key])]
+
     def __getitem__(self, index):
         if self.eval_key is None:
             return OrderedDict([
@@ -86,6 +91,21 @@ class RoundRobinZipDatasets(FairseqDataset):
             for key, dataset in self.datasets.items()
         }
 
+    def num_tokens_vec(self, indices):
+        return np.max([
+            dataset.num_tokens_vec(self._map_indices(key, indices))
+            for key, dataset in self.datasets.items()
+        ], axis=0)
+
+    def size_vec(self, indices):
+        sizes = OrderedDict([
+            (key, dataset.size_vec(self._map_indices(key, indices)))
+            for key, dataset in self.datasets.items()
+        ])
+        if any(s is None for s in sizes.values()):
+            return None
+        return sizes
+
     def ordered_indices(self):
         """Ordered indices for batching."""
         if self._ordered_indices is None:
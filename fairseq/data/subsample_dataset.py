@@ -43,6 +43,12 @@ class SubsampleDataset(BaseWrapperDataset):
     def size(self, index):
         return self.dataset.size(self.indices[index])
 
+    def num_tokens_vec(self, indices):
+        return self.dataset.num_tokens_vec(self.indices[indices])
+
+    def size_vec(self, indices):
+        return self.dataset.size_vec(self.indices[indices])
+
     def ordered_indices(self):
         """Return an ordered list of indices. Batches will be constructed based
         on this order."""
@@ -0,0 +1,198 @@
+# Copyright Xiaozhi Wang
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Approximate top-k entity prediction for TransE embeddings.
+
+The best tails of ``(h, r, ?)`` are the entities closest to the query
+vector ``h + r`` (and the best heads of ``(?, r, t)`` those closest to
+``t - r``) under the L1 distance, since TransE scores ``margin - ||h + r -
+t||_1``. :class:`KeIVFIndex` is an inverted-file index over the entity
+embeddings: entities are clustered with k-means, and a query only scores
+the entities of its ``num_probe`` closest clusters.
+"""
+
+import hashlib
+
+import numpy as np
+import torch
+
+from fairseq.data.ke_online_negative_dataset import gather_ranges
+
+
+def transe_queries(entity_embeddings, relation_embeddings, triplets, target='tail'):
+    """Query vectors of (head, relation, tail) id triplets: ``h + r`` for
+    tail prediction, ``t - r`` for head prediction."""
+    triplets = np.asarray(triplets, dtype=np.int64).reshape(-1, 3)
+    entity_embeddings = np.asarray(entity_embeddings)
+    relation = np.asarray(relation_embeddings)[triplets[:, 1]]
+    if target == 'tail':
+        return entity_embeddings[triplets[:, 0]] + relation
+    assert target == 'head'
+    return entity_embeddings[triplets[:, 2]] - relation
+
+
+@torch.no_grad()
+def exhaustive_search(embeddings, queries, k, p=1, batch_size=256, block_size=65536, device='cpu'):
+    """Exact *k* nearest embeddings of every query.
+
+    Returns:
+        tuple: ``[N, k]`` ids and distances, closest first
+    """
+    embeddings = torch.as_tensor(np.asarray(embeddings), dtype=torch.float, device=device)
+    queries = torch.as_tensor(np.asarray(queries), dtype=torch.float, device=device)
+    ids, dists = [], []
+    for s in range(0, len(queries), batch_size):
+        best_dist = torch.zeros(len(queries[s:s + batch_size]), 0, device=device)
+        best_id = torch.zeros(len(best_dist), 0, dtype=torch.long, device=device)
+        for b in range(0, len(embeddings), block_size):
+            dist = torch.cdist(queries[s:s + batch_size], embeddings[b:b + block_size], p=p)
+            block_id = torch.arange(b, b + dist.size(1), device=device).expand_as(dist)
+            best_dist, top = torch.cat([best_dist, dist], dim=1).topk(min(k, best_dist.size(1) + dist.size(1)),
+                                                                     dim=1, largest=False)
+            best_id = torch.cat([best_id, block_id], dim=1).gather(1, top)
+        ids.append(best_id.cpu().numpy())
+        dists.append(best_dist.cpu().numpy())
+    return np.concatenate(ids), np.concatenate(dists)
+
+
+def recall_at_k(ids, exact_ids):
+    """Mean fraction of the exact top-k found by an approximate search."""
+    ids, exact_ids = np.asarray(ids), np.asarray(exact_ids)
+    hits = [len(np.intersect1d(a, b)) for a, b in zip(ids, exact_ids)]
+    return float(np.mean(hits)) / exact_ids.shape[1] if len(hits) > 0 else 0.0
+
+
+def embedding_fingerprint(embeddings, num_samples=1024):
+    """Shape of *embeddings* and a hash of up to *num_samples* evenly spaced
+    rows (the last one included), cheap enough to check on every load."""
+    n, dim = embeddings.shape
+    sample = np.unique(np.linspace(0, n - 1, min(num_samples, n)).astype(np.int64))
+    digest = hashlib.blake2b(np.ascontiguousarray(embeddings[sample], dtype=np.float32).tobytes(), digest_size=8)
+    return '{}x{}:{}'.format(n, dim, digest.hexdigest())
+
+
+class KeIVFIndex(object):
+    """Inverted-file index of entity embeddings.
+
+    Args:
+        centroids (np.ndarray): ``[num_lists, dim]`` cluster centres
+        offsets (np.ndarray): ``num_lists + 1`` offsets of every list into *ids*
+        ids (np.ndarray): entity ids, grouped by list
+        p (int): norm of the distance (1 for TransE)
+        fingerprint (str, optional): :func:`embedding_fingerprint` of the
+            indexed embeddings
+    """
+
+    def __init__(self, centroids, offsets, ids, p=1, fingerprint=None):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.p = p
+        self.fingerprint = fingerprint
+
+    @property
+    def num_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    @torch.no_grad()
+    def build(cls, embeddings, num_lists=None, p=1, num_iterations=10, sample_size=None, seed=0,
+              batch_size=65536, device='cpu'):
+        """Cluster *embeddings* with k-means and index every row.
+
+        Args:
+            num_lists (int, optional): number of clusters (default:
+                ``4 * sqrt(len(embeddings))``)
+            num_iterations (int): k-means iterations
+            sample_size (int, optional): number of rows the centroids are
+                fitted on (default: 256 per list)
+        """
+        num_entities = len(embeddings)
+        num_lists = min(num_lists or int(4 * np.sqrt(num_entities)) or 1, num_entities)
+        rng = np.random.RandomState(seed)
+        sample_size = min(sample_size or 256 * num_lists, num_entities)
+        sample = np.sort(rng.choice(num_entities, sample_size, replace=False))
+        x = torch.as_tensor(np.array(embeddings[sample], dtype=np.float32), device=device)
+        centroids = x[torch.as_tensor(rng.choice(sample_size, num_lists, replace=False), device=device)]
+        for _ in range(num_iterations):
+            assign = cls._assign(x, centroids, p, batch_size)
+            counts = torch.bincount(assign, minlength=num_lists).unsqueeze(1)
+            sums = torch.zeros_like(centroids).index_add_(0, assign, x)
+            # empty clusters keep their centre
+            centroids = torch.where(counts > 0, sums / counts.clamp(min=1), centroids)
+
+        assign = torch.cat([
+            cls._assign(torch.as_tensor(np.array(embeddings[s:s + batch_size], dtype=np.float32), device=device),
+                        centroids, p, batch_size)
+            for s in range(0, num_entities, batch_size)
+        ]).cpu().numpy()
+        ids = np.argsort(assign, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=num_lists))])
+        return cls(centroids.cpu().numpy(), offsets, ids, p, embedding_fingerprint(embeddings))
+
+    @staticmethod
+    def _assign(x, centroids, p, batch_size):
+        return torch.cat([
+            torch.cdist(x[s:s + batch_size], centroids, p=p).argmin(dim=1)
+            for s in range(0, len(x), batch_size)
+        ])
+
+    @torch.no_grad()
+    def search(self, embeddings, queries, k, num_probe=8, batch_size=32, device='cpu'):
+        """Approximate *k* nearest rows of *embeddings* for every query,
+        scoring only the lists of the *num_probe* closest centroids.
+
+        Returns:
+            tuple: ``[N, k]`` ids and distances, closest first (ids are -1
+            and distances inf when the probed lists hold fewer than *k*
+            entities)
+        """
+        num_probe = min(num_probe, self.num_lists)
+        centroids = torch.as_tensor(self.centroids, device=device)
+        queries = np.asarray(queries, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        dists = np.full((len(queries), k), np.inf, dtype=np.float32)
+        for s in range(0, len(queries), batch_size):
+            query = torch.as_tensor(queries[s:s + batch_size], device=device)
+            lists = torch.cdist(query, centroids, p=self.p).topk(num_probe, dim=1, largest=False)[1].cpu().numpy()
+            starts, ends = self.offsets[lists].reshape(-1), self.offsets[lists + 1].reshape(-1)
+            # candidates of every query, padded to the longest candidate set of the batch
+            lens = (ends - starts).reshape(len(query), num_probe).sum(axis=1)
+            candidates = gather_ranges(self.ids, starts, ends)
+            if len(candidates) == 0:
+                continue
+            rows = np.repeat(np.arange(len(query)), lens)
+            cols = np.arange(len(candidates)) - np.repeat(np.cumsum(lens) - lens, lens)
+            # every distinct candidate embedding is read once
+            uniq, local = np.unique(candidates, return_inverse=True)
+            padded = np.zeros((len(query), max(lens.max(), k)), dtype=np.int64)
+            padded[rows, cols] = local
+            vectors = torch.as_tensor(np.array(embeddings[uniq], dtype=np.float32), device=device)
+            dist = (query.unsqueeze(1) - vectors[torch.as_tensor(padded, device=device)]).norm(p=self.p, dim=2)
+            valid = torch.as_tensor(np.arange(padded.shape[1]) < lens[:, None], device=device)
+            dist = dist.masked_fill(~valid, float('inf'))
+            best_dist, top = dist.topk(k, dim=1, largest=False)
+            top = top.cpu().numpy()
+            best_dist = best_dist.cpu().numpy()
+            found = np.isfinite(best_dist)
+            ids[s:s + batch_size] = np.where(found, uniq[np.take_along_axis(padded, top, axis=1)], -1)
+            dists[s:s + batch_size] = best_dist
+        return ids, dists
+
+    def matches(self, embeddings):
+        """Whether the index was built over *embeddings* (False for indices
+        saved without a fingerprint)."""
+        return self.fingerprint is not None and self.fingerprint == embedding_fingerprint(embeddings)
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, offsets=self.offsets, ids=self.ids, p=self.p,
+                 fingerprint=self.fingerprint or '')
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        fingerprint = str(data['fingerprint']) if 'fingerprint' in data else ''
+        return cls(data['centroids'], data['offsets'], data['ids'], int(data['p']), fingerprint or None)
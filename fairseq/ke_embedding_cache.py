@@ -0,0 +1,153 @@
+# Copyright Xiaozhi Wang
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+On-disk cache of entity embeddings, keyed by (checkpoint content hash,
+description token hash).
+
+Every checkpoint gets a directory with two append-only files: ``emb.bin``
+holds float32 embedding rows and ``keys.bin`` the uint64 token hash of every
+row. Both are memory-mapped, so evaluators read the cached rows without
+loading the whole matrix.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from fairseq.data.ke_online_negative_dataset import in_sorted
+
+
+def checkpoint_hash(path, chunk_size=1 << 24):
+    """SHA-1 of the checkpoint file, memoized by (size, mtime) next to it."""
+    memo_path = os.path.join(os.path.dirname(os.path.abspath(path)), 'emb_cache', 'checkpoints.json')
+    memo = {}
+    if os.path.exists(memo_path):
+        with open(memo_path, 'r') as f:
+            memo = json.load(f)
+    stat = os.stat(path)
+    name = os.path.basename(path)
+    if name in memo and memo[name]['size'] == stat.st_size and memo[name]['mtime'] == stat.st_mtime:
+        return memo[name]['sha1']
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    memo[name] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': sha1.hexdigest()}
+    os.makedirs(os.path.dirname(memo_path), exist_ok=True)
+    with open(memo_path, 'w') as f:
+        json.dump(memo, f)
+    return memo[name]['sha1']
+
+
+def description_hash(tokens):
+    """64-bit hash of the token ids of one (prepended and truncated) description."""
+    digest = hashlib.blake2b(np.asarray(tokens, dtype=np.int64).tobytes(), digest_size=8).digest()
+    return np.frombuffer(digest, dtype=np.uint64)[0]
+
+
+class KeEmbeddingCache(object):
+    """Embeddings of one checkpoint, stored under ``<ckpt_dir>/emb_cache/<sha1>``.
+
+    Args:
+        path (str): cache directory of the checkpoint
+        dim (int, optional): embedding size, required to create a new cache
+    """
+
+    def __init__(self, path, dim=None):
+        self.path = path
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                self.dim = json.load(f)['dim']
+            assert dim is None or dim == self.dim, 'cache {} stores {}-d embeddings'.format(path, self.dim)
+        else:
+            assert dim is not None, 'no embedding cache at {}'.format(path)
+            os.makedirs(path, exist_ok=True)
+            self.dim = dim
+            with open(meta_path, 'w') as f:
+                json.dump({'dim': dim}, f)
+        self._load()
+
+    @classmethod
+    def for_checkpoint(cls, ckpt_path, dim=None):
+        return cls(os.path.join(os.path.dirname(os.path.abspath(ckpt_path)), 'emb_cache', checkpoint_hash(ckpt_path)), dim)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        def size(name, itemsize):
+            return os.path.getsize(self._file(name)) // itemsize if os.path.exists(self._file(name)) else 0
+        # rows are appended before their keys, so a row without a key is an interrupted append
+        n = min(size('keys.bin', 8), size('emb.bin', 4 * self.dim))
+        keys = np.fromfile(self._file('keys.bin'), dtype=np.uint64, count=n) if n > 0 else np.zeros(0, dtype=np.uint64)
+        self._keys = [keys]
+        self._num_rows = n
+        self._sorted = None
+
+    @property
+    def keys(self):
+        if len(self._keys) > 1:
+            self._keys = [np.concatenate(self._keys)]
+        return self._keys[0]
+
+    def __len__(self):
+        return self._num_rows
+
+    @property
+    def embeddings(self):
+        """``[len(self), dim]`` read-only memory map of the cached rows."""
+        if len(self) == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(self._file('emb.bin'), dtype=np.float32, mode='r', shape=(len(self), self.dim))
+
+    def lookup(self, keys):
+        """Cache row of every key, -1 if it is missing."""
+        if self._sorted is None:
+            order = np.argsort(self.keys, kind='mergesort')
+            self._sorted = (order, self.keys[order])
+        order, sorted_keys = self._sorted
+        keys = np.asarray(keys, dtype=np.uint64)
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        found = in_sorted(keys, sorted_keys)
+        rows[found] = order[np.searchsorted(sorted_keys, keys[found])]
+        return rows
+
+    def append(self, keys, embeddings):
+        """Append rows for new keys and return their row ids."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(len(keys), self.dim)
+        n = len(self)
+        # drop a partial append first, so rows and keys stay aligned
+        for name, itemsize in [('emb.bin', 4 * self.dim), ('keys.bin', 8)]:
+            if os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) != n * itemsize:
+                with open(self._file(name), 'r+b') as f:
+                    f.truncate(n * itemsize)
+        with open(self._file('emb.bin'), 'ab') as f:
+            embeddings.tofile(f)
+        with open(self._file('keys.bin'), 'ab') as f:
+            keys.tofile(f)
+        self._keys.append(keys)
+        self._num_rows += len(keys)
+        self._sorted = None
+        return np.arange(n, n + len(keys))
+
+
+def load_entity_embeddings(path, rows=None):
+    """Entity embeddings and the row of every entity id.
+
+    *path* is either a ``.npy`` matrix indexed by entity id, or, together
+    with *rows* (the ``.npy`` of cache rows written by
+    ``generate_embeddings.py --cache``), a checkpoint or its cache
+    directory. Both are memory-mapped.
+    """
+    if rows is None:
+        embeddings = np.load(path, mmap_mode='r')
+        return embeddings, np.arange(len(embeddings))
+    cache = KeEmbeddingCache(path) if os.path.isdir(path) else KeEmbeddingCache.for_checkpoint(path)
+    return cache.embeddings, np.load(rows)
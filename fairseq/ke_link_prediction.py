@@ -0,0 +1,234 @@
+# Copyright Xiaozhi Wang
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Filtered link prediction for knowledge embeddings.
+
+This is a native replacement for graphvite's
+``KnowledgeGraphApplication.link_prediction`` (torch backend): every test
+triple is ranked against all entities of the graph with the block scoring of
+:mod:`fairseq.ke_scoring`, and known triples are filtered out with masks
+gathered from CSR groups instead of Python sets.
+"""
+
+import re
+import resource
+import time
+
+import numpy as np
+import torch
+
+from fairseq.data.ke_online_negative_dataset import KeTrueEntities, lookup_batch
+from fairseq.ke_scoring import TransE
+
+
+def read_triplets(file_name, delimiters=' \t\r\n', comment='#'):
+    """Read (head, relation, tail) names from a graphvite triplet file."""
+    pattern = re.compile('[%s]+' % re.escape(delimiters))
+    triplets = []
+    with open(file_name, 'r') as fin:
+        for i, line in enumerate(fin):
+            line = line.strip(delimiters)
+            comment_start = line.find(comment)
+            if comment_start != -1:
+                line = line[:comment_start]
+            tokens = pattern.split(line) if line else []
+            if len(tokens) == 0:
+                continue
+            if not 3 <= len(tokens) <= 4:
+                raise ValueError('Invalid line format at line %d in %s' % (i + 1, file_name))
+            triplets.append(tuple(tokens[:3]))
+    return triplets
+
+
+def map_triplets(triplets, entity2id, relation2id):
+    """Map names to ids, dropping the triplets with unknown names as graphvite does.
+
+    Returns:
+        np.ndarray: ``[N, 3]`` int64 array of (head, relation, tail) ids
+    """
+    ids = [
+        (entity2id[h], relation2id[r], entity2id[t])
+        for h, r, t in triplets
+        if h in entity2id and r in relation2id and t in entity2id
+    ]
+    return np.array(ids, dtype=np.int64).reshape(-1, 3)
+
+
+def filtered_pairs(groups, keys):
+    """(row, entity) pairs of the entities grouped under every key, sorted by entity."""
+    values, lens = lookup_batch(groups, keys)
+    rows = np.repeat(np.arange(len(keys)), lens)
+    order = np.argsort(values, kind='mergesort')
+    return rows[order], values[order]
+
+
+def _rank_batch(entity, relation, batch, filters, sides, score_function, entity_block):
+    """Rankings of one batch of triples, scoring *entity_block* entities at a time."""
+    device = entity.device
+    num_entities = len(entity)
+    entity_block = entity_block or num_entities
+    h, r, t = (torch.from_numpy(batch[:, i]).to(device) for i in range(3))
+    arange = torch.arange(len(batch), device=device)
+    ranks = []
+    for side in sides:
+        if side == 'head':
+            truth, score, query = h, score_function.score_heads, (relation[r], entity[t])
+        else:
+            truth, score, query = t, score_function.score_tails, (entity[h], relation[r])
+        # the true entity is scored as a block of its own; the score functions compute the score of
+        # an entity independently of the other entities of its block (see TransE._cdist)
+        true_score = score(*(x.unsqueeze(1) for x in query), entity[truth].unsqueeze(1)).view(-1, 1)
+        rows = cols = None
+        if filters is not None:
+            if side == 'head':
+                rows, cols = filtered_pairs(filters.heads, batch[:, 1] * filters.num_entities + batch[:, 2])
+            else:
+                rows, cols = filtered_pairs(filters.tails, batch[:, 0] * filters.num_relations + batch[:, 1])
+        rank = torch.ones(len(batch), dtype=torch.long, device=device)
+        for s in range(0, num_entities, entity_block):
+            e = min(s + entity_block, num_entities)
+            better = score(*query, entity[s:e]) >= true_score
+            # the true entity is counted once, below, and filtered entities not at all
+            in_block = (truth >= s) & (truth < e)
+            better[arange[in_block], truth[in_block] - s] = False
+            if rows is not None:
+                lo, hi = np.searchsorted(cols, [s, e])
+                if hi > lo:
+                    better[torch.from_numpy(rows[lo:hi]).to(device), torch.from_numpy(cols[lo:hi] - s).to(device)] = False
+            rank += better.sum(dim=1)
+        ranks.append(rank)
+    return torch.stack(ranks, dim=1).view(-1).cpu().numpy()
+
+
+_worker = {}
+
+
+def _init_worker(entity, relation, filters, sides, score_function, entity_block):
+    torch.set_num_threads(1)
+    _worker.update(entity=entity, relation=relation, filters=filters, sides=sides, score_function=score_function,
+                   entity_block=entity_block)
+
+
+@torch.no_grad()
+def _rank_batch_in_worker(batch):
+    return _rank_batch(batch=batch, **_worker)
+
+
+@torch.no_grad()
+def link_prediction_rankings(entity_embeddings, relation_embeddings, triplets, score_function, filters=None,
+                             target='both', batch_size=256, entity_block=None, num_workers=1, device='cpu'):
+    """Filtered rank of every test triple, as in graphvite's ``triplet_prediction``.
+
+    The rank of the true entity is one plus the number of other entities
+    scoring at least as high under *score_function*, not counting the
+    filtered ones. Scores are computed for *batch_size* triples and
+    *entity_block* entities at a time, so memory does not grow with the
+    number of entities.
+
+    With ``num_workers > 1`` the batches are ranked on the CPU by a process
+    pool. The embeddings are moved to shared memory once (or, for an
+    ``np.memmap``, mapped by every worker) and are not copied per worker.
+
+    Args:
+        entity_embeddings (np.ndarray): ``[num_entities, dim]`` embeddings
+        relation_embeddings (np.ndarray): ``[num_relations, dim]`` embeddings
+        triplets (np.ndarray): ``[N, 3]`` (head, relation, tail) ids to rank
+        score_function (fairseq.ke_scoring.KeScoreFunction): score of a triple
+        filters (KeTrueEntities, optional): known triples to filter out
+        target (str): 'head', 'tail' or 'both'
+        batch_size (int): number of triples scored together
+        entity_block (int, optional): number of entities scored together
+            (default: all)
+        num_workers (int): number of worker processes
+        device (str): device to score on
+
+    Returns:
+        np.ndarray: rankings, head before tail for every triple with 'both'
+    """
+    assert target in ['head', 'tail', 'both']
+    sides = ['head', 'tail'] if target == 'both' else [target]
+    entity = torch.as_tensor(np.asarray(entity_embeddings), dtype=torch.float, device=device)
+    relation = torch.as_tensor(np.asarray(relation_embeddings), dtype=torch.float, device=device)
+    triplets = np.asarray(triplets, dtype=np.int64).reshape(-1, 3)
+    batches = [triplets[s:s + batch_size] for s in range(0, len(triplets), batch_size)]
+    if len(batches) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if num_workers > 1:
+        if entity.device.type != 'cpu':
+            raise ValueError('num_workers > 1 requires device=cpu')
+        import torch.multiprocessing as mp
+        if not isinstance(entity_embeddings, np.memmap):
+            entity.share_memory_()
+        initargs = (entity, relation.share_memory_(), filters, sides, score_function, entity_block)
+        with mp.Pool(num_workers, initializer=_init_worker, initargs=initargs) as pool:
+            rankings = pool.map(_rank_batch_in_worker, batches, chunksize=1)
+    else:
+        rankings = [_rank_batch(entity, relation, batch, filters, sides, score_function, entity_block)
+                    for batch in batches]
+    return np.concatenate(rankings)
+
+
+def transe_rankings(entity_embeddings, relation_embeddings, triplets, filters=None, target='both', p=1, **kwargs):
+    """:func:`link_prediction_rankings` of TransE with the L*p* distance
+    (graphvite uses 1). The margin does not change the rankings."""
+    return link_prediction_rankings(entity_embeddings, relation_embeddings, triplets, TransE(p=p), filters,
+                                    target, **kwargs)
+
+
+def link_prediction_metrics(rankings):
+    """MR, MRR and HITS@k of filtered rankings, with graphvite's keys."""
+    rankings = np.asarray(rankings, dtype=np.float64)
+    return {
+        'MR': np.mean(rankings),
+        'MRR': np.mean(1 / rankings),
+        'HITS@1': np.mean(rankings <= 1),
+        'HITS@3': np.mean(rankings <= 3),
+        'HITS@10': np.mean(rankings <= 10),
+    }
+
+
+def evaluate_link_prediction(entity_embeddings, relation_embeddings, entity2id, relation2id,
+                             file_name, graph_files, filter_files=None, score_function=None, **kwargs):
+    """Rank the triples of *file_name* the way graphvite does after loading
+    *graph_files* into a ``KnowledgeGraphApplication``.
+
+    Only the entities and relations appearing in *graph_files* are
+    candidates. *entity2id* and *relation2id* map their names to rows of the
+    embedding matrices (as the ``--entity2id``/``--relation2id`` json files
+    of the evaluation scripts). Triples are scored with *score_function*
+    (default: graphvite's TransE with L1 distance). Remaining keyword
+    arguments are passed to :func:`link_prediction_rankings`.
+
+    Returns:
+        dict: MR, MRR, HITS@1, HITS@3 & HITS@10
+    """
+    graph = [x for f in graph_files for x in read_triplets(f)]
+    entities = sorted(set(x for h, _, t in graph for x in (h, t)) & set(entity2id), key=entity2id.get)
+    relations = sorted(set(r for _, r, _ in graph) & set(relation2id), key=relation2id.get)
+    graph_entity2id = {name: i for i, name in enumerate(entities)}
+    graph_relation2id = {name: i for i, name in enumerate(relations)}
+    rows = np.array([entity2id[x] for x in entities], dtype=np.int64)
+    if not np.array_equal(rows, np.arange(len(entity_embeddings))):
+        # keep a memory-mapped matrix mapped when every row is a candidate
+        entity_embeddings = np.asarray(entity_embeddings)[rows]
+    relation_embeddings = np.asarray(relation_embeddings)[[relation2id[x] for x in relations]]
+
+    triplets = map_triplets(read_triplets(file_name), graph_entity2id, graph_relation2id)
+    filters = None
+    if filter_files:
+        known = [x for f in filter_files for x in read_triplets(f)]
+        known = map_triplets(known, graph_entity2id, graph_relation2id)
+        filters = KeTrueEntities(known, len(entities), len(relations))
+    start = time.time()
+    rankings = link_prediction_rankings(entity_embeddings, relation_embeddings, triplets,
+                                        score_function or TransE(p=1), filters, **kwargs)
+    elapsed = time.time() - start
+    # ru_maxrss is in KB on Linux; workers report their own peak
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+    print('| ranked {} triples against {} entities in {:.1f}s ({:.1f} triples/s), peak memory {:.0f} MB'.format(
+        len(triplets), len(entities), elapsed, len(triplets) / max(elapsed, 1e-9), peak))
+    return link_prediction_metrics(rankings)
@@ -0,0 +1,182 @@
+# Copyright Xiaozhi Wang
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Knowledge embedding score functions shared by training and evaluation.
+
+Every score function scores triples in two layouts:
+
+* ``score(head, relation, tail)`` broadcasts its arguments against each
+  other and reduces the last (embedding) dimension, e.g. ``[B, 1, D]``
+  positives against ``[B, K, D]`` negatives in the KE head;
+* ``score_tails(head, relation, entities)`` and ``score_heads(relation,
+  tail, entities)`` score ``[..., B, D]`` queries against ``[..., E, D]``
+  candidate entities and return ``[..., B, E]`` scores, with a matrix
+  product or ``torch.cdist`` where possible, as used in link prediction.
+
+Higher scores mean more plausible triples. ComplEx and RotatE split every
+entity embedding into real and imaginary halves. Elementwise operations run
+in the precision of the embeddings; the reductions of ``score`` accumulate
+in *dtype* if it is given (e.g. fp32 norms of fp16 embeddings).
+"""
+
+import math
+
+import torch
+
+
+class KeScoreFunction(object):
+    """Base class of the knowledge embedding score functions.
+
+    Args:
+        gamma (float): margin of the distance based models
+        dtype (torch.dtype, optional): accumulation type of the reductions
+            (default: that of the embeddings)
+    """
+
+    def __init__(self, gamma=12.0, dtype=None):
+        self.gamma = gamma
+        self.dtype = dtype
+
+    def __call__(self, head, relation, tail):
+        return self.score(head, relation, tail)
+
+    def score(self, head, relation, tail):
+        raise NotImplementedError
+
+    def score_tails(self, head, relation, entities):
+        return self.score(head.unsqueeze(-2), relation.unsqueeze(-2), entities.unsqueeze(-3))
+
+    def score_heads(self, relation, tail, entities):
+        return self.score(entities.unsqueeze(-3), relation.unsqueeze(-2), tail.unsqueeze(-2))
+
+
+class TransE(KeScoreFunction):
+    """``gamma - ||h + r - t||_p``. The KE head trains with p=2, graphvite
+    evaluates with p=1."""
+
+    def __init__(self, gamma=12.0, p=2, dtype=None):
+        super().__init__(gamma, dtype)
+        self.p = p
+
+    def score(self, head, relation, tail):
+        return self.gamma - torch.norm(head + relation - tail, p=self.p, dim=-1, dtype=self.dtype)
+
+    def _cdist(self, queries, entities):
+        # at p=2, cdist of large inputs expands ||x - y||^2 into matrix products by default, whose
+        # rounding depends on the block; rankings compare against single-entity blocks, so every
+        # distance is computed directly
+        return torch.cdist(queries, entities, p=self.p, compute_mode='donot_use_mm_for_euclid_dist')
+
+    def score_tails(self, head, relation, entities):
+        return self.gamma - self._cdist(head + relation, entities)
+
+    def score_heads(self, relation, tail, entities):
+        # ||h + r - t|| = ||h - (t - r)||
+        return self.gamma - self._cdist(tail - relation, entities)
+
+
+class DistMult(KeScoreFunction):
+    """``<h, r, t>``."""
+
+    def score(self, head, relation, tail):
+        return (head * relation * tail).sum(dim=-1, dtype=self.dtype)
+
+    def score_tails(self, head, relation, entities):
+        return torch.matmul(head * relation, entities.transpose(-1, -2))
+
+    def score_heads(self, relation, tail, entities):
+        return torch.matmul(relation * tail, entities.transpose(-1, -2))
+
+
+def _complex_product(re_a, im_a, re_b, im_b):
+    return re_a * re_b - im_a * im_b, re_a * im_b + im_a * re_b
+
+
+class ComplEx(KeScoreFunction):
+    """``Re(<h, r, conj(t)>)``, with complex entities and relations."""
+
+    def score(self, head, relation, tail):
+        re_h, im_h = head.chunk(2, dim=-1)
+        re_r, im_r = relation.chunk(2, dim=-1)
+        re_t, im_t = tail.chunk(2, dim=-1)
+        re_s, im_s = _complex_product(re_h, im_h, re_r, im_r)
+        return (re_s * re_t + im_s * im_t).sum(dim=-1, dtype=self.dtype)
+
+    def score_tails(self, head, relation, entities):
+        re_h, im_h = head.chunk(2, dim=-1)
+        re_r, im_r = relation.chunk(2, dim=-1)
+        query = torch.cat(_complex_product(re_h, im_h, re_r, im_r), dim=-1)
+        return torch.matmul(query, entities.transpose(-1, -2))
+
+    def score_heads(self, relation, tail, entities):
+        re_r, im_r = relation.chunk(2, dim=-1)
+        re_t, im_t = tail.chunk(2, dim=-1)
+        # Re(<h, r, conj(t)>) = Re(<h, conj(conj(r) t)>)
+        query = torch.cat(_complex_product(re_r, -im_r, re_t, im_t), dim=-1)
+        return torch.matmul(query, entities.transpose(-1, -2))
+
+
+class RotatE(KeScoreFunction):
+    """``gamma - sum |h * r - t|``, where the relation is a rotation by the
+    phases ``relation / emb_range * pi``. A relation as wide as the entities
+    (e.g. an encoded relation description) uses its first half as phases.
+    """
+
+    def __init__(self, gamma=12.0, emb_range=1.0, dtype=None):
+        super().__init__(gamma, dtype)
+        self.emb_range = emb_range
+
+    def _rotation(self, relation, dim):
+        if relation.size(-1) == dim:
+            relation = relation[..., :dim // 2]
+        phase = relation / (self.emb_range / math.pi)
+        return torch.cos(phase), torch.sin(phase)
+
+    def _distance(self, re_a, im_a, re_b, im_b):
+        return self.gamma - torch.sqrt((re_a - re_b) ** 2 + (im_a - im_b) ** 2).sum(dim=-1, dtype=self.dtype)
+
+    def score(self, head, relation, tail):
+        re_h, im_h = head.chunk(2, dim=-1)
+        re_t, im_t = tail.chunk(2, dim=-1)
+        re_r, im_r = self._rotation(relation, head.size(-1))
+        return self._distance(*_complex_product(re_h, im_h, re_r, im_r), re_t, im_t)
+
+    def score_heads(self, relation, tail, entities):
+        # |h * r - t| = |h - conj(r) * t| for a unit r
+        re_t, im_t = tail.chunk(2, dim=-1)
+        re_r, im_r = self._rotation(relation, tail.size(-1))
+        re_s, im_s = _complex_product(re_r, -im_r, re_t, im_t)
+        re_e, im_e = entities.chunk(2, dim=-1)
+        return self._distance(re_s.unsqueeze(-2), im_s.unsqueeze(-2), re_e.unsqueeze(-3), im_e.unsqueeze(-3))
+
+
+KE_SCORE_FUNCTIONS = {
+    'TransE': TransE,
+    'DistMult': DistMult,
+    'ComplEx': ComplEx,
+    'RotatE': RotatE,
+}
+
+
+def build_score_function(name, gamma=12.0, p=2, dim=None, dtype=None):
+    """Build the score function *name* (``--ke-model``) the way
+    :class:`RobertaKnowledgeEmbeddingHead` does.
+
+    Args:
+        gamma (float): margin
+        p (int): norm of the TransE distance
+        dim (int, optional): embedding size; RotatE scales its phases by the
+            relation init range ``(gamma + 2) / dim``
+        dtype (torch.dtype, optional): accumulation type of the reductions
+    """
+    if name not in KE_SCORE_FUNCTIONS:
+        raise ValueError('unknown knowledge embedding model {} (choose from {})'.format(
+            name, ', '.join(KE_SCORE_FUNCTIONS)))
+    if name == 'TransE':
+        return TransE(gamma, p, dtype)
+    if name == 'RotatE':
+        return RotatE(gamma, (gamma + 2.0) / dim, dtype)
+    return KE_SCORE_FUNCTIONS[name](gamma, dtype)
@@ -11,6 +11,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from fairseq import utils
+from fairseq.ke_scoring import build_score_function
 from fairseq.models import (
     FairseqDecoder,
     FairseqLanguageModel,
@@ -18,6 +19,7 @@ from fairseq.models import (
     register_model_architecture,
 )
 from fairseq.modules import (
+    KeMemoryBank,
     LayerNorm,
     TransformerSentenceEncoder,
 )
@@ -105,22 +107,50 @@ class RobertaModel(FairseqLanguageModel):
             x = self.classification_heads[classification_head_name](x)
         return x, extra
 
-    def KEscore(self, src_tokens, relations, features_only=True, return_all_hiddens=False, ke_head_name=None, **kwargs):
+    def KEscore(self, src_tokens, relations, features_only=True, return_all_hiddens=False, ke_head_name=None,
+                in_batch_negatives=None, memory_bank=None, **kwargs):
         heads, tails, nHeads, nTails, heads_r, tails_r, relation_desc = src_tokens
         size = heads.size(0)
-        head_embs, _ = self.decoder(heads, features_only, return_all_hiddens, **kwargs)
-        tail_embs, _ = self.decoder(tails, features_only, return_all_hiddens, **kwargs)
-        nHead_embs, _ = self.decoder(nHeads, features_only, return_all_hiddens, **kwargs)
-        nTail_embs, _ = self.decoder(nTails, features_only, return_all_hiddens, **kwargs)
-        head_embs_r, _ = self.decoder(heads_r, features_only, return_all_hiddens, **kwargs)
-        tail_embs_r, _ = self.decoder(tails_r, features_only, return_all_hiddens, **kwargs)
-        if relation_desc is not None:
-            relation_desc_emb, _ = self.decoder(relation_desc, features_only, return_all_hiddens, **kwargs)
+        if getattr(self.args, 'ke_dedup_entities', False):
+            head_embs, tail_embs, nHead_embs, nTail_embs, head_embs_r, tail_embs_r, relation_desc_emb = \
+                self.encode_unique_descriptions(src_tokens, **kwargs)
         else:
-            relation_desc_emb = None
-        pScores, nScores = self.ke_heads[ke_head_name](head_embs, tail_embs, nHead_embs, nTail_embs, head_embs_r, tail_embs_r, relations, relation_desc_emb = relation_desc_emb)
+            head_embs, _ = self.decoder(heads, features_only, return_all_hiddens, **kwargs)
+            tail_embs, _ = self.decoder(tails, features_only, return_all_hiddens, **kwargs)
+            # only the negatives of the --ke-negative-mode side are loaded
+            nHead_embs = self.decoder(nHeads, features_only, return_all_hiddens, **kwargs)[0] if nHeads is not None else None
+            nTail_embs = self.decoder(nTails, features_only, return_all_hiddens, **kwargs)[0] if nTails is not None else None
+            head_embs_r, _ = self.decoder(heads_r, features_only, return_all_hiddens, **kwargs)
+            tail_embs_r, _ = self.decoder(tails_r, features_only, return_all_hiddens, **kwargs)
+            if relation_desc is not None:
+                relation_desc_emb, _ = self.decoder(relation_desc, features_only, return_all_hiddens, **kwargs)
+            else:
+                relation_desc_emb = None
+        pScores, nScores = self.ke_heads[ke_head_name](head_embs, tail_embs, nHead_embs, nTail_embs, head_embs_r, tail_embs_r, relations, relation_desc_emb = relation_desc_emb, in_batch_negatives=in_batch_negatives, memory_bank=memory_bank)
         return pScores, nScores, size
 
+    def encode_unique_descriptions(self, src_tokens, **kwargs):
+        """Encode every distinct description of a KE batch only once.
+
+        Descriptions (heads, tails, negatives, relation descriptions, ...)
+        are right-padded to a common length, deduplicated and encoded in a
+        single forward pass trimmed to the longest distinct description. The
+        <s> (CLS) features are scattered back to every occurrence.
+
+        Returns:
+            tuple: a ``(n, 1, embed_dim)`` tensor for each tensor of
+            *src_tokens* (``None`` entries are passed through).
+        """
+        pad = self.decoder.dictionary.pad()
+        tokens_list = [t for t in src_tokens if t is not None]
+        max_len = max(t.size(1) for t in tokens_list)
+        tokens = torch.cat([F.pad(t, (0, max_len - t.size(1)), value=pad) for t in tokens_list])
+        unique_tokens, inverse = torch.unique(tokens, dim=0, return_inverse=True)
+        unique_tokens = unique_tokens[:, :unique_tokens.ne(pad).long().sum(dim=1).max()]
+        features, _ = self.decoder(unique_tokens, features_only=True, **kwargs)
+        embs = iter(features[:, :1, :][inverse].split([t.size(0) for t in tokens_list]))
+        return tuple(next(embs) if t is not None else None for t in src_tokens)
+
     def register_classification_head(self, name, num_classes=None, inner_dim=None, **kwargs):
         """Register a classification head."""
         if name in self.classification_heads:
@@ -254,6 +284,16 @@ class RobertaModel(FairseqLanguageModel):
         for k in keys_to_delete:
             del state_dict[k]
 
+        # Memory banks are reset when the current heads have none or one of
+        # another size.
+        if hasattr(self, 'ke_heads'):
+            cur_state = self.ke_heads.state_dict()
+            for k in list(state_dict.keys()):
+                if k.startswith(prefix + 'ke_heads.') and '.memory_bank.' in k:
+                    cur = cur_state.get(k[len(prefix + 'ke_heads.'):])
+                    if cur is None or cur.shape != state_dict[k].shape:
+                        del state_dict[k]
+
         # Copy any newly-added classification heads into the state dict
         # with their current weights.
         if hasattr(self, 'ke_heads'):
@@ -279,7 +319,11 @@ class RobertaLMHead(nn.Module):
         self.weight = weight
         self.bias = nn.Parameter(torch.zeros(output_dim))
 
-    def forward(self, features, **kwargs):
+    def forward(self, features, masked_tokens=None, **kwargs):
+        # only project the masked tokens while training
+        if masked_tokens is not None:
+            features = features[masked_tokens, :]
+
         x = self.dense(features)
         x = self.activation_fn(x)
         x = self.layer_norm(x)
@@ -338,62 +382,104 @@ class RobertaKnowledgeEmbeddingHead(nn.Module):
             b=self.emb_range.item()
         )
 
-        model_func = {
-            'TransE': self.TransE,
-            #'DistMult': self.DistMult,
-            #'ComplEx': self.ComplEx,
-            #'RotatE': self.RotatE,
-            #'pRotatE': self.pRotatE
-        }
-        self.score_func = model_func[args.ke_model]
-
-    def TransE(self, head, relation, tail):
-        #print(head.size())
-        #print(relation.size())
-        #print(tail.size())
-        score = (head + relation) -tail
-        score = self.gamma.item() - torch.norm(score, p=2, dim=2)
-        #print(score)
-        return score
-
-    def forward(self, heads, tails, nHeads, nTails, heads_r, tails_r, relations, relation_desc_emb=None, **kwargs):
+        # fp32: score fp32 copies of the embeddings; norm: keep the embeddings
+        # in their dtype and accumulate the reductions in fp32; native: no casts
+        self.precision = getattr(args, 'ke_precision', 'fp32')
+        self.score_func = build_score_function(args.ke_model, gamma=self.gamma.item(),
+                                               p=getattr(args, 'ke_norm', 2), dim=self.hidden_dim,
+                                               dtype=torch.float32 if self.precision == 'norm' else None)
+        if getattr(args, 'ke_negative_sampling', None) == 'memory':
+            self.memory_bank = KeMemoryBank(args.ke_memory_bank_size, args.encoder_embed_dim,
+                                            args.ke_memory_bank_momentum, args.ke_memory_bank_max_age)
+        else:
+            self.memory_bank = None
+
+    def forward(self, heads, tails, nHeads, nTails, heads_r, tails_r, relations, relation_desc_emb=None,
+                in_batch_negatives=None, memory_bank=None, **kwargs):
         heads = heads[:, 0, :].unsqueeze(1)
         tails = tails[:, 0, :].unsqueeze(1)
         heads_r = heads_r[:, 0, :].unsqueeze(1)
         tails_r = tails_r[:, 0, :].unsqueeze(1)
 
-        #nHeads = nHeads[:, 0, :].view(heads.size(0), self.args.negative_sample_size, -1)
-        #nTails = nTails[:, 0, :].view(tails.size(0), self.args.negative_sample_size, -1)
-        nHeads = nHeads[:, 0, :].view(heads.size(0), -1, self.args.encoder_embed_dim)
-        nTails = nTails[:, 0, :].view(tails.size(0), -1, self.args.encoder_embed_dim)
-        
+        # either side of the negatives is None when it is not used (--ke-negative-mode)
+        if nHeads is not None:
+            nHeads = nHeads[:, 0, :].view(heads.size(0), -1, self.args.encoder_embed_dim)
+        if nTails is not None:
+            nTails = nTails[:, 0, :].view(tails.size(0), -1, self.args.encoder_embed_dim)
+
         if relation_desc_emb is not None:
             relations = relation_desc_emb[:, 0, :].unsqueeze(1)
         else:
             relations = self.relation_emb(relations).unsqueeze(1)
         
-        heads = heads.type(torch.cuda.FloatTensor)
-        tails = tails.type(torch.cuda.FloatTensor)
-        nHeads = nHeads.type(torch.cuda.FloatTensor)
-        nTails = nTails.type(torch.cuda.FloatTensor)
-        heads_r = heads_r.type(torch.cuda.FloatTensor)
-        tails_r = tails_r.type(torch.cuda.FloatTensor)
-
-        relations = relations.type(torch.cuda.FloatTensor)
+        if self.precision == 'fp32':
+            heads, tails, nHeads, nTails, heads_r, tails_r, relations = (
+                x.float() if x is not None else None for x in (heads, tails, nHeads, nTails, heads_r, tails_r, relations)
+            )
 
         pScores = (self.score_func(heads_r, relations, tails) + self.score_func(heads, relations, tails_r)) / 2.0
-        nHScores = self.score_func(nHeads, relations, tails_r)
-        nTScores = self.score_func(heads_r, relations, nTails)
-
-        USE_NHEADS = False
-        if USE_NHEADS:
-            nScores = torch.cat((nHScores, nTScores), dim=1) #check the shape
+        if in_batch_negatives is not None:
+            # the heads/tails of the other triples are the negatives: one [B, B] score matrix
+            # per side, with the positives and known true triples masked out (-inf)
+            h, t, h_r, t_r, r = (x.squeeze(1) for x in (heads, tails, heads_r, tails_r, relations))
+            # these are cdist/matmul over the batch, which neither take the accumulation dtype of
+            # the score function nor run in half on CPU: score copies of the operands instead
+            dtype = self.score_func.dtype
+            if dtype is None and h.dtype == torch.float16 and h.device.type == 'cpu':
+                dtype = torch.float32
+            if dtype is not None:
+                h, t, h_r, t_r, r = (x.to(dtype) for x in (h, t, h_r, t_r, r))
+            nScores = []
+            if 'head' in in_batch_negatives:
+                scores = self.score_func.score_heads(r, t_r, h)
+                nScores.append(scores.masked_fill(~in_batch_negatives['head'], float('-inf')))
+            if 'tail' in in_batch_negatives:
+                scores = self.score_func.score_tails(h_r, r, t)
+                nScores.append(scores.masked_fill(~in_batch_negatives['tail'], float('-inf')))
+            nScores = torch.cat(nScores, dim=1).type_as(pScores)
+        elif memory_bank is not None:
+            nScores = self.memory_bank_scores(heads, tails, heads_r, tails_r, relations, memory_bank)
+        elif nHeads is not None and nTails is not None:
+            # both sides in one call: (nHead, r, tail_r) pairs, then (head_r, r, nTail) pairs
+            nScores = self.score_func(
+                torch.cat([nHeads, heads_r.expand_as(nTails)], dim=1),
+                relations,
+                torch.cat([tails_r.expand_as(nHeads), nTails], dim=1),
+            )
+        elif nHeads is not None:
+            nScores = self.score_func(nHeads, relations, tails_r)
         else:
-            nScores = nTScores
-        #print("Pscore",pScores)
-        #print("Nscore",nScores)
+            nScores = self.score_func(heads_r, relations, nTails)
         return pScores, nScores
 
+    def memory_bank_scores(self, heads, tails, heads_r, tails_r, relations, memory_bank):
+        """Scores of --negative-sample-size entities drawn from the memory
+        bank for every triple (-inf where the bank has nothing to draw or the
+        entity forms a known true triple). In training, the heads and tails
+        of the batch are stored in the bank afterwards."""
+        triples = memory_bank['triples'].long()
+        nScores = []
+        for side in ['head', 'tail']:
+            if side not in memory_bank:
+                continue
+            ids, embs, valid = self.memory_bank.sample(len(triples), self.args.negative_sample_size)
+            embs = embs.type_as(heads)
+            true = memory_bank[side]
+            valid &= ~(ids.unsqueeze(2) == true.unsqueeze(1)).any(dim=2)
+            if side == 'head':
+                valid &= ids != triples[:, :1]
+                scores = self.score_func(embs, relations, tails_r)
+            else:
+                valid &= ids != triples[:, 2:]
+                scores = self.score_func(heads_r, relations, embs)
+            nScores.append(scores.masked_fill(~valid, float('-inf')))
+        if self.training:
+            self.memory_bank.update(
+                torch.cat([triples[:, 0], triples[:, 2]]),
+                torch.cat([heads.squeeze(1), tails.squeeze(1)]).detach(),
+            )
+        return torch.cat(nScores, dim=1)
+
 class RobertaEncoder(FairseqDecoder):
     """RoBERTa encoder.
 
@@ -428,7 +514,7 @@ class RobertaEncoder(FairseqDecoder):
             weight=self.sentence_encoder.embed_tokens.weight,
         )
 
-    def forward(self, src_tokens, features_only=False, return_all_hiddens=False, **unused):
+    def forward(self, src_tokens, features_only=False, return_all_hiddens=False, masked_tokens=None, **unused):
         """
         Args:
             src_tokens (LongTensor): input tokens of shape `(batch, src_len)`
@@ -437,6 +523,9 @@ class RobertaEncoder(FairseqDecoder):
                 `(batch, src_len, embed_dim)`.
             return_all_hiddens (bool, optional): also return all of the
                 intermediate hidden states (default: False).
+            masked_tokens (ByteTensor, optional): only project the positions
+                where this `(batch, src_len)` mask is set onto the vocabulary.
+                The LM output is then of shape `(num_masked, vocab)`.
 
         Returns:
             tuple:
@@ -446,7 +535,7 @@ class RobertaEncoder(FairseqDecoder):
         """
         x, extra = self.extract_features(src_tokens, return_all_hiddens)
         if not features_only:
-            x = self.output_layer(x)
+            x = self.output_layer(x, masked_tokens=masked_tokens)
         return x, extra
 
     def extract_features(self, src_tokens, return_all_hiddens=False, **unused):
@@ -456,8 +545,8 @@ class RobertaEncoder(FairseqDecoder):
         features = inner_states[-1]
         return features, {'inner_states': inner_states if return_all_hiddens else None}
 
-    def output_layer(self, features, **unused):
-        return self.lm_head(features)
+    def output_layer(self, features, masked_tokens=None, **unused):
+        return self.lm_head(features, masked_tokens)
 
     def max_positions(self):
         """Maximum output length supported by the encoder."""
@@ -13,6 +13,7 @@ from .dynamic_convolution import DynamicConv, DynamicConv1dTBC
 from .gelu import gelu, gelu_accurate
 from .grad_multiply import GradMultiply
 from .highway import Highway
+from .ke_memory_bank import KeMemoryBank
 from .layer_norm import LayerNorm
 from .learned_positional_embedding import LearnedPositionalEmbedding
 from .lightweight_convolution import LightweightConv, LightweightConv1dTBC
@@ -42,6 +43,7 @@ __all__ = [
     'gelu_accurate',
     'GradMultiply',
     'Highway',
+    'KeMemoryBank',
     'LayerNorm',
     'LearnedPositionalEmbedding',
     'LightweightConv1dTBC',
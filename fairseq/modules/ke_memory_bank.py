@@ -0,0 +1,94 @@
+# Copyright Xiaozhi Wang
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import torch
+import torch.nn as nn
+
+
+class KeMemoryBank(nn.Module):
+    """Recent <s> (CLS) embeddings of the entities seen in training, drawn as
+    KE negatives without running the encoder.
+
+    The bank holds *size* slots keyed by entity id. An entity already in the
+    bank is refreshed in place (``momentum * old + (1 - momentum) * new``),
+    a new one takes an empty slot or evicts the least recently updated
+    entity. Slots that were not refreshed in the last *max_age* updates are
+    not drawn. All of it is kept in buffers, so the bank is saved in
+    checkpoints with the model.
+
+    Args:
+        size (int): number of slots
+        embed_dim (int): embedding size
+        momentum (float): weight of the stored embedding on refresh
+        max_age (int): staleness limit in updates (0: no limit)
+        block_size (int): number of slots compared with the updated ids at a time
+    """
+
+    def __init__(self, size, embed_dim, momentum=0.0, max_age=0, block_size=65536):
+        super().__init__()
+        self.momentum = momentum
+        self.max_age = max_age
+        self.block_size = block_size
+        self.register_buffer('embeddings', torch.zeros(size, embed_dim))
+        self.register_buffer('keys', torch.full((size,), -1, dtype=torch.long))
+        self.register_buffer('updated', torch.zeros(size, dtype=torch.long))
+        self.register_buffer('num_updates', torch.zeros((), dtype=torch.long))
+
+    @property
+    def size(self):
+        return self.keys.size(0)
+
+    def find(self, ids):
+        """Slot of every entity id, -1 if it is not in the bank."""
+        slots = torch.full_like(ids, -1)
+        for s in range(0, self.size, self.block_size):
+            match = ids.unsqueeze(1) == self.keys[s:s + self.block_size].unsqueeze(0)
+            found = match.any(dim=1)
+            slots[found] = match[found].long().argmax(dim=1) + s
+        return slots
+
+    @torch.no_grad()
+    def update(self, ids, embeddings):
+        """Store the embeddings of entity *ids* (the mean over repeated ids)."""
+        ids, inverse = torch.unique(ids, return_inverse=True)
+        counts = torch.zeros(len(ids), device=ids.device).index_add_(0, inverse, torch.ones_like(inverse, dtype=torch.float))
+        embeddings = torch.zeros(len(ids), embeddings.size(1), device=ids.device) \
+            .index_add_(0, inverse, embeddings.float()) / counts.unsqueeze(1)
+        embeddings = embeddings.type_as(self.embeddings)
+        self.num_updates += 1
+
+        slots = self.find(ids)
+        found = slots >= 0
+        old = self.embeddings[slots[found]]
+        self.embeddings[slots[found]] = self.momentum * old + (1 - self.momentum) * embeddings[found]
+        self.updated[slots[found]] = self.num_updates
+
+        ids, embeddings = ids[~found][-self.size:], embeddings[~found][-self.size:]
+        # least recently updated slots first (empty ones were never updated), ties by slot
+        order = self.updated * self.size + torch.arange(self.size, device=ids.device)
+        new = order.topk(len(ids), largest=False)[1]
+        self.embeddings[new] = embeddings
+        self.keys[new] = ids
+        self.updated[new] = self.num_updates
+
+    def sample(self, num_samples, k):
+        """Draw *k* stored entities for each of *num_samples* rows, uniformly
+        over the filled, fresh slots.
+
+        Returns:
+            tuple: ``[num_samples, k]`` entity ids, ``[num_samples, k, dim]``
+            embeddings (detached) and ``[num_samples, k]`` validity mask,
+            which is False everywhere if no slot can be drawn
+        """
+        valid = self.keys >= 0
+        if self.max_age > 0:
+            valid &= self.num_updates - self.updated < self.max_age
+        candidates = valid.nonzero().view(-1)
+        if len(candidates) == 0:
+            ids = self.keys.new_full((num_samples, k), -1)
+            return ids, self.embeddings.new_zeros(num_samples, k, self.embeddings.size(1)), ids >= 0
+        slots = candidates[torch.randint(len(candidates), (num_samples, k), device=candidates.device)]
+        ids = self.keys[slots]
+        return ids, self.embeddings[slots], ids >= 0
@@ -34,6 +34,15 @@ from fairseq.data import (
     RawLabelDataset,
     RoundRobinZipDatasets,
     KeNegDataset,
+    KeEntityDataset,
+    KeInBatchNegDataset,
+    KeOnlineNegDataset,
+    KeTrueEntitiesDataset,
+)
+from fairseq.data.ke_online_negative_dataset import (
+    KeCitationNeighbourhood,
+    KeNegativeSampler,
+    KeTrueEntities,
 )
 from fairseq.tasks import FairseqTask, register_task
 
@@ -49,6 +58,28 @@ class MLMetKETask(FairseqTask):
         will be iterated upon during epochs in round-robin manner')
         parser.add_argument('--KEdata', help='file prefix for knowledge embedding data')
         parser.add_argument('--KEdata2', help='file prefix for the second knowledge embedding data', default='')
+        parser.add_argument('--ke-data-format', default='dump', choices=['dump', 'entity'],
+                            help='"dump": binarized descriptions of every head, tail and negative '
+                                 '(KGpreprocess.py); "entity": one binarized description per entity '
+                                 'plus int32 triple/negative id arrays (KGpreprocess.py --indexed)')
+        parser.add_argument('--ke-negative-sampling', default='offline', choices=['offline', 'uniform', 'local', 'global', 'inbatch', 'memory'],
+                            help='"offline": read the negatives dumped by the preprocessing scripts; '
+                                 '"inbatch": score the heads/tails of the other triples of the batch, '
+                                 'filtered against the known triples, as negatives; '
+                                 '"memory": draw --negative-sample-size negatives from a memory bank of '
+                                 'recently encoded entities, filtered against the known triples; '
+                                 'otherwise draw fresh negatives for every epoch, uniformly over all entities '
+                                 '(as KGpreprocess.py) or from the citation graph given by --ke-citations '
+                                 '(as KGpreprocessAdvanced.py). Requires --ke-data-format entity')
+        parser.add_argument('--ke-citations', default=None,
+                            help='path to citations_per_paper_id.json for local/global negative sampling')
+        parser.add_argument('--ke-memory-bank-size', default=65536, type=int,
+                            help='number of entity embeddings kept by --ke-negative-sampling memory')
+        parser.add_argument('--ke-memory-bank-momentum', default=0.0, type=float,
+                            help='weight of the stored embedding when an entity in the memory bank is seen again '
+                                 '(0: keep the latest embedding)')
+        parser.add_argument('--ke-memory-bank-max-age', default=0, type=int,
+                            help='do not draw entities that were not refreshed in this many updates (0: no limit)')
         parser.add_argument('--sample-break-mode', default='complete', choices=['none', 'complete', 'complete_doc', 'eos'], help='If omitted or "none", fills each sample with tokens-per-sample '
                                  'tokens. If set to "complete", splits samples only at the end '
                                  'of sentence, but may include multiple sentences per sample. '
@@ -69,8 +100,16 @@ class MLMetKETask(FairseqTask):
                             help='mask whole words; you may also want to set --bpe')
         parser.add_argument('--negative-sample-size', default=1, type=int,
                             help='The number of negative samples per positive sample for Knowledge Embedding' )
+        parser.add_argument('--ke-negative-mode', default='tail', choices=['tail', 'head', 'both'],
+                            help='which corrupted side of the triples is scored as negatives; '
+                                 'the descriptions of the other side are not loaded nor encoded')
         parser.add_argument('--ke-model', default='TransE', type=str,
-                            help='Knowledge Embedding Method (TransE, RotatE, etc)')
+                            help='Knowledge Embedding Method (TransE, DistMult, ComplEx or RotatE)')
+        parser.add_argument('--ke-norm', default=2, type=int,
+                            help='norm of the TransE distance (graphvite evaluates with 1)')
+        parser.add_argument('--ke-precision', default='fp32', choices=['fp32', 'norm', 'native'],
+                            help='precision of the KE scores: fp32 copies of the embeddings, fp32 accumulation '
+                                 'of the norms only, or the dtype of the model (e.g. with --fp16)')
         parser.add_argument('--ke-head-name', default='acl', type=str,
                             help='Knowledge Embedding head name (wikiData, acl, etc)')
         parser.add_argument('--ke-head-name2', default='wordnet', type=str,
@@ -86,11 +125,20 @@ class MLMetKETask(FairseqTask):
         parser.add_argument('--relation_desc', action='store_true')
         parser.add_argument('--double_ke', action='store_true')
         parser.add_argument('--relemb_from_desc', action='store_true')
+        parser.add_argument('--ke-dedup-entities', action='store_true',
+                            help='encode every distinct description of a KE batch only once '
+                                 '(heads_r/tails_r and repeated entities share one encoder pass)')
+        parser.add_argument('--ke-bucket-width', default=0, type=int,
+                            help='order KE instances by their number of description tokens, rounded down '
+                                 'to a multiple of this width (random order within a bucket), so that a '
+                                 'batch pads descriptions of similar length; 0 keeps a plain shuffle. '
+                                 'Use with --max-tokens to pack batches by token budget')
 
     def __init__(self, args, dictionary):
         super().__init__(args)
         self.dictionary = dictionary
         self.seed = args.seed
+        self.ke_negative_samplers = {}
         # add mask token
         if 'bert' in args and args.bert:
             self.mask_idx = dictionary.mask_index
@@ -222,14 +270,40 @@ class MLMetKETask(FairseqTask):
         data_path = paths[epoch % len(paths)] # BURASI NEDEN BOYLE? SADECE TEK BIR PARCAYI ALIYOR?
         def get_path(type):
             return os.path.join(data_path,type,split)
-        def desc_dataset(type, dictionary, relation_desc=None):
-            now_path=get_path(type)
-            dataset=data_utils.load_indexed_dataset(
-                now_path,
-                dictionary,
-                self.args.dataset_impl,
-                combine=combine,
+        online_negatives = self.args.ke_negative_sampling != 'offline'
+        negative_mode = getattr(self.args, 'ke_negative_mode', 'tail')
+        negative_sides = {'head': ['negHead'], 'tail': ['negTail'], 'both': ['negHead', 'negTail']}[negative_mode]
+        if online_negatives and self.args.ke_data_format != 'entity':
+            raise ValueError('--ke-negative-sampling {} requires --ke-data-format entity'.format(self.args.ke_negative_sampling))
+        if self.args.ke_data_format == 'entity':
+            # descriptions are stored once per entity and gathered by id
+            entities=data_utils.load_indexed_dataset(
+                os.path.join(data_path, 'entity', 'desc'),
+                self.source_dictionary,
+                'mmap',
             )
+            if entities is None:
+                raise FileNotFoundError('Entity descriptions not found: {}'.format(os.path.join(data_path, 'entity', 'desc')))
+            triples=np.load(get_path('triples')+'.npy', mmap_mode='r')
+            entity_ids={
+                'head': triples[:, 0],
+                'tail': triples[:, 2],
+            }
+            if not online_negatives:
+                for side in negative_sides:
+                    entity_ids[side]=np.load(get_path(side)+'.npy', mmap_mode='r').reshape(-1)
+        def desc_dataset(type, dictionary, relation_desc=None):
+            if type == 'entity':
+                dataset=entities
+            elif self.args.ke_data_format == 'entity':
+                dataset=KeEntityDataset(entities, entity_ids[type])
+            else:
+                dataset=data_utils.load_indexed_dataset(
+                    get_path(type),
+                    dictionary,
+                    self.args.dataset_impl,
+                    combine=combine,
+                )
             if self.args.init_token is not None:
                 dataset = PrependTokenDataset(dataset, self.args.init_token)
             if relation_desc is not None:
@@ -262,28 +336,67 @@ class MLMetKETask(FairseqTask):
 
         head=desc_dataset("head",self.source_dictionary)
         tail=desc_dataset("tail",self.source_dictionary)
-        nHead=desc_dataset("negHead",self.source_dictionary)
-        nTail=desc_dataset("negTail",self.source_dictionary)
+        negatives={}
+        if self.args.ke_negative_sampling in ['inbatch', 'memory']:
+            # the masks of the valid in-batch negatives, or the true entities to filter the
+            # memory bank negatives with; nothing else is loaded
+            true_entities=self.get_ke_negative_sampler(data_path, len(entities)).true_entities
+            for side in negative_sides:
+                mode='head-batch' if side == 'negHead' else 'tail-batch'
+                if self.args.ke_negative_sampling == 'inbatch':
+                    negatives[side]=KeInBatchNegDataset(triples, true_entities, mode)
+                else:
+                    negatives[side]=KeTrueEntitiesDataset(triples, true_entities, mode)
+        elif online_negatives:
+            sampler=self.get_ke_negative_sampler(data_path, len(entities))
+            entity_desc=desc_dataset("entity",self.source_dictionary)
+            for side in negative_sides:
+                mode='head-batch' if side == 'negHead' else 'tail-batch'
+                negatives[side]=KeOnlineNegDataset(entity_desc, triples, sampler, mode, self.args.negative_sample_size, seed=self.args.seed, epoch=epoch)
+            self.negative_sample_size=self.args.negative_sample_size
+        else:
+            for side in negative_sides:
+                negatives[side]=desc_dataset(side,self.source_dictionary)
+                assert len(negatives[side])%len(head)==0, "check the KE positive and negative instances' number"
+                self.negative_sample_size=len(negatives[side])/len(head)
+                negatives[side]=KeNegDataset(negatives[side],self.args)
 
         head_r=desc_dataset("head",self.source_dictionary, relation_desc if self.args.relation_desc else None)
         tail_r=desc_dataset("tail",self.source_dictionary, relation_desc if self.args.relation_desc else None)
-        
-        assert len(nHead)%len(head)==0, "check the KE positive and negative instances' number"
-        self.negative_sample_size=len(nHead)/len(head)
 
-        relation=np.load(get_path("relation")+".npy")
+        if self.args.ke_data_format == 'entity':
+            relation=np.array(triples[:, 1], dtype=np.int64)
+        else:
+            relation=np.load(get_path("relation")+".npy")
         sizes=np.load(get_path("sizes")+".npy")
         with data_utils.numpy_seed(self.args.seed + epoch):
             shuffle=np.random.permutation(len(head))
+        sort_order=[shuffle]
+        if self.args.ke_bucket_width > 0:
+            # consecutive indices, and so the KE half of a batch, come from one length bucket;
+            # the batches themselves are shuffled by the epoch iterator
+            sort_order.append(sizes // self.args.ke_bucket_width)
         net_input = {
             'heads': head,
             'tails': tail,
-            'nHeads': KeNegDataset(nHead,self.args),
-            'nTails': KeNegDataset(nTail,self.args),
             'heads_r': head_r,
             'tails_r': tail_r,
             'src_lengths': FakeNumelDataset(sizes, reduce=False),
         }
+        if self.args.ke_negative_sampling == 'inbatch':
+            net_input['in_batch_negatives'] = {
+                side: negatives[key] for side, key in [('head', 'negHead'), ('tail', 'negTail')] if key in negatives
+            }
+        elif self.args.ke_negative_sampling == 'memory':
+            net_input['memory_bank'] = {
+                side: negatives[key] for side, key in [('head', 'negHead'), ('tail', 'negTail')] if key in negatives
+            }
+            net_input['memory_bank']['triples'] = RawLabelDataset(triples)
+        else:
+            if 'negHead' in negatives:
+                net_input['nHeads'] = negatives['negHead']
+            if 'negTail' in negatives:
+                net_input['nTails'] = negatives['negTail']
         if self.args.relemb_from_desc:
             net_input['relation_desc'] = relation_desc
 
@@ -298,10 +411,29 @@ class MLMetKETask(FairseqTask):
                 },
                 sizes=[sizes],
             ),
-            sort_order=[shuffle],
+            sort_order=sort_order,
         )
         return dataset
 
+    def get_ke_negative_sampler(self, data_path, num_entities):
+        """Online negative sampler filtered against the triples of every
+        split dumped in *data_path*."""
+        if data_path not in self.ke_negative_samplers:
+            triples=np.concatenate([
+                np.load(os.path.join(data_path, 'triples', split+'.npy'))
+                for split in ['train', 'valid', 'test']
+                if os.path.exists(os.path.join(data_path, 'triples', split+'.npy'))
+            ])
+            true_entities=KeTrueEntities(triples, num_entities, int(triples[:, 1].max())+1)
+            neighbourhood=None
+            if self.args.ke_negative_sampling in ['local', 'global']:
+                if self.args.ke_citations is None:
+                    raise ValueError('--ke-negative-sampling {} requires --ke-citations'.format(self.args.ke_negative_sampling))
+                with open(self.args.ke_citations, 'r') as f:
+                    neighbourhood=KeCitationNeighbourhood(json.load(f), self.args.ke_negative_sampling)
+            self.ke_negative_samplers[data_path]=KeNegativeSampler(true_entities, num_entities, neighbourhood)
+        return self.ke_negative_samplers[data_path]
+
     def load_dataset(self, split, epoch=0, combine=False):
         print("| LOADING MLM DATASET...")
         MLMdataset=self.load_MLM_dataset(split,epoch,combine)
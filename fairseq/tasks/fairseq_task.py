@@ -132,15 +132,22 @@ class FairseqTask(object):
 
         # filter examples that are too large
         if max_positions is not None:
-            indices = data_utils.filter_by_size(
-                indices, dataset.size, max_positions, raise_exception=(not ignore_invalid_inputs),
-            )
-            indices = np.fromiter(indices, dtype=np.int64, count=-1)
+            sizes = dataset.size_vec(indices)
+            if sizes is not None:
+                indices = data_utils.filter_by_size_vec(
+                    indices, sizes, max_positions, raise_exception=(not ignore_invalid_inputs),
+                )
+            else:
+                indices = data_utils.filter_by_size(
+                    indices, dataset.size, max_positions, raise_exception=(not ignore_invalid_inputs),
+                )
+                indices = np.fromiter(indices, dtype=np.int64, count=-1)
 
         # create mini-batches with given size constraints
         batch_sampler = data_utils.batch_by_size(
             indices, dataset.num_tokens, max_tokens=max_tokens, max_sentences=max_sentences,
             required_batch_size_multiple=required_batch_size_multiple,
+            num_tokens_vec=dataset.num_tokens_vec(indices),
         )
 
         # return a reusable, sharded iterator
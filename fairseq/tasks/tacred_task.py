@@ -3,8 +3,11 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import hashlib
 import json
 import os
+import uuid
+from multiprocessing import Pool
 
 import numpy as np
 import torch
@@ -15,6 +18,7 @@ from fairseq.data import (
     BertDictionary,
     encoders,
     IdDataset,
+    indexed_dataset,
     ListDataset,
     NestedDictionaryDataset,
     NumSamplesDataset,
@@ -23,11 +27,140 @@ from fairseq.data import (
     RightPadDataset,
     SortDataset,
 )
+from fairseq import file_utils
 from fairseq.tasks import FairseqTask, register_task
 import transformers
 from transformers import BertTokenizer
 
 
+def _file_hash(path, sha1=None, chunk_size=1 << 24):
+    sha1 = sha1 or hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1
+
+
+def getIns(bpe,bped,bpeTokens,tokens,L,R):
+    resL=0
+    tkL=" ".join(tokens[:L])
+    bped_tkL=bpe.encode(tkL)
+    if bped.find(bped_tkL)==0:
+        resL=len(bped_tkL.split())
+    else:
+        tkL+=" "
+        bped_tkL=bpe.encode(tkL)
+        if bped.find(bped_tkL)==0:
+            resL=len(bped_tkL.split())
+    resR=0
+    tkR=" ".join(tokens[R:])
+    bped_tkR=bpe.encode(tkR)
+    if bped.rfind(bped_tkR)+len(bped_tkR)==len(bped):
+        resR=len(bpeTokens)-len(bped_tkR.split())
+    else:
+        tkR=" "+tkR
+        bped_tkR=bpe.encode(tkR)
+        if bped.rfind(bped_tkR)+len(bped_tkR)==len(bped):
+            resR=len(bpeTokens)-len(bped_tkR.split())
+    return resL, resR
+
+def getExample(bpe,a,bias):
+    s=" ".join(a["token"])
+    ss=bpe.encode(s)
+    sst=ss.split()
+    headL=a['h']['pos'][0]
+    headR=a['h']['pos'][1]
+    hiL, hiR=getIns(bpe,ss,sst,a["token"],headL,headR)
+    tailL=a['t']['pos'][0]
+    tailR=a['t']['pos'][1]
+    tiL, tiR=getIns(bpe,ss,sst,a["token"],tailL,tailR)
+    E1b='1'
+    E1e='2'
+    E2b='3'
+    E2e='4'
+    ins=[(hiL, E1b), (hiR, E1e), (tiL, E2b), (tiR, E2e)]
+    ins=sorted(ins)
+    pE1=0
+    pE2=0
+    pE1_=0
+    pE2_=0
+    for i in range(0,4):
+        sst.insert(ins[i][0]+i,ins[i][1])
+        if ins[i][1]==E1b:
+            pE1=ins[i][0]+i
+        elif ins[i][1]==E2b:
+            pE2=ins[i][0]+i
+        elif ins[i][1]==E1e:
+            pE1_=ins[i][0]+i
+        else:
+            pE2_=ins[i][0]+i
+    if pE1_-pE1==1 or pE2_-pE2==1:
+        return "???", -1, -1
+    else:
+        return " ".join(sst), pE1+bias, pE2+bias
+
+
+_worker = {}
+
+
+def _init_worker(args, vocab):
+    _worker['bpe'] = encoders.build_bpe(args)
+    _worker['vocab'] = vocab
+    _worker['init_token'] = args.init_token
+
+
+def _encode_line(line):
+    """Marker-inserted token ids, marker positions and relation of one jsonl
+    line, or None if an entity marker pair ends up empty."""
+    example = json.loads(line.strip())
+    bped, pE1, pE2 = getExample(_worker['bpe'], example, 1)
+    if pE1 == -1:
+        return None
+    tokens = _worker['vocab'].encode_line(bped, append_eos=True, add_if_not_exist=False).long()
+    if _worker['init_token'] is not None:
+        tokens = torch.cat([tokens.new([_worker['init_token']]), tokens])
+    return tokens, pE1, pE2, example.get('relation')
+
+
+def build_tacred_cache(data_path, prefix, rel2id, args, vocab, workers=1):
+    """Binarize *data_path* once into ``<prefix>.{bin,idx}`` (token ids with
+    the entity markers inserted), ``<prefix>.pos.npy`` (int32 positions of
+    the two start markers) and ``<prefix>.label.npy`` (relation ids, empty
+    if the split is unlabeled)."""
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    # every writer has its own temporary files, so concurrent builds never mix
+    tmp = '{}.{}.tmp'.format(prefix, uuid.uuid4().hex)
+    builder = indexed_dataset.make_builder(tmp + '.bin', impl='mmap', vocab_size=len(vocab))
+    positions, labels, num_skipped = [], [], 0
+    with open(data_path, 'r') as fin:
+        if workers > 1:
+            pool = Pool(workers, initializer=_init_worker, initargs=(args, vocab))
+            examples = pool.imap(_encode_line, fin, chunksize=256)
+        else:
+            _init_worker(args, vocab)
+            pool, examples = None, map(_encode_line, fin)
+        for example in examples:
+            if example is None:
+                num_skipped += 1
+                continue
+            tokens, pE1, pE2, relation = example
+            builder.add_item(tokens)
+            positions.append((pE1, pE2))
+            if relation is not None:
+                labels.append(rel2id[relation])
+        if pool is not None:
+            pool.close()
+            pool.join()
+    builder.finalize(tmp + '.idx')
+    assert len(labels) in [0, len(positions)], 'only some examples of {} are labeled'.format(data_path)
+    np.save(tmp + '.label.npy', np.array(labels, dtype=np.int64))
+    np.save(tmp + '.pos.npy', np.array(positions, dtype=np.int32).reshape(-1, 2))
+    # the positions are renamed last, so they mark a complete cache
+    for suffix in ['.bin', '.idx', '.label.npy', '.pos.npy']:
+        os.replace(tmp + suffix, prefix + suffix)
+    print('| binarized {} examples of {} into {} ({} skipped)'.format(len(positions), data_path, prefix, num_skipped))
+
+
 @register_task('tacred')
 class TacredTask(FairseqTask):
     """Task to finetune RoBERTa for TACRED."""
@@ -41,6 +174,8 @@ class TacredTask(FairseqTask):
                             help='add token at the beginning of each batch item')
         parser.add_argument('--num-classes', type=int, default=42)
         parser.add_argument('--regression-target', action='store_true', default=False)
+        parser.add_argument('--preprocess-workers', type=int, default=1,
+                            help='number of processes binarizing a split that is not cached yet')
     def __init__(self, args, vocab):
         super().__init__(args)
         self.vocab = vocab 
@@ -82,70 +217,25 @@ class TacredTask(FairseqTask):
 
         return cls(args, vocab)
 
+    def cache_prefix(self, split, data_path, rel2id_path):
+        """Prefix of the binarized *split*, keyed on the contents of the
+        jsonl, rel2id, dictionary and BPE files."""
+        sha1 = hashlib.sha1()
+        paths = [data_path, rel2id_path]
+        if self.args.bpe == 'gpt2':
+            paths += [file_utils.cached_path(self.args.gpt2_encoder_json), file_utils.cached_path(self.args.gpt2_vocab_bpe)]
+        for path in paths:
+            _file_hash(path, sha1)
+        sha1.update('\n'.join(self.vocab.symbols).encode('utf-8'))
+        sha1.update('{} {}'.format(self.args.bpe, self.args.init_token).encode('utf-8'))
+        return os.path.join(os.path.dirname(data_path), 'cache', '{}.{}'.format(split, sha1.hexdigest()))
+
     def load_dataset(self, split, epoch=0, combine=False, data_path=None, return_only=False, **kwargs):
         """Load a given dataset split.
 
         Args:
             split (str): name of the split (e.g., train, valid, test)
         """
-        def getIns(bped,bpeTokens,tokens,L,R):
-            resL=0
-            tkL=" ".join(tokens[:L])
-            bped_tkL=self.bpe.encode(tkL)
-            if bped.find(bped_tkL)==0:
-                resL=len(bped_tkL.split())
-            else:
-                tkL+=" "
-                bped_tkL=self.bpe.encode(tkL)
-                if bped.find(bped_tkL)==0:
-                    resL=len(bped_tkL.split())
-            resR=0
-            tkR=" ".join(tokens[R:])
-            bped_tkR=self.bpe.encode(tkR)
-            if bped.rfind(bped_tkR)+len(bped_tkR)==len(bped):
-                resR=len(bpeTokens)-len(bped_tkR.split())
-            else:
-                tkR=" "+tkR
-                bped_tkR=self.bpe.encode(tkR)
-                if bped.rfind(bped_tkR)+len(bped_tkR)==len(bped):
-                    resR=len(bpeTokens)-len(bped_tkR.split())
-            return resL, resR
-        
-        def getExample(a,bias):
-            s=" ".join(a["token"])
-            ss=self.bpe.encode(s)
-            sst=ss.split()
-            headL=a['h']['pos'][0]
-            headR=a['h']['pos'][1]
-            hiL, hiR=getIns(ss,sst,a["token"],headL,headR)
-            tailL=a['t']['pos'][0]
-            tailR=a['t']['pos'][1]
-            tiL, tiR=getIns(ss,sst,a["token"],tailL,tailR)
-            E1b='1'
-            E1e='2'
-            E2b='3'
-            E2e='4'
-            ins=[(hiL, E1b), (hiR, E1e), (tiL, E2b), (tiR, E2e)]
-            ins=sorted(ins)
-            pE1=0
-            pE2=0
-            pE1_=0
-            pE2_=0
-            for i in range(0,4):
-                sst.insert(ins[i][0]+i,ins[i][1])
-                if ins[i][1]==E1b:
-                    pE1=ins[i][0]+i
-                elif ins[i][1]==E2b:
-                    pE2=ins[i][0]+i
-                elif ins[i][1]==E1e:
-                    pE1_=ins[i][0]+i
-                else:
-                    pE2_=ins[i][0]+i
-            if pE1_-pE1==1 or pE2_-pE2==1:
-                return "???", -1, -1
-            else:
-                return " ".join(sst), pE1+bias, pE2+bias
-
         def get_example_bert(item):
             if 'text' in item:
                 sentence = item['text']
@@ -200,51 +290,52 @@ class TacredTask(FairseqTask):
             return indexed_tokens, pos1, pos2
 
  
-        def binarize(s, append_bos=False):
-            #if self.bpe is not None:
-            #    s = self.bpe.encode(s)
-            tokens = self.vocab.encode_line(
-                s, append_eos=True, add_if_not_exist=False,
-            ).long()
-            if append_bos and self.args.init_token is not None:
-                tokens = torch.cat([tokens.new([self.args.init_token]), tokens])
-            return tokens
-
         if data_path is None:
             data_path = os.path.join(self.args.data, split + '.jsonl')
-            rel2id_path=os.path.join(self.args.data, "rel2id.json")
+        rel2id_path=os.path.join(os.path.dirname(data_path), "rel2id.json")
         if not os.path.exists(data_path):
             raise FileNotFoundError('Cannot find data: {}'.format(data_path))
         if not os.path.exists(rel2id_path):
             raise FileNotFoundError('Cannot find rel2id: {}'.format(rel2id_path))
         
         rel2id=json.load(open(rel2id_path,"r"))
-        labels = []
-        src_tokens = []
-        src_lengths = []
-        src_idx = []
-        with open(data_path) as h:
-            for line in h:
-                example = json.loads(line.strip())
-                if 'relation' in example:
-                    label = rel2id[example['relation']]
-                    labels.append(label)
-                #bped=self.bpe.encode(" ".join(example["token"]))
-                if getattr(self.args, 'bert', False):
+        if getattr(self.args, 'bert', False):
+            labels = []
+            src_tokens = []
+            src_lengths = []
+            src_idx = []
+            with open(data_path) as h:
+                for line in h:
+                    example = json.loads(line.strip())
+                    if 'relation' in example:
+                        label = rel2id[example['relation']]
+                        labels.append(label)
                     src_bin, pE1, pE2 = get_example_bert(example)
-                else:
-                    bped, pE1, pE2 = getExample(example,1)
-                    if pE1==-1:
-                        continue
-                    src_bin = binarize(bped, append_bos=True)
-                src_tokens.append(src_bin)
-                src_lengths.append(len(src_bin))
-                #pE1=0
-                #pE2=0
-                src_idx.append([[pE1 for i in range(0,self.args.encoder_embed_dim)], [pE2 for i in range(0,self.args.encoder_embed_dim)]])
-
-        src_lengths = np.array(src_lengths)
-        src_tokens = ListDataset(src_tokens, src_lengths)
+                    src_tokens.append(src_bin)
+                    src_lengths.append(len(src_bin))
+                    src_idx.append((pE1, pE2))
+
+            # positions of the two entity markers, picked from the features by the criterion
+            src_idx = np.array(src_idx, dtype=np.int32).reshape(-1, 2)
+            src_lengths = np.array(src_lengths)
+            src_tokens = ListDataset(src_tokens, src_lengths)
+        else:
+            # GPT-2 BPE and marker insertion run once, the result is cached next to the data
+            prefix = self.cache_prefix(split, data_path, rel2id_path)
+            distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+            # with distributed training only the master builds the cache, the others wait for it
+            if not distributed or torch.distributed.get_rank() == 0:
+                if not os.path.exists(prefix + '.pos.npy'):
+                    build_tacred_cache(data_path, prefix, rel2id, self.args, self.vocab, self.args.preprocess_workers)
+            if distributed:
+                torch.distributed.barrier()
+                # e.g. a rank on another node without a shared file system
+                if not os.path.exists(prefix + '.pos.npy'):
+                    build_tacred_cache(data_path, prefix, rel2id, self.args, self.vocab, self.args.preprocess_workers)
+            src_tokens = data_utils.load_indexed_dataset(prefix, self.vocab, 'mmap')
+            src_idx = np.load(prefix + '.pos.npy')
+            labels = np.load(prefix + '.label.npy')
+            src_lengths = src_tokens.sizes.astype(np.int64)
         src_lengths = ListDataset(src_lengths)
         
         print("src_len", len(src_lengths))
@@ -22,7 +22,6 @@ import re
 import pickle
 import logging
 import multiprocessing
-from collections import defaultdict
 
 from future.builtins import str, map, range
 from easydict import EasyDict
@@ -224,6 +223,9 @@ class ApplicationMixin(object):
         import torch
 
         gpus = self.gpus if self.gpus else range(torch.cuda.device_count())
+        if len(gpus) == 0:
+            logger.info("No GPU is available. Evaluate on CPU in the current process.")
+            return [func(setting + ("cpu",)) for setting in settings]
         new_settings = []
         for i, setting in enumerate(settings):
             new_settings.append(setting + (gpus[i % len(gpus)],))
@@ -627,6 +629,7 @@ class KnowledgeGraphApplication(ApplicationMixin):
 
     SAMPLE_PER_DIMENSION = 7
     MEMORY_SCALE_FACTOR = 1.5
+    TORCH_BATCH_ELEMENTS = 2 ** 22
 
     def get_graph(self, **kwargs):
         return graph.KnowledgeGraph(self.index_type)
@@ -646,7 +649,7 @@ class KnowledgeGraphApplication(ApplicationMixin):
         self.solver.relation_embeddings[:] = model.solver.relation_embeddings[relation_mapping]
 
     def entity_prediction(self, H=None, R=None, T=None, file_name=None, save_file=None, target="tail", k=3,
-                          backend=cfg.backend):
+                          backend=cfg.backend, batch_size=auto, memory_limit=auto):
         """
         Predict the distribution of missing entity or relation for triplets.
 
@@ -659,6 +662,10 @@ class KnowledgeGraphApplication(ApplicationMixin):
             k (int, optional): top-k recalls will be returned
             target (str, optional): 'head' or 'tail'
             backend (str, optional): 'graphvite' or 'torch'
+            batch_size (int, optional): number of triplets scored together by the torch backend,
+                default is to score about ``TORCH_BATCH_ELEMENTS`` embedding elements at once
+            memory_limit (int, optional): bytes of candidate triplets and scores the graphvite backend holds at once,
+                default is the available memory divided by ``MEMORY_SCALE_FACTOR``
 
         Return:
             list of list of tuple: top-k recalls for each triplet, if save file is not provided
@@ -671,7 +678,7 @@ class KnowledgeGraphApplication(ApplicationMixin):
             entity_embeddings = SharedNDArray(self.solver.entity_embeddings)
             relation_embeddings = SharedNDArray(self.solver.relation_embeddings)
 
-            num_gpu = len(self.gpus) if self.gpus else torch.cuda.device_count()
+            num_gpu = len(self.gpus) if self.gpus else max(torch.cuda.device_count(), 1)
             work_load = (num_sample + num_gpu - 1) // num_gpu
             settings = []
 
@@ -680,7 +687,7 @@ class KnowledgeGraphApplication(ApplicationMixin):
                 work_R = R[work_load * i: work_load * (i+1)]
                 work_T = T[work_load * i: work_load * (i+1)]
                 settings.append((entity_embeddings, relation_embeddings, work_H, work_R, work_T,
-                                 None, None, target, k, self.solver.model, self.solver.margin))
+                                 None, None, None, target, k, self.solver.model, self.solver.margin, batch_size))
 
             results = self.gpu_map(triplet_prediction, settings)
             return sum(results, [])
@@ -688,21 +695,39 @@ class KnowledgeGraphApplication(ApplicationMixin):
         # entity prediction
         def graphvite_predict():
             num_entity = len(entity2id)
-            batch_size = self.get_batch_size(num_entity)
+            # the top-k indexes of a block (argpartition) are counted per candidate, and the
+            # 2k merged entries of a query (index, score, argpartition) as candidates
+            num_candidate = self.get_num_candidate(memory_limit, np.int64().itemsize)
+            block_size = min(num_entity, max(num_candidate - 2 * k, 1))
+            batch_size = max(num_candidate // (block_size + 2 * k), 1)
             recalls = []
 
             for i in range(0, num_sample, batch_size):
                 batch_h = H[i: i + batch_size]
                 batch_r = R[i: i + batch_size]
                 batch_t = T[i: i + batch_size]
-                batch = self.generate_one_vs_rest(batch_h, batch_r, batch_t, num_entity, target)
-
-                scores = self.solver.predict(batch)
-                scores = scores.reshape(-1, num_entity)
-                indexes = np.argpartition(scores, num_entity - k, axis=-1)
+                # running top-k of every query over the entity blocks
+                indexes = np.zeros((len(batch_r), 0), dtype=np.int64)
+                scores = np.zeros((len(batch_r), 0))
+                for start in range(0, num_entity, block_size):
+                    end = min(start + block_size, num_entity)
+                    batch = self.generate_candidates(batch_h, batch_r, batch_t, start, end, target)
+                    block_scores = self.solver.predict(batch).reshape(len(batch_r), end - start)
+                    del batch
+                    if end - start > k:
+                        # only the top-k of the block are merged into the running top-k
+                        block_indexes = np.argpartition(block_scores, end - start - k, axis=-1)[:, -k:]
+                        block_scores = np.take_along_axis(block_scores, block_indexes, axis=1)
+                        block_indexes = block_indexes + start
+                    else:
+                        block_indexes = np.broadcast_to(np.arange(start, end), block_scores.shape)
+                    indexes = np.concatenate([indexes, block_indexes], axis=1)
+                    scores = np.concatenate([scores, block_scores], axis=1)
+                    if scores.shape[1] > k:
+                        top = np.argpartition(scores, scores.shape[1] - k, axis=-1)[:, -k:]
+                        indexes = np.take_along_axis(indexes, top, axis=1)
+                        scores = np.take_along_axis(scores, top, axis=1)
                 for index, score in zip(indexes, scores):
-                    index = index[-k:]
-                    score = score[index]
                     order = np.argsort(score)[::-1]
                     recall = list(zip(index[order], score[order]))
                     recalls.append(recall)
@@ -791,7 +816,8 @@ class KnowledgeGraphApplication(ApplicationMixin):
             return recalls
 
     def link_prediction(self, H=None, R=None, T=None, filter_H=None, filter_R=None, filter_T=None, file_name=None,
-                        filter_files=None, target="both", fast_mode=None, backend=cfg.backend):
+                        filter_files=None, target="both", fast_mode=None, backend=cfg.backend, batch_size=auto,
+                        memory_limit=auto):
         """
         Evaluate knowledge graph embeddings on link prediction task.
 
@@ -807,6 +833,10 @@ class KnowledgeGraphApplication(ApplicationMixin):
             target (str, optional): 'head', 'tail' or 'both'
             fast_mode (int, optional): if specified, only that number of samples will be evaluated
             backend (str, optional): 'graphvite' or 'torch'
+            batch_size (int, optional): number of triplets scored together by the torch backend,
+                default is to score about ``TORCH_BATCH_ELEMENTS`` embedding elements at once
+            memory_limit (int, optional): bytes of candidate triplets and scores the graphvite backend holds at once,
+                default is the available memory divided by ``MEMORY_SCALE_FACTOR``
 
         Returns:
             dict: MR, MRR, HITS\@1, HITS\@3 & HITS\@10 of link prediction
@@ -817,7 +847,7 @@ class KnowledgeGraphApplication(ApplicationMixin):
             entity_embeddings = SharedNDArray(self.solver.entity_embeddings)
             relation_embeddings = SharedNDArray(self.solver.relation_embeddings)
 
-            num_gpu = len(self.gpus) if self.gpus else torch.cuda.device_count()
+            num_gpu = len(self.gpus) if self.gpus else max(torch.cuda.device_count(), 1)
             work_load = (fast_mode + num_gpu - 1) // num_gpu
             settings = []
 
@@ -826,37 +856,26 @@ class KnowledgeGraphApplication(ApplicationMixin):
                 work_R = R[work_load * i: work_load * (i+1)]
                 work_T = T[work_load * i: work_load * (i+1)]
                 settings.append((entity_embeddings, relation_embeddings, work_H, work_R, work_T,
-                                 exclude_H, exclude_T, target, None, self.solver.model, self.solver.margin))
+                                 exclude_H, exclude_T, num_relation, target, None, self.solver.model, self.solver.margin, batch_size))
 
             results = self.gpu_map(triplet_prediction, settings)
             return np.concatenate(results)
 
         def graphvite_predict():
             num_entity = len(entity2id)
-            if target == "both":
-                batch_size = self.get_batch_size(num_entity * 2)
-            else:
-                batch_size = self.get_batch_size(num_entity)
+            num_candidate = self.get_num_candidate(memory_limit)
+            block_size = min(num_entity, num_candidate)
+            batch_size = max(num_candidate // block_size, 1)
+            sides = ["head", "tail"] if target == "both" else [target]
             rankings = []
 
             for i in range(0, fast_mode, batch_size):
                 batch_h = H[i: i + batch_size]
                 batch_r = R[i: i + batch_size]
                 batch_t = T[i: i + batch_size]
-                batch = self.generate_one_vs_rest(batch_h, batch_r, batch_t, num_entity, target)
-                masks = self.generate_mask(batch_h, batch_r, batch_t, exclude_H, exclude_T, num_entity, target)
-                if target == "head":
-                    positives = batch_h
-                if target == "tail":
-                    positives = batch_t
-                if target == "both":
-                    positives = np.asarray([batch_h, batch_t]).transpose()
-                    positives = positives.ravel()
-                scores = self.solver.predict(batch) ### Burada segmentation fault (core dumped)
-                scores = scores.reshape(-1, num_entity)
-                truths = scores[range(len(positives)), positives]
-                ranking = np.sum((scores >= truths[:, np.newaxis]) * masks, axis=1)
-                rankings.append(ranking)
+                ranking = [self.stream_ranking(batch_h, batch_r, batch_t, exclude_H if side == "head" else exclude_T,
+                                               num_entity, block_size, side) for side in sides]
+                rankings.append(np.stack(ranking, axis=1).ravel())
 
             return np.concatenate(rankings)
 
@@ -924,11 +943,12 @@ class KnowledgeGraphApplication(ApplicationMixin):
         filter_R = np.asarray(new_R, dtype=np.uint32)
         filter_T = np.asarray(new_T, dtype=np.uint32)
 
-        exclude_H = defaultdict(set)
-        exclude_T = defaultdict(set)
-        for h, r, t in zip(filter_H, filter_R, filter_T):
-            exclude_H[(t, r)].add(h)
-            exclude_T[(h, r)].add(t)
+        num_relation = len(relation2id)
+        filter_H = filter_H.astype(np.int64)
+        filter_R = filter_R.astype(np.int64)
+        filter_T = filter_T.astype(np.int64)
+        exclude_H = build_exclude_index(filter_T * num_relation + filter_R, filter_H)
+        exclude_T = build_exclude_index(filter_H * num_relation + filter_R, filter_T)
 
         num_sample = len(H)
         fast_mode = fast_mode or num_sample
@@ -950,55 +970,105 @@ class KnowledgeGraphApplication(ApplicationMixin):
             "HITS@10": np.mean(rankings <= 10)
         }
 
-    def get_batch_size(self, sample_size):
-        import psutil
-        memory = psutil.virtual_memory()
+    def get_num_candidate(self, memory_limit=auto, extra_bytes=0):
+        """
+        Number of candidate triplets scored by one call of ``solver.predict``.
 
-        batch_size = int(self.SAMPLE_PER_DIMENSION * self.dim * self.graph.num_vertex
-                         * self.solver.num_partition / self.solver.num_worker / sample_size)
-        # 2 triplet (Python, C++ sample pool) + 1 sample index
-        mem_per_sample = sample_size * (2 * 3 * np.uint32().itemsize + 1 * np.uint64().itemsize)
-        max_batch_size = int(memory.available / mem_per_sample / self.MEMORY_SCALE_FACTOR)
-        if max_batch_size < batch_size:
+        ``extra_bytes`` is the memory of any other per-candidate array of the caller.
+        """
+        num_candidate = int(self.SAMPLE_PER_DIMENSION * self.dim * self.graph.num_vertex
+                            * self.solver.num_partition / self.solver.num_worker)
+        # 2 triplet (Python, C++ sample pool) + 1 score + 1 comparison
+        mem_per_candidate = 2 * 3 * np.uint32().itemsize + 1 * np.uint64().itemsize + 1 * np.bool_().itemsize
+        mem_per_candidate += extra_bytes
+        if memory_limit == auto:
+            import psutil
+            memory_limit = psutil.virtual_memory().available / self.MEMORY_SCALE_FACTOR
+        max_num_candidate = int(memory_limit / mem_per_candidate)
+        if max_num_candidate < num_candidate:
             logger.info("Memory is not enough for optimal prediction batch size. "
                         "Use the maximal possible size instead.")
-            batch_size = max_batch_size
-        return batch_size
-
-    def generate_one_vs_rest(self, H, R, T, num_entity, target="both"):
-        one = np.ones(num_entity, dtype=bool)
-        all = np.arange(num_entity, dtype=np.uint32)
-        batches = []
-
-        for h, r, t in zip(H, R, T):
-            if target == "head" or target == "both":
-                batch = np.asarray([all, t * one, r * one]).transpose()
-                batches.append(batch)
-            if target == "tail" or target == "both":
-                batch = np.asarray([h * one, all, r * one]).transpose()
-                batches.append(batch)
-
-        batches = np.concatenate(batches)
-        return batches
-
-    def generate_mask(self, H, R, T, exclude_H, exclude_T, num_entity, target="both"):
-        one = np.ones(num_entity, dtype=bool)
-        masks = []
-
-        for h, r, t in zip(H, R, T):
-            if target == "head" or target == "both":
-                mask = one.copy()
-                mask[list(exclude_H[(t, r)])] = 0
-                mask[h] = 1
-                masks.append(mask)
-            if target == "tail" or target == "both":
-                mask = one.copy()
-                mask[list(exclude_T[(h, r)])] = 0
-                mask[t] = 1
-                masks.append(mask)
-
-        masks = np.asarray(masks)
-        return masks
+            num_candidate = max_num_candidate
+        return max(num_candidate, 1)
+
+    def generate_candidates(self, H, R, T, start, end, target):
+        """Triplets of each query with entities ``start`` to ``end`` as head or tail."""
+        all = np.arange(start, end, dtype=np.uint32)
+        batch = np.empty((len(R), end - start, 3), dtype=np.uint32)
+        batch[:, :, 0] = all if target == "head" else np.asarray(H, dtype=np.uint32)[:, np.newaxis]
+        batch[:, :, 1] = all if target == "tail" else np.asarray(T, dtype=np.uint32)[:, np.newaxis]
+        batch[:, :, 2] = np.asarray(R, dtype=np.uint32)[:, np.newaxis]
+        return batch.reshape(-1, 3)
+
+    def stream_ranking(self, H, R, T, exclude, num_entity, block_size, target):
+        """
+        Filtered rankings of the heads or tails of a batch of triplets.
+
+        Entities are scored ``block_size`` at a time, so the candidate triplets of
+        all entities are never held in memory at once.
+        """
+        num_relation = len(self.graph.relation2id)
+        H = np.asarray(H, dtype=np.int64)
+        R = np.asarray(R, dtype=np.int64)
+        T = np.asarray(T, dtype=np.int64)
+        if target == "head":
+            truths = H
+            rows, cols = lookup_exclude_index(exclude, T * num_relation + R)
+        else:
+            truths = T
+            rows, cols = lookup_exclude_index(exclude, H * num_relation + R)
+        order = np.argsort(cols, kind="stable")
+        rows, cols = rows[order], cols[order]
+        truth_scores = self.solver.predict(np.asarray([H, T, R], dtype=np.uint32).transpose())
+        samples = np.arange(len(R))
+
+        # the true entity is counted once and the excluded ones not at all
+        rankings = np.ones(len(R), dtype=np.int64)
+        for start in range(0, num_entity, block_size):
+            end = min(start + block_size, num_entity)
+            batch = self.generate_candidates(H, R, T, start, end, target)
+            scores = self.solver.predict(batch).reshape(len(R), end - start)
+            better = scores >= truth_scores[:, np.newaxis]
+            in_block = (truths >= start) & (truths < end)
+            better[samples[in_block], truths[in_block] - start] = False
+            lo, hi = np.searchsorted(cols, [start, end])
+            better[rows[lo: hi], cols[lo: hi] - start] = False
+            rankings += better.sum(axis=1)
+        return rankings
+
+
+def build_exclude_index(keys, values):
+    """
+    Group entities to exclude from ranking by their query key, in CSR form.
+
+    Parameters:
+        keys (array of int): query key of each entity, e.g. ``tail * num_relation + relation`` for heads
+        values (array of int): entity ids
+
+    Returns:
+        tuple of array: sorted keys and the entities in the same order
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    values = np.asarray(values, dtype=np.int64)
+    order = np.argsort(keys, kind="stable")
+    return keys[order], values[order]
+
+
+def lookup_exclude_index(index, queries):
+    """
+    Gather the excluded entities of a batch of query keys.
+
+    Returns:
+        tuple of array: row of the query and excluded entity for every pair
+    """
+    keys, values = index
+    queries = np.asarray(queries, dtype=np.int64)
+    starts = np.searchsorted(keys, queries, side="left")
+    ends = np.searchsorted(keys, queries, side="right")
+    lengths = ends - starts
+    rows = np.repeat(np.arange(len(queries)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return rows, values[np.repeat(starts, lengths) + offsets]
 
 
 def triplet_prediction(args):
@@ -1007,7 +1077,7 @@ def triplet_prediction(args):
     torch.set_grad_enabled(False)
 
     entity_embeddings, relation_embeddings, H, R, T, \
-    exclude_H, exclude_T, target, k, score_function, margin, device = args
+    exclude_H, exclude_T, num_relation, target, k, score_function, margin, batch_size, device = args
     num_entity = len(entity_embeddings)
     score_function = LinkPredictor(score_function, entity_embeddings, relation_embeddings, entity_embeddings,
                                    margin=margin)
@@ -1024,48 +1094,54 @@ def triplet_prediction(args):
             score_function = LinkPredictor(score_function, entity_embeddings, relation_embeddings, entity_embeddings,
                                            margin=margin)
 
-    one = torch.ones(num_entity, dtype=torch.long, device=device)
-    all = torch.arange(num_entity, dtype=torch.long, device=device)
+    if batch_size == auto:
+        batch_size = max(KnowledgeGraphApplication.TORCH_BATCH_ELEMENTS // (num_entity * entity_embeddings.shape[1]), 1)
+    H = np.asarray(H, dtype=np.int64)
+    R = np.asarray(R, dtype=np.int64)
+    T = np.asarray(T, dtype=np.int64)
     results = [] # rankings or top-k recalls
 
-    for h, r, t in zip(H, R, T):
-        if target == "head" or target == "both":
-            batch_h = all
-            batch_r = r * one
-            batch_t = t * one
-            score = score_function(batch_h, batch_r, batch_t)
-            if k: # top-k recalls
-                score, index = torch.topk(score, k)
-                score = score.cpu().numpy()
-                index = index.cpu().numpy()
-                recall = list(zip(index, score))
-                results.append(recall)
-            else: # ranking
-                mask = torch.ones(num_entity, dtype=torch.uint8, device=device)
-                index = torch.tensor(list(exclude_H[(t, r)]), dtype=torch.long, device=device)
-                mask[index] = 0
-                mask[h] = 1
-                ranking = torch.sum((score >= score[h]) * mask).item()
-                results.append(ranking)
-
-        if target == "tail" or target == "both":
-            batch_h = h * one
-            batch_r = r * one
-            batch_t = all
-            score = score_function(batch_h, batch_r, batch_t)
+    for i in range(0, len(H), batch_size):
+        h = H[i: i + batch_size]
+        r = R[i: i + batch_size]
+        t = T[i: i + batch_size]
+        num_sample = len(h)
+        batch_results = []
+        for side in ["head", "tail"]:
+            if target != side and target != "both":
+                continue
+            # score the query triplets against all entities at once
+            batch_h = torch.as_tensor(h, device=device)
+            batch_r = torch.as_tensor(r, device=device)
+            batch_t = torch.as_tensor(t, device=device)
+            if side == "head":
+                truth = batch_h
+                score = score_function.score_all([None, batch_r, batch_t], 0)
+            else:
+                truth = batch_t
+                score = score_function.score_all([batch_h, batch_r, None], 2)
             if k: # top-k recalls
-                score, index = torch.topk(score, k)
+                score, index = torch.topk(score, k, dim=1)
                 score = score.cpu().numpy()
                 index = index.cpu().numpy()
-                recall = list(zip(index, score))
-                results.append(recall)
+                batch_results.append([list(zip(x, y)) for x, y in zip(index, score)])
             else: # ranking
-                mask = torch.ones(num_entity, dtype=torch.uint8, device=device)
-                index = torch.tensor(list(exclude_T[(h, r)]), dtype=torch.long, device=device)
-                mask[index] = 0
-                mask[t] = 1
-                ranking = torch.sum((score >= score[t]) * mask).item()
-                results.append(ranking)
+                if side == "head":
+                    rows, cols = lookup_exclude_index(exclude_H, t * num_relation + r)
+                else:
+                    rows, cols = lookup_exclude_index(exclude_T, h * num_relation + r)
+                rows = torch.as_tensor(rows, device=device)
+                cols = torch.as_tensor(cols, device=device)
+                sample = torch.arange(num_sample, device=device)
+                mask = torch.ones(num_sample, num_entity, dtype=torch.bool, device=device)
+                mask[rows, cols] = 0
+                mask[sample, truth] = 1
+                truth_score = score[sample, truth].unsqueeze(1)
+                ranking = ((score >= truth_score) & mask).sum(dim=1)
+                batch_results.append(ranking.cpu().numpy())
+        # keep the order of the per-triplet loop: head before tail of each triplet
+        for j in range(num_sample):
+            results += [x[j] for x in batch_results]
 
     if not k: # ranking
         results = np.asarray(results)
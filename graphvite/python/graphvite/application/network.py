@@ -66,10 +66,31 @@ class LinkPredictor(nn.Module):
             vectors.append(embedding(index))
         return self.score_function(*vectors, **self.kwargs)
 
+    def score_all(self, indexes, position):
+        """
+        Score a batch of triplets against all candidates of one position.
+
+        Parameters:
+            indexes (list of Tensor): indexes of each position, ``None`` for *position*
+            position (int): position filled with every row of its embeddings
+
+        Returns:
+            Tensor: scores of shape (batch size, number of candidates)
+        """
+        assert len(indexes) == len(self.embeddings)
+        vectors = []
+        for i, (index, embedding) in enumerate(zip(indexes, self.embeddings)):
+            if i == position:
+                vectors.append(embedding.weight.unsqueeze(0))
+            else:
+                vectors.append(embedding(index).unsqueeze(1))
+        # score functions broadcast over all but the last dimension
+        return self.score_function(*vectors, **self.kwargs)
+
     @staticmethod
     def LINE(heads, tails):
         x = heads * tails
-        score = x.sum(dim=1)
+        score = x.sum(dim=-1)
         return score
 
     DeepWalk = LINE
@@ -77,67 +98,63 @@ class LinkPredictor(nn.Module):
     @staticmethod
     def TransE(heads, relations, tails, margin=12):
         x = heads + relations - tails
-        score = margin - x.norm(p=1, dim=1)
+        score = margin - x.norm(p=1, dim=-1)
         return score
 
     @staticmethod
     def RotatE(heads, relations, tails, margin=12):
-        dim = heads.size(1) // 2
+        dim = heads.size(-1) // 2
 
-        head_re, head_im = heads.view(-1, dim, 2).permute(2, 0, 1)
-        tail_re, tail_im = tails.view(-1, dim, 2).permute(2, 0, 1)
-        relations = relations[:, :dim]
+        head_re, head_im = heads[..., 0::2], heads[..., 1::2]
+        tail_re, tail_im = tails[..., 0::2], tails[..., 1::2]
+        relations = relations[..., :dim]
         relation_re, relation_im = torch.cos(relations), torch.sin(relations)
 
         x_re = head_re * relation_re - head_im * relation_im - tail_re
         x_im = head_re * relation_im + head_im * relation_re - tail_im
         x = torch.stack([x_re, x_im], dim=0)
-        score = margin - x.norm(p=2, dim=0).sum(dim=1)
+        score = margin - x.norm(p=2, dim=0).sum(dim=-1)
         return score
 
     @staticmethod
     def DistMult(heads, relations, tails):
         x = heads * relations * tails
-        score = x.sum(dim=1)
+        score = x.sum(dim=-1)
         return score
 
     @staticmethod
     def ComplEx(heads, relations, tails):
-        dim = heads.size(1) // 2
-
-        head_re, head_im = heads.view(-1, dim, 2).permute(2, 0, 1)
-        tail_re, tail_im = tails.view(-1, dim, 2).permute(2, 0, 1)
-        relation_re, relation_im = relations.view(-1, dim, 2).permute(2, 0, 1)
+        head_re, head_im = heads[..., 0::2], heads[..., 1::2]
+        tail_re, tail_im = tails[..., 0::2], tails[..., 1::2]
+        relation_re, relation_im = relations[..., 0::2], relations[..., 1::2]
 
         x_re = head_re * relation_re - head_im * relation_im
         x_im = head_re * relation_im + head_im * relation_re
         x = x_re * tail_re + x_im * tail_im
-        score = x.sum(dim=1)
+        score = x.sum(dim=-1)
         return score
 
     @staticmethod
     def SimplE(heads, relations, tails):
-        dim = heads.size(1) // 2
-
-        tails = tails.view(-1, dim, 2).flip(2).view(-1, dim * 2)
+        tails = torch.stack([tails[..., 1::2], tails[..., 0::2]], dim=-1).flatten(-2)
 
         x = heads * relations * tails
-        score = x.sum(dim=1)
+        score = x.sum(dim=-1)
         return score
 
     @staticmethod
     def QuatE(heads, relations, tails):
-        dim = heads.size(1) // 4
+        dim = heads.size(-1) // 4
 
-        head_r, head_i, head_j, head_k = heads.view(-1, dim, 4).permute(2, 0, 1)
-        tail_r, tail_i, tail_j, tail_k = tails.view(-1, dim, 4).permute(2, 0, 1)
-        relation_r, relation_i, relation_j, relation_k = relations.view(-1, dim, 4).permute(2, 0, 1)
+        head_r, head_i, head_j, head_k = [heads[..., i::4] for i in range(4)]
+        tail_r, tail_i, tail_j, tail_k = [tails[..., i::4] for i in range(4)]
+        relation_r, relation_i, relation_j, relation_k = [relations[..., i::4] for i in range(4)]
 
-        relation_norm = relations.view(-1, dim, 4).norm(p=2, dim=2)
+        relation_norm = relations.reshape(relations.shape[:-1] + (dim, 4)).norm(p=2, dim=-1)
         x_r = head_r * relation_r - head_i * relation_i - head_j * relation_j - head_k * relation_k
         x_i = head_r * relation_i + head_i * relation_r + head_j * relation_k - head_k * relation_j
         x_j = head_r * relation_j - head_i * relation_k + head_j * relation_r + head_k * relation_i
         x_k = head_r * relation_k + head_i * relation_j - head_j * relation_i + head_k * relation_r
         x = (x_r * tail_r + x_i * tail_i + x_j * tail_j + x_k * tail_k) / (relation_norm + 1e-15)
-        score = x.sum(dim=1)
-        return score
\ No newline at end of file
+        score = x.sum(dim=-1)
+        return score
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+from fairseq.ke_ann_index import KeIVFIndex, exhaustive_search, recall_at_k, transe_queries
+from fairseq.ke_embedding_cache import load_entity_embeddings
+from fairseq.ke_link_prediction import map_triplets, read_triplets
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entity_embeddings', help='numpy of entity embeddings, or the checkpoint (or its embedding cache directory) with --entity_rows')
+    parser.add_argument('--entity_rows', help='numpy of the cache row of every entity, written by generate_embeddings.py --cache')
+    parser.add_argument('--relation_embeddings', help='numpy of relation embeddings')
+    parser.add_argument('--entity2id', help='entity name to numpy id json')
+    parser.add_argument('--relation2id', help='entity name to numpy id json')
+    parser.add_argument('--index', help='index file (default: next to the embeddings, <name>.ivf.npz)')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the index even if the file exists and matches the embeddings')
+    parser.add_argument('--num_lists', type=int, default=None, help='number of k-means lists (default: 4 * sqrt(#entities))')
+    parser.add_argument('--num_iterations', type=int, default=10, help='k-means iterations')
+    parser.add_argument('--p', type=int, default=1, help='norm of the TransE distance (1 as graphvite, 2 as the KE head of training)')
+
+    parser.add_argument('--dataset', help='triplets to report recall@k on, against exhaustive search')
+    parser.add_argument('--target', default='tail', choices=['head', 'tail'])
+    parser.add_argument('--k', type=int, default=15)
+    parser.add_argument('--num_probe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32], help='numbers of probed lists to report')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    entity_embeddings, rows = load_entity_embeddings(args.entity_embeddings, args.entity_rows)
+    index_path = args.index or os.path.splitext(args.entity_rows or args.entity_embeddings)[0] + '.ivf.npz'
+    index = None
+    if os.path.exists(index_path) and not args.rebuild:
+        index = KeIVFIndex.load(index_path)
+        if not index.matches(entity_embeddings):
+            print('| index {} was not built over these embeddings, rebuilding it'.format(index_path))
+            index = None
+        elif index.p != args.p:
+            print('| index {} was built with p={}, rebuilding it with p={}'.format(index_path, index.p, args.p))
+            index = None
+        else:
+            print('| loaded index with {} lists from {}'.format(index.num_lists, index_path))
+    if index is None:
+        start = time.time()
+        index = KeIVFIndex.build(entity_embeddings, num_lists=args.num_lists, p=args.p, num_iterations=args.num_iterations,
+                                 device=args.device)
+        index.save(index_path)
+        print('| built index with {} lists over {} entities in {:.1f}s, saved to {}'.format(
+            index.num_lists, len(entity_embeddings), time.time() - start, index_path))
+
+    if args.dataset is None:
+        return
+    relation_embeddings = np.load(args.relation_embeddings)
+    entity2id = {key: int(rows[i]) for key, i in json.load(open(args.entity2id)).items()}
+    relation2id = json.load(open(args.relation2id))
+    triplets = map_triplets(read_triplets(args.dataset), entity2id, relation2id)
+    queries = transe_queries(entity_embeddings, relation_embeddings, triplets, args.target)
+
+    start = time.time()
+    exact_ids, _ = exhaustive_search(entity_embeddings, queries, args.k, p=args.p, device=args.device)
+    exact_time = time.time() - start
+    print('| exhaustive search: {} queries in {:.2f}s'.format(len(queries), exact_time))
+    for num_probe in args.num_probe:
+        start = time.time()
+        ids, _ = index.search(entity_embeddings, queries, args.k, num_probe=num_probe, device=args.device)
+        elapsed = time.time() - start
+        print('| num_probe {}: recall@{} {:.4f}, {:.2f}s ({:.1f}x faster)'.format(
+            num_probe, args.k, recall_at_k(ids, exact_ids), elapsed, exact_time / max(elapsed, 1e-9)))
+
+if __name__ == '__main__':
+    main()
@@ -1,58 +1,47 @@
 import argparse
-import graphvite as gv
-import graphvite.application as gap
 import numpy as np
 import json
-from tqdm import tqdm
+import torch
+
+from fairseq.ke_embedding_cache import load_entity_embeddings
+from fairseq.ke_link_prediction import evaluate_link_prediction
+from fairseq.ke_scoring import KE_SCORE_FUNCTIONS, build_score_function
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--entity_embeddings', help='numpy of entity embeddings')
+    parser.add_argument('--entity_embeddings', help='numpy of entity embeddings, or the checkpoint (or its embedding cache directory) with --entity_rows')
+    parser.add_argument('--entity_rows', help='numpy of the cache row of every entity, written by generate_embeddings.py --cache')
     parser.add_argument('--relation_embeddings', help='numpy of relation embeddings')
     parser.add_argument('--entity2id', help='entity name to numpy id json')
     parser.add_argument('--relation2id', help='entity name to numpy id json')
     parser.add_argument('--dim', type=int, help='size of embedding')
+    parser.add_argument('--ke_model', default='TransE', choices=sorted(KE_SCORE_FUNCTIONS), help='score function (--ke-model of training)')
+    parser.add_argument('--p', type=int, default=1, help='norm of the TransE distance (1 as graphvite, 2 as the KE head of training)')
+    parser.add_argument('--gamma', type=float, default=12.0, help='margin (--gamma of training, sets the RotatE phase scale)')
 
     parser.add_argument('--train_dataset', help="train dataset")
     parser.add_argument('--val_dataset', help="val dataset")
     parser.add_argument('--dataset', help="test dataset")
+    parser.add_argument('--batch_size', type=int, default=256, help='number of test triplets scored together')
+    parser.add_argument('--entity_block', type=int, default=65536, help='number of entities scored together')
+    parser.add_argument('--workers', type=int, default=1, help='number of CPU worker processes (requires --device cpu)')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
     args = parser.parse_args()
-    
-    # Load embeddings (Only load the embeddings that appear in the entity2id file)
-    entity_embeddings_full = np.load(args.entity_embeddings)
+
+    # Load embeddings (Only the embeddings of entities appearing in the training dataset are candidates)
+    entity_embeddings, rows = load_entity_embeddings(args.entity_embeddings, args.entity_rows)
     relation_embeddings = np.load(args.relation_embeddings)
-    entity2id_ori = json.load(open(args.entity2id))
+    entity2id = {key: int(rows[i]) for key, i in json.load(open(args.entity2id)).items()}
     relation2id = json.load(open(args.relation2id))
+    assert entity_embeddings.shape[1] == args.dim and relation_embeddings.shape[1] == args.dim
 
-    entity_embeddings = np.zeros((len(entity2id_ori), args.dim), dtype=np.float32) 
-    entity2id = {}
-    i = 0
-    for key in tqdm(entity2id_ori):
-        entity2id[key] = i
-        entity_embeddings[i] = entity_embeddings_full[entity2id_ori[key]]
-        i += 1
-    
-    # Building the graph 
-    app = gap.KnowledgeGraphApplication(dim=args.dim)
-    app.load(file_name=args.train_dataset)
-    app.build()
-    app.train(model='TransE', num_epoch=0)
-
-    # Load embeddings to graphvite
-    print('load data ......')
-    assert(len(relation_embeddings) == len(app.solver.relation_embeddings))
-    assert(len(entity_embeddings) == len(app.solver.entity_embeddings))
-    app.solver.relation_embeddings[:] = relation_embeddings
-    print('loaded relation embeddings')
-    app.solver.entity_embeddings[:] = entity_embeddings
-    print('loaded entity embeddings')
-    
-    # (Modified gv) Replace mapping with our own
-    app.entity2id = entity2id
-    app.relation2id = relation2id
-    
     print('start evaluation ......')
-    app.evaluate('link_prediction', file_name=args.dataset, filter_files=[args.train_dataset, args.val_dataset, args.dataset])
+    print(evaluate_link_prediction(entity_embeddings, relation_embeddings, entity2id, relation2id, args.dataset,
+                                   graph_files=[args.train_dataset],
+                                   filter_files=[args.train_dataset, args.val_dataset, args.dataset],
+                                   batch_size=args.batch_size, entity_block=args.entity_block,
+                                   score_function=build_score_function(args.ke_model, args.gamma, args.p, args.dim),
+                                   num_workers=args.workers, device=args.device))
 
 if __name__ == '__main__':
     main()
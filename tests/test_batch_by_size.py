@@ -0,0 +1,63 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from collections import OrderedDict
+import unittest
+
+import numpy as np
+import torch
+
+from fairseq.data import (
+    data_utils,
+    ListDataset,
+    NestedDictionaryDataset,
+    RoundRobinZipDatasets,
+    SortDataset,
+)
+
+
+def nested_dataset(sizes):
+    return SortDataset(
+        NestedDictionaryDataset({'x': ListDataset(torch.arange(len(sizes)), sizes)}, sizes=[sizes]),
+        sort_order=[np.random.permutation(len(sizes))],
+    )
+
+
+class TestBatchBySize(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.dataset = RoundRobinZipDatasets(OrderedDict([
+            ('MLM', nested_dataset(rng.randint(1, 60, size=17))),
+            ('KE', nested_dataset(rng.randint(1, 40, size=50))),
+        ]))
+        self.indices = self.dataset.ordered_indices()
+
+    def test_filter_by_size_vec(self):
+        sizes = self.dataset.size_vec(self.indices)
+        self.assertEqual(list(sizes), ['MLM', 'KE'])
+        for max_positions in [(50, 30), (None, 10), (60, 40)]:
+            expected = list(data_utils.filter_by_size(self.indices, self.dataset.size, max_positions))
+            indices = data_utils.filter_by_size_vec(self.indices, sizes, max_positions)
+            self.assertEqual(indices.tolist(), expected)
+        with self.assertRaises(Exception):
+            data_utils.filter_by_size_vec(self.indices, sizes, (50, 30), raise_exception=True)
+
+    def test_batch_by_size_vec(self):
+        num_tokens = self.dataset.num_tokens_vec(self.indices)
+        self.assertEqual(num_tokens.tolist(), [self.dataset.num_tokens(i) for i in self.indices])
+        for max_tokens, max_sentences, mult in [(100, None, 1), (None, 4, 1), (200, 6, 4)]:
+            expected = data_utils.batch_by_size(
+                self.indices, self.dataset.num_tokens, max_tokens, max_sentences, mult,
+            )
+            batches = data_utils.batch_by_size(
+                self.indices, self.dataset.num_tokens, max_tokens, max_sentences, mult,
+                num_tokens_vec=num_tokens,
+            )
+            self.assertEqual(batches, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
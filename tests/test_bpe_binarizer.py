@@ -0,0 +1,93 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import contextlib
+from io import StringIO
+import json
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+from examples.roberta import multiprocessing_bpe_binarizer, multiprocessing_bpe_encoder
+from fairseq import options
+from fairseq.data.encoders.gpt2_bpe_utils import bytes_to_unicode
+
+import preprocess
+
+
+def write_toy_bpe(data_dir):
+    merges = [('a', 'a'), ('Ġ', 'b'), ('aa', 'a'), ('Ġb', 'aa')]
+    encoder = {c: i for i, c in enumerate(bytes_to_unicode().values())}
+    for a, b in merges:
+        encoder[a + b] = len(encoder)
+    with open(os.path.join(data_dir, 'encoder.json'), 'w') as f:
+        json.dump(encoder, f)
+    with open(os.path.join(data_dir, 'vocab.bpe'), 'w', encoding='utf-8') as f:
+        f.write('#version: 0.2\n')
+        for merge in merges:
+            f.write(' '.join(merge) + '\n')
+    # BPE ids of the dictionary, in frequency order; ' ', 'c', ... are <unk>
+    with open(os.path.join(data_dir, 'dict.txt'), 'w') as f:
+        for i, symbol in enumerate(['Ġbaa', 'aaa', 'aa', 'a', 'Ġb', 'b', 'Ġ', '!']):
+            f.write('{} {}\n'.format(encoder[symbol], 100 - i))
+
+
+def write_text(path, num_lines=50):
+    rng = random.Random(0)
+    with open(path, 'w', encoding='utf-8') as f:
+        for _ in range(num_lines):
+            words = [rng.choice(['a', 'aa', 'aaaaa', 'baaa', 'b', 'ab!', 'cé']) for _ in range(rng.randint(0, 6))]
+            f.write(' '.join(words) + '\n')
+
+
+class TestBPEBinarizer(unittest.TestCase):
+
+    def test_same_as_encoder_and_preprocess(self):
+        with contextlib.redirect_stderr(StringIO()):
+            with tempfile.TemporaryDirectory('test_bpe_binarizer') as data_dir:
+                write_toy_bpe(data_dir)
+                write_text(os.path.join(data_dir, 'train.raw'))
+                bpe_args = [
+                    '--encoder-json', os.path.join(data_dir, 'encoder.json'),
+                    '--vocab-bpe', os.path.join(data_dir, 'vocab.bpe'),
+                    '--inputs', os.path.join(data_dir, 'train.raw'),
+                    '--keep-empty',
+                    '--workers', '3',
+                ]
+
+                with mock.patch('sys.argv', ['multiprocessing_bpe_encoder.py'] + bpe_args + [
+                    '--outputs', os.path.join(data_dir, 'train.bpe'),
+                ]):
+                    multiprocessing_bpe_encoder.main()
+                # as preprocess.cli_main (fairseq-preprocess) parses them
+                preprocess_parser = options.get_preprocessing_parser()
+                preprocess_parser.add_argument('--bert', action='store_true')
+                preprocess_args = preprocess_parser.parse_args([
+                    '--only-source',
+                    '--trainpref', os.path.join(data_dir, 'train.bpe'),
+                    '--srcdict', os.path.join(data_dir, 'dict.txt'),
+                    '--destdir', os.path.join(data_dir, 'preprocessed'),
+                    '--dataset-impl', 'mmap',
+                    '--workers', '2',
+                ])
+                preprocess.main(preprocess_args)
+
+                with mock.patch('sys.argv', ['multiprocessing_bpe_binarizer.py'] + bpe_args + [
+                    '--srcdict', os.path.join(data_dir, 'dict.txt'),
+                    '--outputs', os.path.join(data_dir, 'binarized', 'train'),
+                ]):
+                    multiprocessing_bpe_binarizer.main()
+
+                for name in ['train.bin', 'train.idx', 'dict.txt']:
+                    with open(os.path.join(data_dir, 'preprocessed', name), 'rb') as f:
+                        expected = f.read()
+                    with open(os.path.join(data_dir, 'binarized', name), 'rb') as f:
+                        self.assertEqual(f.read(), expected, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
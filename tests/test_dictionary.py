@@ -5,7 +5,9 @@
 
 import tempfile
 import unittest
+from unittest import mock
 
+import numpy as np
 import torch
 
 from fairseq.data import Dictionary
@@ -65,6 +67,40 @@ class TestDictionary(unittest.TestCase):
             assertMatch(reload_ids, ref_ids2)
             assertMatch(finalized_ids, reload_ids)
 
+    def assertEncodeLines(self, d, txt, num_replaced):
+        for append_eos in [True, False]:
+            for reverse_order in [True, False]:
+                ids, replaced = d.encode_lines(txt, append_eos=append_eos, reverse_order=reverse_order)
+                expected = [
+                    d.encode_line(line, add_if_not_exist=False, append_eos=append_eos,
+                                  reverse_order=reverse_order)
+                    for line in txt
+                ]
+                self.assertEqual([t.tolist() for t in ids], [t.tolist() for t in expected])
+                self.assertTrue(all(t.dtype == torch.int32 for t in ids))
+                self.assertEqual(sum(replaced.values()), num_replaced)
+
+    def test_encode_lines(self):
+        words = Dictionary()
+        # '²' and '①' pass str.isdigit() but are not integers
+        for line in ['A B C D', 'B C D ² ①']:
+            words.encode_line(line, add_if_not_exist=True)
+        bpe_ids = Dictionary()
+        for line in ['50256 13', '13 262 0']:
+            bpe_ids.encode_line(line, add_if_not_exist=True)
+        self.assertEqual(bpe_ids.int_symbol_table().tolist()[:14], [7] + [3] * 12 + [5])
+
+        self.assertEncodeLines(words, ['A B E ²', '', 'D <unk> C F E ① 3\n'], 4)
+        self.assertIsNone(words.int_symbol_table())
+
+        # canonical integers only: parsed at once and mapped through int_symbol_table
+        with mock.patch('fairseq.data.dictionary.np.fromstring', wraps=np.fromstring) as fromstring:
+            self.assertEncodeLines(bpe_ids, ['50256 13 7', '', '262 0 13 99999\n'], 2)
+            self.assertTrue(fromstring.called)
+        # '051' is not the symbol '51', so the batch is looked up word by word
+        with mock.patch('fairseq.data.dictionary.np.fromstring', wraps=np.fromstring) as fromstring:
+            self.assertEncodeLines(bpe_ids, ['262 0 13 051', '51 7'], 3)
+            self.assertFalse(fromstring.called)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,71 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import tempfile
+import unittest
+
+from fairseq.data.encoders.gpt2_bpe_utils import Encoder, bytes_to_unicode
+
+
+def toy_encoder(cache_path=None):
+    merges = [('a', 'a'), ('Ġ', 'b'), ('aa', 'a'), ('Ġb', 'aa')]
+    encoder = {c: i for i, c in enumerate(bytes_to_unicode().values())}
+    for a, b in merges:
+        encoder[a + b] = len(encoder)
+    return Encoder(encoder, merges, cache_path=cache_path)
+
+
+class TestGPT2BPE(unittest.TestCase):
+
+    def test_merge(self):
+        bpe = toy_encoder()
+        # every occurrence of the lowest-ranked pair is merged, left to right
+        self.assertEqual(bpe.bpe('aaaaa'), 'aa aaa')
+        self.assertEqual(bpe.bpe('Ġbaa'), 'Ġbaa')
+        self.assertEqual(bpe.bpe('Ġbaaa'), 'Ġb aaa')
+        self.assertEqual(bpe.bpe('ab'), 'a b')
+        self.assertEqual(bpe.decode(bpe.encode(' baaa aaaaa!')), ' baaa aaaaa!')
+
+    def test_persistent_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'cache')
+            bpe = toy_encoder(path)
+            ids = bpe.encode('aaaaa baaa')
+            self.assertEqual(set(bpe.pop_new_words()), {'aaaaa', ' baaa'})
+            bpe.persistent_cache.update({'aaaaa': bpe.token_ids('aaaaa')})
+
+            bpe = toy_encoder(path)
+            self.assertEqual(bpe.encode('aaaaa baaa'), ids)
+            self.assertEqual(list(bpe.pop_new_words()), [' baaa'])
+            bpe.persistent_cache.update({' baaa': bpe.token_ids(' baaa')})
+            name = bpe.persistent_cache.name
+            self.assertTrue(name.startswith('1-'))
+            self.assertEqual(sorted(os.listdir(path)), [
+                'ids.{}.npy'.format(name), 'keys.{}.npy'.format(name), 'meta.json', 'offsets.{}.npy'.format(name),
+            ])
+
+            bpe = toy_encoder(path)
+            self.assertEqual(len(bpe.persistent_cache), 2)
+            self.assertEqual(bpe.encode('aaaaa baaa'), ids)
+            self.assertEqual(bpe.pop_new_words(), {})
+
+    def test_persistent_cache_concurrent_writers(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'cache')
+            first, second = toy_encoder(path), toy_encoder(path)
+            first.persistent_cache.update({'aaaaa': first.token_ids('aaaaa')})
+            # the second writer still maps the empty cache, but merges into the latest one
+            second.persistent_cache.update({' baaa': second.token_ids(' baaa')})
+            self.assertEqual(len(second.persistent_cache), 2)
+
+            cache, bpe = toy_encoder(path).persistent_cache, toy_encoder()
+            self.assertEqual(cache.get('aaaaa'), bpe.token_ids('aaaaa'))
+            self.assertEqual(cache.get(' baaa'), bpe.token_ids(' baaa'))
+            self.assertEqual(len(os.listdir(path)), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from fairseq.ke_ann_index import KeIVFIndex, exhaustive_search, recall_at_k, transe_queries
+
+
+class TestKeIVFIndex(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        centers = rng.randn(10, 8) * 5
+        self.entity = (centers[rng.randint(10, size=300)] + rng.randn(300, 8)).astype(np.float32)
+        self.relation = (rng.randn(4, 8) * 0.1).astype(np.float32)
+        self.triplets = np.stack([rng.randint(300, size=40), rng.randint(4, size=40), rng.randint(300, size=40)], axis=1)
+
+    def test_exhaustive_search(self):
+        queries = transe_queries(self.entity, self.relation, self.triplets, 'head')
+        np.testing.assert_allclose(queries, self.entity[self.triplets[:, 2]] - self.relation[self.triplets[:, 1]])
+        ids, dists = exhaustive_search(self.entity, queries, 5, block_size=7)
+        expected = np.abs(queries[:, None] - self.entity[None]).sum(axis=2)
+        np.testing.assert_allclose(dists, np.sort(expected, axis=1)[:, :5], rtol=1e-5)
+        np.testing.assert_allclose(np.take_along_axis(expected, ids, axis=1), dists, rtol=1e-5)
+
+    def test_search(self):
+        queries = transe_queries(self.entity, self.relation, self.triplets)
+        index = KeIVFIndex.build(self.entity, num_lists=10)
+        self.assertEqual(sorted(index.ids.tolist()), list(range(300)))
+        exact_ids, exact_dists = exhaustive_search(self.entity, queries, 5)
+        # probing every list is exhaustive
+        ids, dists = index.search(self.entity, queries, 5, num_probe=10, batch_size=16)
+        np.testing.assert_allclose(dists, exact_dists, rtol=1e-5)
+        self.assertEqual(recall_at_k(ids, exact_ids), 1.0)
+        self.assertGreater(recall_at_k(index.search(self.entity, queries, 5, num_probe=2)[0], exact_ids), 0.9)
+        with tempfile.TemporaryDirectory() as d:
+            index.save(os.path.join(d, 'index.npz'))
+            loaded = KeIVFIndex.load(os.path.join(d, 'index.npz'))
+        self.assertEqual(loaded.search(self.entity, queries, 5, num_probe=3)[0].tolist(),
+                         index.search(self.entity, queries, 5, num_probe=3)[0].tolist())
+
+    def test_fingerprint(self):
+        index = KeIVFIndex.build(self.entity, num_lists=10)
+        with tempfile.TemporaryDirectory() as d:
+            index.save(os.path.join(d, 'index.npz'))
+            loaded = KeIVFIndex.load(os.path.join(d, 'index.npz'))
+            np.savez(os.path.join(d, 'old.npz'), centroids=index.centroids, offsets=index.offsets, ids=index.ids,
+                     p=index.p)
+            old = KeIVFIndex.load(os.path.join(d, 'old.npz'))
+        self.assertTrue(loaded.matches(self.entity))
+        self.assertTrue(loaded.matches(self.entity.copy()))
+        # appended rows, a different dimension, regenerated embeddings
+        self.assertFalse(loaded.matches(np.concatenate([self.entity, self.entity[:1]])))
+        self.assertFalse(loaded.matches(self.entity[:, :4]))
+        self.assertFalse(loaded.matches(self.entity + 1e-3))
+        # indices saved before fingerprints never match
+        self.assertIsNone(old.fingerprint)
+        self.assertFalse(old.matches(self.entity))
+
+
+if __name__ == '__main__':
+    unittest.main()
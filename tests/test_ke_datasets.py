@@ -0,0 +1,91 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+
+import numpy as np
+import torch
+
+from fairseq.data import KeEntityDataset, KeInBatchNegDataset, KeOnlineNegDataset, ListDataset
+from fairseq.data.ke_online_negative_dataset import (
+    KeCitationNeighbourhood,
+    KeNegativeSampler,
+    KeTrueEntities,
+)
+
+
+def mock_entities(num_entities=5):
+    items = [torch.LongTensor([e] * (e + 1)) for e in range(num_entities)]
+    return ListDataset(items, sizes=np.array([len(x) for x in items]))
+
+
+class TestKeEntityDataset(unittest.TestCase):
+
+    def test_gather_by_entity_id(self):
+        entity_ids = np.array([3, 0, 3, 4], dtype=np.int32)
+        ds = KeEntityDataset(mock_entities(), entity_ids)
+        self.assertEqual(len(ds), 4)
+        for i, e in enumerate(entity_ids):
+            self.assertTrue(torch.equal(ds[i], torch.LongTensor([e] * (e + 1))))
+        self.assertEqual(ds.sizes.tolist(), [4, 1, 4, 5])
+        self.assertEqual(ds.num_tokens(3), 5)
+
+
+class TestKeOnlineNegDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.triples = np.array([[0, 0, 1], [2, 0, 1], [0, 1, 3], [4, 1, 3]])
+        self.true_entities = KeTrueEntities(self.triples, 5, 2)
+
+    def test_true_entities(self):
+        self.assertEqual(self.true_entities.true_heads(0, 1).tolist(), [0, 2])
+        self.assertEqual(self.true_entities.true_tails(0, 1).tolist(), [3])
+        self.assertEqual(self.true_entities.true_tails(1, 1).tolist(), [])
+
+    def test_negatives_are_filtered_and_seeded(self):
+        sampler = KeNegativeSampler(self.true_entities, 5)
+        ds = KeOnlineNegDataset(mock_entities(), self.triples, sampler, 'head-batch', 4, seed=1)
+        negatives = [ds.negative_ids(i) for i in range(len(ds))]
+        for (h, r, t), neg in zip(self.triples, negatives):
+            self.assertEqual(len(neg), 4)
+            self.assertFalse(np.isin(neg, self.true_entities.true_heads(r, t)).any())
+        for i in range(len(ds)):
+            self.assertEqual(ds.negative_ids(i).tolist(), negatives[i].tolist())
+        self.assertEqual(len(ds[0]), 4)
+
+    def test_local_candidates(self):
+        neighbourhood = KeCitationNeighbourhood([
+            {'paper_contexts': [0, 2], 'citations': [1]},
+            {'paper_contexts': [4], 'citations': [1, 3]},
+        ])
+        self.assertEqual(neighbourhood.candidates(1, 'head-batch').tolist(), [0, 2, 4])
+        self.assertEqual(neighbourhood.candidates(4, 'tail-batch').tolist(), [1, 3])
+        sampler = KeNegativeSampler(self.true_entities, 5, neighbourhood)
+        self.assertEqual(sampler.sample(0, 0, 1, 'head-batch', 1).tolist(), [4])
+
+
+
+class TestKeInBatchNegDataset(unittest.TestCase):
+
+    def test_masks_positives_and_known_triples(self):
+        triples = np.array([[0, 0, 1], [2, 0, 1], [0, 1, 3], [0, 0, 4]])
+        true_entities = KeTrueEntities(triples, 5, 2)
+        tails = KeInBatchNegDataset(triples, true_entities, 'tail-batch')
+        # (0, 0, 4) is known, so the tail of the last triple is not a negative of the first
+        self.assertEqual(tails.collater([tails[i] for i in [0, 1, 2, 3]]).tolist(), [
+            [False, False, True, False],
+            [False, False, True, True],
+            [True, True, False, True],
+            [False, False, True, False],
+        ])
+        heads = KeInBatchNegDataset(triples, true_entities, 'head-batch')
+        self.assertEqual(heads.collater([heads[i] for i in [1, 0, 2]]).tolist(), [
+            [False, False, False],
+            [False, False, False],
+            [True, False, False],
+        ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from fairseq.ke_embedding_cache import KeEmbeddingCache, checkpoint_hash, description_hash
+
+
+class TestKeEmbeddingCache(unittest.TestCase):
+
+    def test_append_and_lookup(self):
+        with tempfile.TemporaryDirectory() as d:
+            cache = KeEmbeddingCache(os.path.join(d, 'cache'), dim=3)
+            keys = np.array([description_hash([0, 5, 2]), description_hash([0, 7])], dtype=np.uint64)
+            self.assertEqual(cache.lookup(keys).tolist(), [-1, -1])
+            cache.append(keys[1:], np.ones((1, 3)))
+            cache.append(keys[:1], np.zeros((1, 3)))
+            self.assertEqual(cache.lookup(keys).tolist(), [1, 0])
+
+            # an interrupted append leaves a row without a key, which is dropped
+            with open(os.path.join(d, 'cache', 'emb.bin'), 'ab') as f:
+                np.full(3, 2, dtype=np.float32).tofile(f)
+            cache = KeEmbeddingCache(os.path.join(d, 'cache'))
+            self.assertEqual(len(cache), 2)
+            new_key = description_hash([0, 1])
+            self.assertEqual(cache.append([new_key], np.full((1, 3), 3)).tolist(), [2])
+            cache = KeEmbeddingCache(os.path.join(d, 'cache'))
+            self.assertEqual(cache.lookup([new_key]).tolist(), [2])
+            self.assertEqual(cache.embeddings[:, 0].tolist(), [1, 0, 3])
+
+    def test_checkpoint_hash(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'checkpoint.pt')
+            with open(path, 'wb') as f:
+                f.write(b'weights')
+            first = checkpoint_hash(path)
+            self.assertEqual(checkpoint_hash(path), first)
+            with open(path, 'wb') as f:
+                f.write(b'other weights')
+            self.assertNotEqual(checkpoint_hash(path), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import tempfile
+import unittest
+from collections import defaultdict
+
+import numpy as np
+import torch
+
+from fairseq.data.ke_online_negative_dataset import KeTrueEntities
+from fairseq.ke_link_prediction import (
+    evaluate_link_prediction,
+    link_prediction_metrics,
+    transe_rankings,
+)
+
+
+def graphvite_rankings(entity, relation, triplets, known, target='both', margin=12):
+    """Per-triple loop of graphvite's triplet_prediction (torch backend)."""
+    entity, relation = torch.from_numpy(entity), torch.from_numpy(relation)
+    exclude_H, exclude_T = defaultdict(set), defaultdict(set)
+    for h, r, t in known:
+        exclude_H[(t, r)].add(h)
+        exclude_T[(h, r)].add(t)
+    rankings = []
+    for h, r, t in triplets:
+        if target in ['head', 'both']:
+            score = margin - (entity + relation[r] - entity[t]).norm(p=1, dim=1)
+            mask = torch.ones(len(entity), dtype=torch.bool)
+            mask[list(exclude_H[(t, r)])] = False
+            mask[h] = True
+            rankings.append(torch.sum((score >= score[h]) & mask).item())
+        if target in ['tail', 'both']:
+            score = margin - (entity[h] + relation[r] - entity).norm(p=1, dim=1)
+            mask = torch.ones(len(entity), dtype=torch.bool)
+            mask[list(exclude_T[(h, r)])] = False
+            mask[t] = True
+            rankings.append(torch.sum((score >= score[t]) & mask).item())
+    return np.asarray(rankings)
+
+
+class TestKeLinkPrediction(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.entity = rng.randint(-3, 4, size=(20, 4)).astype(np.float32)  # integers, so ties are exact
+        self.relation = rng.randint(-3, 4, size=(3, 4)).astype(np.float32)
+        self.known = np.stack([rng.randint(20, size=60), rng.randint(3, size=60), rng.randint(20, size=60)], axis=1)
+        self.test = self.known[:25]
+
+    def test_matches_graphvite(self):
+        filters = KeTrueEntities(self.known, 20, 3)
+        for target in ['head', 'tail', 'both']:
+            expected = graphvite_rankings(self.entity, self.relation, self.test, self.known, target)
+            rankings = transe_rankings(self.entity, self.relation, self.test, filters, target, batch_size=7)
+            self.assertEqual(rankings.tolist(), expected.tolist())
+        blocked = transe_rankings(self.entity, self.relation, self.test, filters, 'both', batch_size=4,
+                                  entity_block=3, num_workers=2)
+        self.assertEqual(blocked.tolist(), expected.tolist())
+        raw = transe_rankings(self.entity, self.relation, self.test, None, 'tail')
+        self.assertEqual(raw.tolist(), graphvite_rankings(self.entity, self.relation, self.test, [], 'tail').tolist())
+
+    def test_metrics(self):
+        metrics = link_prediction_metrics([1, 2, 4, 20])
+        self.assertAlmostEqual(metrics['MR'], 6.75)
+        self.assertAlmostEqual(metrics['MRR'], (1 + 1 / 2 + 1 / 4 + 1 / 20) / 4)
+        self.assertEqual((metrics['HITS@1'], metrics['HITS@3'], metrics['HITS@10']), (0.25, 0.5, 0.75))
+
+    def test_evaluate_from_files(self):
+        # names are mapped to shuffled rows of the full embedding matrices
+        entity2id = {'Q%d' % i: (i * 7) % 20 for i in range(20)}
+        relation2id = {'P%d' % i: 2 - i for i in range(3)}
+        entity = np.empty_like(self.entity)
+        entity[[entity2id['Q%d' % i] for i in range(20)]] = self.entity
+        relation = self.relation[::-1].copy()
+        with tempfile.TemporaryDirectory() as d:
+            file_name = os.path.join(d, 'test.txt')
+            with open(file_name, 'w') as f:
+                f.write('# comment\n')
+                for h, r, t in self.known:
+                    f.write('Q%d\tP%d\tQ%d\n' % (h, r, t))
+                f.write('Q0\tP0\tQ99\n')  # unknown entity
+            metrics = evaluate_link_prediction(entity, relation, entity2id, relation2id, file_name,
+                                               graph_files=[file_name], filter_files=[file_name])
+        # every entity appears in the graph, so this is the same as ranking the ids directly
+        used = np.unique(self.known[:, [0, 2]])
+        remap = -np.ones(20, dtype=np.int64)
+        remap[used] = np.arange(len(used))
+        known = np.stack([remap[self.known[:, 0]], self.known[:, 1], remap[self.known[:, 2]]], axis=1)
+        expected = graphvite_rankings(self.entity[used], self.relation, known, known)
+        self.assertEqual(metrics, link_prediction_metrics(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
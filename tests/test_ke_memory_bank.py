@@ -0,0 +1,48 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+
+import numpy as np
+import torch
+
+from fairseq.data import KeTrueEntitiesDataset
+from fairseq.data.ke_online_negative_dataset import KeTrueEntities
+from fairseq.modules import KeMemoryBank
+
+
+class TestKeMemoryBank(unittest.TestCase):
+
+    def test_refresh_and_evict(self):
+        bank = KeMemoryBank(3, 2, momentum=0.5)
+        bank.update(torch.LongTensor([7, 3, 7]), torch.Tensor([[1, 1], [2, 2], [3, 3]]))
+        self.assertEqual(bank.find(torch.LongTensor([3, 7, 5])).tolist(), [0, 1, -1])
+        self.assertEqual(bank.embeddings[1].tolist(), [2, 2])  # mean of the repeated id
+        bank.update(torch.LongTensor([3, 9, 4]), torch.Tensor([[4, 4], [5, 5], [6, 6]]))
+        # 3 is refreshed with momentum, 4 takes the free slot and 9 evicts the stale 7
+        self.assertEqual(bank.keys.tolist(), [3, 9, 4])
+        self.assertEqual(bank.embeddings.tolist(), [[3, 3], [5, 5], [6, 6]])
+        self.assertEqual(bank.updated.tolist(), [2, 2, 2])
+
+    def test_sample(self):
+        bank = KeMemoryBank(4, 2, max_age=1)
+        ids, embs, valid = bank.sample(2, 3)
+        self.assertFalse(valid.any())
+        bank.update(torch.LongTensor([1, 2]), torch.Tensor([[1, 1], [2, 2]]))
+        bank.update(torch.LongTensor([5]), torch.Tensor([[5, 5]]))
+        ids, embs, valid = bank.sample(2, 3)
+        # 1 and 2 are stale
+        self.assertTrue(valid.all())
+        self.assertEqual(ids.unique().tolist(), [5])
+        self.assertEqual(embs.shape, (2, 3, 2))
+
+    def test_true_entities(self):
+        triples = np.array([[0, 0, 1], [2, 0, 1], [0, 0, 3]])
+        ds = KeTrueEntitiesDataset(triples, KeTrueEntities(triples, 4, 1), 'tail-batch')
+        self.assertEqual(ds.collater([ds[i] for i in [1, 2]]).tolist(), [[1, -1], [1, 3]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+import sys
+import tempfile
+import unittest
+from shutil import copyfile
+
+import numpy as np
+
+from fairseq.data import data_utils, indexed_dataset
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'examples', 'KEPLER', 'Pretrain'))
+import KGpreprocessSharded  # noqa: E402
+from ke_dump import binarize_entities  # noqa: E402
+from ke_sampling import NegativeSampler  # noqa: E402
+
+
+JSON_DATA = [
+    {'paper_contexts': [0, 2], 'citations': [1]},
+    {'paper_contexts': [4], 'citations': [1, 3]},
+]
+TRIPLETS = np.array([[0, 0, 1], [2, 0, 1], [0, 1, 3], [4, 1, 3]])
+
+
+class TestNegativeSampler(unittest.TestCase):
+
+    def sample(self, sampler, triplets, mode, nss):
+        with data_utils.numpy_seed(1):
+            return sampler.sample(triplets, mode, nss)
+
+    def test_local(self):
+        sampler = NegativeSampler(JSON_DATA, TRIPLETS, 5, 'local')
+        ok, negatives = self.sample(sampler, TRIPLETS, 'nHead', 1)
+        self.assertEqual(ok.tolist(), [True, True, False, False])
+        self.assertEqual(negatives[:, 0].tolist(), [4, 4, -1, -1])
+        ok, negatives = self.sample(sampler, TRIPLETS, 'nTail', 1)
+        self.assertEqual(ok.tolist(), [False, False, True, True])
+        self.assertEqual(negatives[:, 0].tolist(), [-1, -1, 1, 1])
+
+    def test_global(self):
+        sampler = NegativeSampler(JSON_DATA, TRIPLETS, 5, 'global')
+        ok, negatives = self.sample(sampler, TRIPLETS, 'nHead', 1)
+        self.assertTrue(ok.all())
+        self.assertEqual(negatives[:, 0].tolist(), [4, 4, 2, 2])
+        ok, _ = self.sample(sampler, TRIPLETS, 'nHead', 2)
+        self.assertFalse(ok.any())
+
+    def test_uniform(self):
+        sampler = NegativeSampler(None, TRIPLETS, 5, 'uniform')
+        ok, negatives = self.sample(sampler, TRIPLETS[:1], 'nTail', 4)
+        self.assertEqual(ok.tolist(), [True])
+        self.assertEqual(sorted(negatives[0].tolist()), [0, 2, 3, 4])
+        ok, _ = self.sample(sampler, TRIPLETS[:1], 'nTail', 5)
+        self.assertEqual(ok.tolist(), [False])
+
+    def test_duplicate_triplets_count_once(self):
+        triplets = np.array([[0, 0, 1], [0, 0, 1], [2, 0, 1]])
+        sampler = NegativeSampler(JSON_DATA, triplets, 5, 'global')
+        ok, negatives = self.sample(sampler, triplets[1:], 'nHead', 1)
+        self.assertEqual(ok.tolist(), [True, True])
+        self.assertEqual(negatives[:, 0].tolist(), [4, 4])
+
+
+class TestKGpreprocessSharded(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory('test_ke_preprocess')
+        self.dict_path = os.path.join(self.tmp.name, 'dict.txt')
+        with open(self.dict_path, 'w') as f:
+            for i, word in enumerate('abcde'):
+                f.write('{} {}\n'.format(word, 10 - i))
+        ent_desc = os.path.join(self.tmp.name, 'desc.bpe')
+        with open(ent_desc, 'w') as f:
+            for e in range(8):
+                f.write(' '.join('abcde'[(e + k) % 5] for k in range(e % 3 + 1)) + '\n')
+        os.mkdir(os.path.join(self.tmp.name, 'entity'))
+        binarize_entities(ent_desc, self.dict_path, self.tmp.name)
+        self.entity_prefix = os.path.join(self.tmp.name, 'entity', 'desc')
+        rng = np.random.RandomState(0)
+        self.triplets = np.stack([rng.randint(8, size=40), rng.randint(2, size=40), rng.randint(8, size=40)], axis=1)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def dump(self, name, shards):
+        args = argparse.Namespace(negative_sampling_size=2, seed=3, batch_size=7)
+        sampler = NegativeSampler(None, self.triplets, 8, 'uniform')
+        KGpreprocessSharded.initWorker(sampler, self.entity_prefix, 9, args)
+        paths = {}
+        for shard in shards:
+            paths[shard] = os.path.join(self.tmp.name, '{}_{}'.format(name, shard))
+            KGpreprocessSharded.makeDumpDir(paths[shard])
+            part = self.triplets[shard * 20:(shard + 1) * 20]
+            KGpreprocessSharded.dumpShard('train', shard, paths[shard], part)
+        return paths
+
+    def read(self, path):
+        files = {}
+        for nm in os.listdir(path):
+            for fn in sorted(os.listdir(os.path.join(path, nm))):
+                with open(os.path.join(path, nm, fn), 'rb') as f:
+                    files[(nm, fn)] = f.read()
+        return files
+
+    def test_shards_are_deterministic(self):
+        alone = self.dump('alone', [0])
+        both = self.dump('both', [1, 0])
+        again = self.dump('again', [1])
+        self.assertTrue(len(self.read(alone[0])) > 0)
+        self.assertEqual(self.read(alone[0]), self.read(both[0]))
+        self.assertEqual(self.read(again[1]), self.read(both[1]))
+        self.assertNotEqual(self.read(both[0]), self.read(both[1]))
+
+
+class TestBinarizeEntities(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory('test_ke_preprocess')
+        self.src = os.path.join(self.tmp.name, 'src')
+        os.makedirs(os.path.join(self.src, 'entity'))
+        self.dict_path = os.path.join(self.src, 'dict.txt')
+        with open(self.dict_path, 'w') as f:
+            f.write('a 3\nb 2\n')
+        ent_desc = os.path.join(self.src, 'desc.bpe')
+        with open(ent_desc, 'w') as f:
+            f.write('a b\n\nb\n')
+        binarize_entities(ent_desc, self.dict_path, self.src)
+        # a binarized prefix next to the dict.txt it was encoded with
+        self.prefix = os.path.join(self.src, 'entity', 'desc')
+        copyfile(self.dict_path, os.path.join(self.src, 'entity', 'dict.txt'))
+        self.out = os.path.join(self.tmp.name, 'out')
+        os.makedirs(os.path.join(self.out, 'entity'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_copy_binarized(self):
+        binarize_entities(self.prefix, self.dict_path, self.out, num_entities=3)
+        for path_fn in [indexed_dataset.data_file_path, indexed_dataset.index_file_path]:
+            with open(path_fn(self.prefix), 'rb') as f, \
+                    open(path_fn(os.path.join(self.out, 'entity', 'desc')), 'rb') as g:
+                self.assertEqual(f.read(), g.read())
+
+    def test_too_few_descriptions(self):
+        with self.assertRaises(AssertionError):
+            binarize_entities(self.prefix, self.dict_path, self.out, num_entities=4)
+
+    def test_other_dictionary(self):
+        other = os.path.join(self.tmp.name, 'dict.txt')
+        with open(other, 'w') as f:
+            f.write('b 3\na 2\n')
+        with self.assertRaises(AssertionError):
+            binarize_entities(self.prefix, other, self.out)
+
+
+if __name__ == '__main__':
+    unittest.main()
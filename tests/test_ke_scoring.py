@@ -0,0 +1,145 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import unittest
+
+import numpy as np
+import torch
+
+from fairseq.data.ke_online_negative_dataset import KeTrueEntities
+from fairseq.ke_link_prediction import link_prediction_rankings
+from fairseq.ke_scoring import KE_SCORE_FUNCTIONS, build_score_function
+from fairseq.models.roberta.model import RobertaKnowledgeEmbeddingHead
+
+
+class TestKeScoring(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.functions = [build_score_function(name, gamma=6.0, p=p, dim=8)
+                          for name in sorted(KE_SCORE_FUNCTIONS) for p in [1, 2]]
+
+    def test_blocks_match_dense_scores(self):
+        head, relation, tail = torch.randn(5, 8), torch.randn(5, 8), torch.randn(5, 8)
+        entities = torch.randn(7, 8)
+        for f in self.functions:
+            expected_tails = f(head.unsqueeze(1), relation.unsqueeze(1), entities.unsqueeze(0))
+            expected_heads = f(entities.unsqueeze(0), relation.unsqueeze(1), tail.unsqueeze(1))
+            self.assertTrue(torch.allclose(f.score_tails(head, relation, entities), expected_tails, atol=1e-5))
+            self.assertTrue(torch.allclose(f.score_heads(relation, tail, entities), expected_heads, atol=1e-5))
+            # batched blocks, as used for the true entities
+            batched = f.score_tails(head.unsqueeze(1), relation.unsqueeze(1), tail.unsqueeze(1)).view(-1)
+            self.assertTrue(torch.allclose(batched, f(head, relation, tail), atol=1e-5))
+
+    def test_ke_head_layout(self):
+        # [B, 1, D] positives against [B, K, D] negatives
+        head, relation, tails = torch.randn(3, 1, 8), torch.randn(3, 1, 8), torch.randn(3, 4, 8)
+        transe = build_score_function('TransE', gamma=6.0)
+        self.assertTrue(torch.allclose(transe(head, relation, tails), 6.0 - torch.norm(head + relation - tails, p=2, dim=2)))
+        for f in self.functions:
+            self.assertEqual(f(head, relation, tails).shape, (3, 4))
+
+    def test_ke_head_precision(self):
+        embs = [torch.randn(n, 1, 8) for n in [3, 3, 6, 6, 3, 3]]
+        relations = torch.tensor([0, 2, 1])
+        scores = {}
+        for precision in ['fp32', 'norm', 'native']:
+            args = argparse.Namespace(gamma=6.0, nrelation=3, encoder_embed_dim=8, ke_model='TransE',
+                                      ke_precision=precision)
+            torch.manual_seed(1)
+            head = RobertaKnowledgeEmbeddingHead(args)
+            pScores, nScores = head(*embs, relations)
+            self.assertEqual((pScores.shape, nScores.shape), ((3, 1), (3, 4)))
+            scores[precision] = (pScores, nScores)
+            # on CPU, and in half precision
+            pScores, nScores = head.half()(*[x.half() for x in embs], relations)
+            self.assertEqual(pScores.dtype, torch.float16 if precision == 'native' else torch.float32)
+            self.assertTrue(torch.allclose(pScores.float(), scores[precision][0], atol=0.05))
+        for precision in ['norm', 'native']:
+            self.assertTrue(torch.allclose(scores[precision][0], scores['fp32'][0]))
+            self.assertTrue(torch.allclose(scores[precision][1], scores['fp32'][1]))
+
+    def test_ke_head_precision_in_batch(self):
+        heads, tails, heads_r, tails_r = (torch.randn(3, 1, 8) for _ in range(4))
+        relations = torch.tensor([0, 2, 1])
+        valid = ~torch.eye(3, dtype=torch.bool)
+        in_batch_negatives = {'head': valid, 'tail': valid}
+        scores = {}
+        for ke_model in ['TransE', 'DistMult']:
+            for precision in ['fp32', 'norm', 'native']:
+                args = argparse.Namespace(gamma=6.0, nrelation=3, encoder_embed_dim=8, ke_model=ke_model,
+                                          ke_precision=precision)
+                torch.manual_seed(1)
+                head = RobertaKnowledgeEmbeddingHead(args)
+                _, nScores = head(heads, tails, None, None, heads_r, tails_r, relations,
+                                  in_batch_negatives=in_batch_negatives)
+                self.assertEqual(nScores.shape, (3, 6))
+                self.assertTrue(torch.equal(torch.isinf(nScores), ~valid.repeat(1, 2)))
+                scores[precision] = nScores
+                # on CPU, and in half precision
+                _, nScores = head.half()(heads.half(), tails.half(), None, None, heads_r.half(), tails_r.half(),
+                                         relations, in_batch_negatives=in_batch_negatives)
+                self.assertEqual(nScores.dtype, torch.float16 if precision == 'native' else torch.float32)
+                self.assertTrue(torch.allclose(nScores.float(), scores[precision], atol=0.05))
+            for precision in ['norm', 'native']:
+                self.assertTrue(torch.allclose(scores[precision], scores['fp32']))
+
+    def test_ke_head_negative_modes(self):
+        heads, tails, heads_r, tails_r = (torch.randn(3, 1, 8) for _ in range(4))
+        nHeads, nTails = torch.randn(6, 1, 8), torch.randn(6, 1, 8)
+        relations = torch.tensor([0, 2, 1])
+        args = argparse.Namespace(gamma=6.0, nrelation=3, encoder_embed_dim=8, ke_model='TransE')
+        head = RobertaKnowledgeEmbeddingHead(args)
+        _, nHScores = head(heads, tails, nHeads, None, heads_r, tails_r, relations)
+        _, nTScores = head(heads, tails, None, nTails, heads_r, tails_r, relations)
+        _, nScores = head(heads, tails, nHeads, nTails, heads_r, tails_r, relations)
+        self.assertEqual(nHScores.shape, (3, 2))
+        self.assertTrue(torch.allclose(nScores, torch.cat([nHScores, nTScores], dim=1)))
+
+    def test_rankings(self):
+        rng = np.random.RandomState(0)
+        entity = rng.randn(12, 8).astype(np.float32)
+        relation = rng.randn(2, 8).astype(np.float32)
+        known = np.stack([rng.randint(12, size=30), rng.randint(2, size=30), rng.randint(12, size=30)], axis=1)
+        filters = KeTrueEntities(known, 12, 2)
+        e, r = torch.from_numpy(entity), torch.from_numpy(relation)
+        for f in self.functions:
+            expected = []
+            for h, rel, t in known[:10]:
+                score = f(e, r[rel], e[t])
+                mask = torch.ones(12, dtype=torch.bool)
+                mask[known[(known[:, 1] == rel) & (known[:, 2] == t), 0]] = False
+                expected.append(1 + torch.sum((score >= score[h]) & mask).item())
+                score = f(e[h], r[rel], e)
+                mask = torch.ones(12, dtype=torch.bool)
+                mask[known[(known[:, 0] == h) & (known[:, 1] == rel), 2]] = False
+                expected.append(1 + torch.sum((score >= score[t]) & mask).item())
+            rankings = link_prediction_rankings(entity, relation, known[:10], f, filters, batch_size=4, entity_block=5)
+            self.assertEqual(rankings.tolist(), expected)
+
+    def test_rankings_near_ties(self):
+        # nearly identical entities far from the origin: at p=2 the scores of a large block must be
+        # as exact as that of the true entity, else the ties are broken by rounding
+        rng = np.random.RandomState(0)
+        entity = (100 * rng.randn(1, 8) + 1e-3 * rng.randn(64, 8)).astype(np.float32)
+        relation = np.zeros((1, 8), dtype=np.float32)
+        known = np.stack([np.arange(32), np.zeros(32, dtype=np.int64), np.arange(32, 64)], axis=1)
+        filters = KeTrueEntities(known, 64, 1)
+        e, r = torch.from_numpy(entity), torch.from_numpy(relation)
+        for p in [1, 2]:
+            f = build_score_function('TransE', gamma=6.0, p=p, dim=8)
+            expected = []
+            for h, rel, t in known:
+                score = f(e, r[rel], e[t])
+                expected.append(torch.sum(score >= score[h]).item())
+                score = f(e[h], r[rel], e)
+                expected.append(torch.sum(score >= score[t]).item())
+            rankings = link_prediction_rankings(entity, relation, known, f, filters, batch_size=32, entity_block=64)
+            self.assertEqual(rankings.tolist(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
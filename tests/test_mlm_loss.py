@@ -0,0 +1,78 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import unittest
+from unittest import mock
+
+import torch
+import torch.nn.functional as F
+
+from fairseq.criterions.MLMetKE import MLMetKELoss
+from fairseq.data import Dictionary
+from fairseq.models.roberta import RobertaModel
+
+
+class TestMLMLoss(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        dictionary = Dictionary()
+        for i in range(20):
+            dictionary.add_symbol('w{}'.format(i))
+        self.dictionary = dictionary
+        task = argparse.Namespace(source_dictionary=dictionary, target_dictionary=dictionary)
+        args = argparse.Namespace(encoder_layers=2, encoder_embed_dim=16, encoder_ffn_embed_dim=32,
+                                  encoder_attention_heads=2, max_positions=16)
+        self.model = RobertaModel.build_model(args, task)
+        self.model.eval()
+        self.criterion = MLMetKELoss(args, task)
+
+        self.tokens = torch.randint(dictionary.nspecial, len(dictionary), (3, 10))
+        self.tokens[2, 7:] = dictionary.pad()
+        self.targets = torch.full_like(self.tokens, dictionary.pad())
+        for i, j in [(0, 1), (0, 8), (1, 3), (2, 0), (2, 5)]:
+            self.targets[i, j] = self.tokens[i, j]
+            self.tokens[i, j] = dictionary.unk()
+
+    def sample(self, targets):
+        return {'MLM': {'net_input': {'src_tokens': self.tokens}, 'target': targets}}
+
+    def full_loss(self, targets):
+        logits = self.model(self.tokens)[0]
+        return F.nll_loss(
+            F.log_softmax(logits.view(-1, logits.size(-1)), dim=-1, dtype=torch.float32),
+            targets.view(-1),
+            reduction='mean',
+            ignore_index=self.dictionary.pad(),
+        )
+
+    def test_lm_head_masked_tokens(self):
+        masked_tokens = self.targets.ne(self.dictionary.pad())
+        logits = self.model(self.tokens)[0]
+        masked_logits = self.model(self.tokens, masked_tokens=masked_tokens)[0]
+        self.assertEqual(masked_logits.shape, (5, logits.size(-1)))
+        self.assertTrue(torch.allclose(masked_logits, logits[masked_tokens], atol=1e-6))
+
+    def test_mlm_loss(self):
+        with torch.no_grad():
+            loss, sample_size = self.criterion.MLM_loss(self.model, self.sample(self.targets))
+            self.assertEqual(sample_size, 5)
+            self.assertTrue(torch.allclose(loss, self.full_loss(self.targets), atol=1e-6))
+
+    def test_mlm_loss_without_masked_tokens(self):
+        # nothing to predict: every position is projected, as without masked_tokens
+        targets = torch.full_like(self.targets, self.dictionary.pad())
+        with torch.no_grad(), mock.patch.object(self.model, 'forward', wraps=self.model.forward) as forward:
+            loss, sample_size = self.criterion.MLM_loss(self.model, self.sample(targets))
+            expected = self.full_loss(targets)
+        self.assertIsNone(forward.call_args_list[0][1]['masked_tokens'])
+        self.assertEqual(sample_size, 0)
+        self.assertEqual(loss.shape, expected.shape)
+        self.assertTrue(torch.isnan(loss) and torch.isnan(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()